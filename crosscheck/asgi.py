@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crosscheck.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up. GET /events streams change events,
+# see crosscheckapi.streams
+from crosscheckapi.streams import EventStreamRouter  # noqa: E402
+
+application = EventStreamRouter(django_application)
@@ -0,0 +1,181 @@
+"""Primary / replica database routing
+
+Writes always go to the primary (`default`). Reads go to a healthy
+replica only while ReplicaMiddleware handles a safe request (GET, HEAD,
+OPTIONS) that has not written anything yet, and only if the same client
+did not write during the last DATABASE_ROUTING['STICKY_SECONDS'], so
+clients read their own writes. Management commands, signals outside a
+request and transactions always use the primary.
+
+The end of the stickiness window travels with the client instead of
+living in a worker: a response to a write sets the `primary_until`
+cookie and the `X-Primary-Until` header to it. Browsers send the cookie
+back on their own, other clients echo the header on their next requests.
+
+Replicas are health checked at most every HEALTH_CHECK_INTERVAL seconds
+per process. A replica that fails the check, or lags behind by more than
+MAX_LAG_SECONDS, is skipped until the next check. Checks run on a
+background thread, one per replica at a time, and requests route on the
+last result meanwhile. A replica not checked yet is skipped.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# True while the current request may read from a replica
+replica_reads = ContextVar('replica_reads', default=False)
+
+# Set once the current request wrote to the primary
+wrote = ContextVar('wrote', default=False)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+STICKY_COOKIE = 'primary_until'
+STICKY_HEADER = 'X-Primary-Until'
+
+LAG_SQL = {
+    # 0 when every received WAL record is replayed, even if the primary is idle
+    'postgresql': """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """,
+}
+
+
+class ReplicaHealth:
+    """alias -> (checked at, healthy, lag in seconds), refreshed lazily"""
+
+    def __init__(self):
+        self.checks = {}
+        # Aliases with a check in flight
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def check(self, alias):
+        """Run the health check now. Returns (healthy, lag)"""
+        options = settings.DATABASE_ROUTING
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(LAG_SQL.get(connections[alias].vendor, 'SELECT 0'))
+                lag = float(cursor.fetchone()[0] or 0)
+            healthy = lag <= options['MAX_LAG_SECONDS']
+        except DatabaseError as ex:
+            logger.warning('Replica %s failed its health check: %s', alias, ex)
+            # Drop the broken persistent connection, the next check reconnects
+            connections[alias].close()
+            healthy, lag = False, None
+
+        with self.lock:
+            self.checks[alias] = (time.monotonic(), healthy, lag)
+        return healthy, lag
+
+    def refresh(self, alias):
+        """Body of the background check thread"""
+        try:
+            self.check(alias)
+        finally:
+            # The connection belongs to this thread, which ends here
+            connections[alias].close()
+            with self.lock:
+                self.running.discard(alias)
+
+    def healthy(self, alias):
+        """The last result, never waits for the replica. Starts a check
+        in the background when it is stale and none is running
+        """
+        interval = settings.DATABASE_ROUTING['HEALTH_CHECK_INTERVAL']
+        with self.lock:
+            checked = self.checks.get(alias)
+            start = ((checked is None or time.monotonic() - checked[0] >= interval)
+                     and alias not in self.running)
+            if start:
+                self.running.add(alias)
+        if start:
+            threading.Thread(target=self.refresh, args=(alias,), name=f'check-{alias}', daemon=True).start()
+        return checked is not None and checked[1]
+
+    def clear(self):
+        with self.lock:
+            self.checks.clear()
+
+
+health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    """Django database router, listed in DATABASE_ROUTERS"""
+
+    def db_for_read(self, model, **hints):
+        if not replica_reads.get() or wrote.get():
+            return DEFAULT_DB_ALIAS
+        # Reads inside a transaction must see its writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        replicas = [alias for alias in settings.DATABASE_ROUTING['REPLICAS'] if health.healthy(alias)]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db not in settings.DATABASE_ROUTING['REPLICAS']
+
+
+def sticky(request):
+    """True while the client is inside the stickiness window it was given.
+    Deadlines further out than STICKY_SECONDS are ignored, give or take a
+    second of clock skew between workers
+    """
+    now = time.time()
+    for value in (request.META.get('HTTP_X_PRIMARY_UNTIL'), request.COOKIES.get(STICKY_COOKIE)):
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            continue
+        if now < until <= now + settings.DATABASE_ROUTING['STICKY_SECONDS'] + 1:
+            return True
+    return False
+
+
+class ReplicaMiddleware:
+    """Allows replica reads for safe requests of clients that did not
+    write recently, and starts the stickiness window after a write
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.DATABASE_ROUTING
+        if not options['REPLICAS']:
+            return self.get_response(request)
+
+        reads = replica_reads.set(request.method in SAFE_METHODS and not sticky(request))
+        writes = wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if wrote.get() or request.method not in SAFE_METHODS:
+                until = f"{time.time() + options['STICKY_SECONDS']:.3f}"
+                response[STICKY_HEADER] = until
+                response.set_cookie(STICKY_COOKIE, until, max_age=options['STICKY_SECONDS'],
+                                    secure=request.is_secure(), httponly=True, samesite='Lax')
+        finally:
+            replica_reads.reset(reads)
+            wrote.reset(writes)
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,21 +48,151 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'crosscheckapi.authentication.CachedTokenAuthentication',
+        'crosscheckapi.authentication.SignedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'crosscheckapi.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'crosscheckapi.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Clients not asking for a version get version 1, the responses
+    # existing clients expect, such as the lookup tables sent as a JSON
+    # string. `Accept: application/json; version=2` returns them as objects
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.AcceptHeaderVersioning',
+    'DEFAULT_VERSION': '1',
+    'ALLOWED_VERSIONS': ['1', '2'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10
 }
 
+# Responses of at least MIN_SIZE bytes are compressed with brotli (when
+# installed) or gzip for the clients accepting it. Compressed bodies of
+# versioned lists are kept per ETag, like RESPONSE_CACHE
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'MAX_SIZE': 500,
+    'TTL': 3600,
+}
+
+# Resolved token -> user -> landlord credentials are kept in an
+# in-process LRU, a deleted token or user is only rejected by the other
+# workers once their entry expires after TTL seconds. With several
+# workers set ALIAS to a shared cache in CACHES (memcached, Redis), used
+# instead of the LRU so every worker sees invalidations right away
+AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+    'ALIAS': None,
+}
+
+# Short-lived HMAC signed access tokens plus refresh tokens, checked
+# without a query (`Authorization: Bearer`). When enabled, /login and
+# /register answer with them instead of the stored DRF token. Tokens
+# revoked by another process are honoured within DENYLIST_SECONDS
+SIGNED_TOKENS = {
+    'ENABLED': False,
+    'ACCESS_SECONDS': 900,
+    'REFRESH_SECONDS': 14 * 24 * 3600,
+    'DENYLIST_SECONDS': 30,
+}
+
+# GET /sync re-sends rows changed OVERLAP_SECONDS before the cursor,
+# for transactions still open when it was taken. Tombstones of deleted
+# rows, and with them the cursors, expire after TOMBSTONE_DAYS
+SYNC = {
+    'OVERLAP_SECONDS': 5,
+    'TOMBSTONE_DAYS': 30,
+}
+
+# GET /typeahead answers from per-landlord prefix indexes built on the
+# first lookup. Writes of other processes show up after TTL seconds.
+# The least recently used indexes are evicted beyond MAX_KEYS keys
+TYPEAHEAD = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 50,
+    'TTL': 300,
+    'MAX_KEYS': 1000000,
+}
+
+# Change events streamed at /events by the ASGI application. BACKEND
+# carries them between processes: MemoryBackend within one process,
+# PostgresBackend through LISTEN / NOTIFY. A stream whose client falls
+# QUEUE_SIZE events behind gets one overflow event instead. Idle streams
+# get a ping every HEARTBEAT_SECONDS. The credentials of every stream are
+# checked again every REAUTH_SECONDS, a revoked token is cut off by then
+EVENTS = {
+    'BACKEND': 'crosscheckapi.events.MemoryBackend',
+    'QUEUE_SIZE': 100,
+    'MAX_IDS': 100,
+    'HEARTBEAT_SECONDS': 15,
+    'REAUTH_SECONDS': 120,
+}
+
+# Rendered list responses kept per process, keyed by resource versions.
+# Entries are replaced as soon as a write bumps the version
+RESPONSE_CACHE = {
+    'MAX_SIZE': 2000,
+    'TTL': 3600,
+}
+
+# Number of rows inserted per query by the bulk payment import
+PAYMENT_IMPORT_BATCH_SIZE = 1000
+
+# Most ids accepted by one bulk edit or delete of payments or leases
+BULK_EDIT_MAX_ITEMS = 5000
+
+# Rows removed per statement (and transaction) by `manage.py purge_deleted`
+PURGE_BATCH_SIZE = 1000
+
+# Background jobs run by `manage.py runworker`. POOL is 'thread' or
+# 'process'. Failed attempts are retried after BACKOFF_SECONDS, doubled
+# each time up to MAX_BACKOFF_SECONDS. Running jobs without a heartbeat
+# for STALE_SECONDS are given to another worker
+JOBS = {
+    'POOL': 'thread',
+    'CONCURRENCY': 2,
+    'POLL_SECONDS': 1,
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF_SECONDS': 10,
+    'MAX_BACKOFF_SECONDS': 600,
+    'STALE_SECONDS': 600,
+    'FILES_DIR': BASE_DIR / 'jobs',
+}
+
+# Number of rows fetched per round trip by the streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
+# Per-route request metrics served at /metrics. Requests slower than
+# SLOW_REQUEST_MS are logged with their SQL, None turns the log off
+METRICS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': None,
+    'SLOW_LOG_MAX_QUERIES': 100,
+}
+
 CORS_ORIGIN_WHITELIST = (
     'http://localhost:3000',
     'http://127.0.0.1:3000'
 )
 
+# Lets the front end read and echo the replica stickiness deadline
+CORS_ALLOW_HEADERS = (*default_headers, 'x-primary-until')
+CORS_EXPOSE_HEADERS = ('X-Primary-Until',)
+
 MIDDLEWARE = [
+    'crosscheckapi.metrics.MetricsMiddleware',
+    'crosscheckapi.compression.CompressionMiddleware',
+    'crosscheck.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -117,6 +248,29 @@ DATABASES = {
     }
 }
 
+# Read replicas, same keys as DATABASES['default'], for example
+# {'replica': {**DATABASES['default'], 'HOST': 'replica.local'}}.
+# Locally a copy of a SQLite file can stand in for a replica
+DATABASE_REPLICAS = {}
+DATABASES.update(DATABASE_REPLICAS)
+
+# Keep connections open between requests instead of reconnecting each time
+for database in DATABASES.values():
+    database.setdefault('CONN_MAX_AGE', 60)
+
+DATABASE_ROUTERS = ['crosscheck.routers.PrimaryReplicaRouter']
+
+# Safe requests read from a healthy replica unless the client wrote in
+# the last STICKY_SECONDS. Replicas lagging more than MAX_LAG_SECONDS are
+# skipped. The stickiness window is carried by the client, in the
+# primary_until cookie or the X-Primary-Until header a write answers with
+DATABASE_ROUTING = {
+    'REPLICAS': list(DATABASE_REPLICAS),
+    'STICKY_SECONDS': 5,
+    'MAX_LAG_SECONDS': 5,
+    'HEALTH_CHECK_INTERVAL': 10,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
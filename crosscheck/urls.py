@@ -1,18 +1,25 @@
 from django.conf.urls import include
 from django.urls import path
 from rest_framework import routers
-from crosscheckapi.views import register_user, login_user
-from crosscheckapi.views import Tenants, Payments, Properties, PaymentTypes
+from crosscheckapi.views import register_user, login_user, refresh_token, revoke_token, metrics
+from crosscheckapi.views import Tenants, Payments, Properties, PaymentTypes, Ledger, Jobs, Sync, Typeahead
 
 router = routers.DefaultRouter(trailing_slash=False)
 router.register(r'tenants', Tenants, 'tenant')
 router.register(r'payments', Payments, 'payment')
 router.register(r'properties', Properties, 'property')
 router.register(r'paymenttypes', PaymentTypes, 'paymenttype')
+router.register(r'ledger', Ledger, 'ledger')
+router.register(r'jobs', Jobs, 'job')
+router.register(r'sync', Sync, 'sync')
+router.register(r'typeahead', Typeahead, 'typeahead')
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('register', register_user),
-    path('login', login_user),
+    path('register', register_user, name='register'),
+    path('login', login_user, name='login'),
+    path('token/refresh', refresh_token, name='token-refresh'),
+    path('token/revoke', revoke_token, name='token-revoke'),
+    path('metrics', metrics, name='metrics'),
     path('api-auth', include('rest_framework.urls', namespace='rest_framework')),
 ]
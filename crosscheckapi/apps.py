@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CrosscheckapiConfig(AppConfig):
     name = 'crosscheckapi'
+
+    def ready(self):
+        from crosscheckapi import signals, tasks  # noqa: F401
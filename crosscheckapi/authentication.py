@@ -0,0 +1,187 @@
+"""Token authentication that resolves the landlord along with the user"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from crosscheckapi import tokens
+from crosscheckapi.models import Landlord
+
+
+class TTLCache:
+    """Bounded in-process LRU whose entries expire after `ttl` seconds"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class CredentialCache:
+    """token key -> (user, token, landlord)
+
+    Kept in the shared Django cache AUTH_CACHE['ALIAS'] when one is
+    configured, so a token, user or landlord invalidated by any worker
+    is rejected by all of them right away. There is no in-process copy
+    in front of it, which other workers could not invalidate. Without an
+    ALIAS, entries live in an in-process LRU, and only the process that
+    made the change drops them before TTL.
+    """
+
+    def __init__(self):
+        options = settings.AUTH_CACHE
+        self.local = TTLCache(options['MAX_SIZE'], options['TTL'])
+        self.ttl = options['TTL']
+        self.alias = options.get('ALIAS')
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def key(self, token_key):
+        return f'crosscheck:auth:{token_key}'
+
+    def get(self, token_key):
+        if self.shared is not None:
+            return self.shared.get(self.key(token_key))
+        return self.local.get(token_key)
+
+    def set(self, token_key, value):
+        if self.shared is not None:
+            self.shared.set(self.key(token_key), value, self.ttl)
+        else:
+            self.local.set(token_key, value)
+
+    def invalidate(self, token_key):
+        if self.shared is not None:
+            self.shared.delete(self.key(token_key))
+        self.local.delete(token_key)
+
+    def invalidate_user(self, user_id):
+        for token_key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+            self.invalidate(token_key)
+
+    def clear(self):
+        self.local.clear()
+
+
+credentials = CredentialCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """DRF token authentication that also sets `request.landlord`
+
+    The token, its user and the user's landlord are loaded with one
+    query and then served from `credentials` until the entry expires
+    or the token, user or landlord changes.
+    """
+
+    def authenticate(self, request):
+        self.landlord = None
+        result = super().authenticate(request)
+        if result is not None:
+            request.landlord = self.landlord
+        return result
+
+    def authenticate_credentials(self, key):
+        cached = credentials.get(key)
+        if cached is None:
+            try:
+                token = Token.objects.select_related('user__landlord').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+
+            try:
+                landlord = token.user.landlord
+            except Landlord.DoesNotExist:
+                landlord = None
+
+            cached = (token.user, token, landlord)
+            credentials.set(key, cached)
+
+        user, token, self.landlord = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, token)
+
+
+class TokenUser:
+    """`request.user` of a signed token: the id, without loading the
+    row. Building an unsaved User would cost more than checking the token
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, user_id):
+        self.id = self.pk = user_id
+
+    def __str__(self):
+        return f'user {self.id}'
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """`Authorization: Bearer <access token>`, see crosscheckapi.tokens
+
+    Checked without a query: `request.user` is a TokenUser and
+    `request.landlord` an unsaved Landlord carrying the ids from the
+    token, which is all the views use. Ignored unless
+    SIGNED_TOKENS['ENABLED'].
+    """
+    keyword = b'bearer'
+
+    def authenticate(self, request):
+        if not settings.SIGNED_TOKENS['ENABLED']:
+            return None
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword:
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            claims = tokens.decode(auth[1].decode('latin-1'))
+        except tokens.InvalidToken as ex:
+            raise exceptions.AuthenticationFailed(str(ex))
+
+        user = TokenUser(claims.user_id)
+        # Positional (id, user) arguments skip the slow keyword path of Model()
+        request.landlord = Landlord(claims.landlord_id, claims.user_id) if claims.landlord_id else None
+        return (user, claims)
+
+    def authenticate_header(self, request):
+        return 'Bearer'
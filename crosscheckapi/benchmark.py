@@ -0,0 +1,31 @@
+"""Measurement helpers shared by the benchmark commands"""
+from contextlib import contextmanager
+from django.db import connection
+
+
+class QueryCounter:
+    """Counts the queries run on the default connection"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """with count_queries() as queries: ... queries.count"""
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
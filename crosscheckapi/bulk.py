@@ -0,0 +1,318 @@
+"""Batched edits and deletes of payments and leases
+
+Ownership of every id is checked with one query and the tenants and
+payment types the changes point to with one more each. Changes are
+written with bulk_update, one statement per set of changed fields, and
+deletes with one DELETE per batch, all inside a single transaction.
+Invalid items are reported back and skipped, like rows of the import.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+from crosscheckapi.importer import MAX_REPORTED_ERRORS, RowError, parse_amount, parse_date
+from crosscheckapi.models import LedgerEntry, Payment, PaymentType, Tenant, TenantPropertyRel
+from crosscheckapi.signals import bulk_deleted, bulk_saved
+
+# Rows per statement. bulk_update adds a CASE branch per row and field
+BATCH_SIZE = 500
+
+
+class Report:
+    """Per-item errors, reported like the rows of the bulk import"""
+
+    def __init__(self):
+        self.errors = []
+        self.error_count = 0
+
+    def add(self, item_id, reason):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"id": item_id, "reason": reason})
+
+    def result(self, **counts):
+        return {**counts, "error_count": self.error_count, "errors": self.errors}
+
+
+def check_size(items):
+    """The whole request is rejected when it is not a list or too long"""
+    if not isinstance(items, list):
+        raise ValueError('Send a list')
+    if len(items) > settings.BULK_EDIT_MAX_ITEMS:
+        raise ValueError(f'Send at most {settings.BULK_EDIT_MAX_ITEMS} items')
+    return items
+
+
+def body_ids(data):
+    """The ids of a bulk DELETE body, {"ids": [...]} or a bare list"""
+    if isinstance(data, dict):
+        return data.get('ids')
+    return data
+
+
+def parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'Invalid id: {value}')
+
+
+def referenced_ids(items, *fields):
+    """Ids found under any of `fields`, to resolve them with one query"""
+    ids = set()
+    for item in items:
+        for field in fields:
+            try:
+                ids.add(int(item[field]))
+            except (KeyError, TypeError, ValueError):
+                pass
+    return ids
+
+
+def owned_changes(items, owned, report):
+    """Pair every valid item with its row from `owned` (id -> instance).
+    Ids that are unknown, belong to another landlord or repeat are errors
+    """
+    seen = set()
+    for item in items:
+        item_id = item.get('id') if isinstance(item, dict) else None
+        try:
+            if not isinstance(item, dict):
+                raise RowError('Malformed item')
+            pk = parse_id(item_id)
+            if pk in seen:
+                raise RowError(f'Duplicate id: {pk}')
+            seen.add(pk)
+            if pk not in owned:
+                raise RowError(f'Not found: {pk}')
+        except RowError as ex:
+            report.add(item_id, str(ex))
+            continue
+        yield item, owned[pk]
+
+
+def apply(instance, values):
+    """Set the values that differ. Returns the names of the changed fields"""
+    changed = [name for name, value in values.items() if getattr(instance, name) != value]
+    for name in changed:
+        setattr(instance, name, values[name])
+    return changed
+
+
+def write(model, changes):
+    """bulk_update each group of rows with the fields it changed only.
+    `updated_at`, which bulk_update does not set, is one plain UPDATE
+    per batch: as a bulk_update field it would add a CASE branch per row
+    """
+    by_fields = defaultdict(list)
+    for instance, fields in changes:
+        by_fields[tuple(sorted(fields))].append(instance)
+    for fields, instances in by_fields.items():
+        model.objects.bulk_update(instances, fields, batch_size=BATCH_SIZE)
+
+    ids = [instance.pk for instance, _ in changes]
+    for chunk in range(0, len(ids), BATCH_SIZE):
+        model._base_manager.filter(pk__in=ids[chunk:chunk + BATCH_SIZE]).update(updated_at=timezone.now())
+
+
+def payment_values(item, tenants, payment_types):
+    """Attribute values of the fields present in one PATCH item"""
+    values = {}
+    if 'date' in item:
+        values['date'] = parse_date(item['date'])
+    if 'amount' in item:
+        values['amount'] = parse_amount(item['amount'])
+    if 'ref_num' in item:
+        ref_num = str(item['ref_num'] or '')
+        if len(ref_num) > Payment._meta.get_field('ref_num').max_length:
+            raise RowError('ref_num is too long')
+        values['ref_num'] = ref_num
+
+    tenant = item.get('tenant', item.get('full_name'))
+    if tenant is not None:
+        tenant_id = parse_id(tenant)
+        if tenant_id not in tenants:
+            raise RowError(f'Unknown tenant: {tenant_id}')
+        values['tenant_id'] = tenant_id
+    if 'type' in item:
+        type_id = parse_id(item['type'])
+        if type_id not in payment_types:
+            raise RowError(f'Unknown payment type: {type_id}')
+        values['payment_type_id'] = type_id
+
+    if not values:
+        raise RowError('Nothing to change')
+    return values
+
+
+def edit_payments(items, landlord):
+    """Apply per-item field changes, e.g. [{"id": 4, "amount": 950}],
+    to payments of `landlord`
+    Returns:
+        dict -- number of updated payments and the per-item errors
+    """
+    items = check_size(items)
+    report = Report()
+
+    owned = Payment.objects.filter(landlord=landlord).in_bulk(referenced_ids(items, 'id'))
+    tenants = Tenant.objects.filter(landlord=landlord).in_bulk(
+        referenced_ids(items, 'tenant', 'full_name'))
+    payment_types = PaymentType.objects.in_bulk()
+
+    changes = []
+    moved_from = set()
+    for item, payment in owned_changes(items, owned, report):
+        previous_tenant = payment.tenant_id
+        try:
+            fields = apply(payment, payment_values(item, tenants, payment_types))
+        except RowError as ex:
+            report.add(item['id'], str(ex))
+            continue
+        if fields:
+            changes.append((payment, fields))
+        if payment.tenant_id != previous_tenant:
+            moved_from.add(previous_tenant)
+
+    with transaction.atomic():
+        write(Payment, changes)
+        if changes:
+            # bulk_update skips post_save, let the derived data catch up
+            bulk_saved.send(
+                sender=Payment, landlord=landlord,
+                queryset=Payment.objects.filter(pk__in=[payment.pk for payment, _ in changes]),
+                tenant_ids=moved_from
+            )
+
+    return report.result(updated=len(changes))
+
+
+def lease_values(item, lease, tenants):
+    """Attribute values of the fields present in one PATCH item"""
+    values = {}
+    if 'lease_start' in item:
+        values['lease_start'] = parse_date(item['lease_start'])
+    if 'lease_end' in item:
+        values['lease_end'] = parse_date(item['lease_end'])
+    if 'rent' in item:
+        values['rent'] = parse_amount(item['rent'])
+    if 'tenant' in item:
+        tenant_id = parse_id(item['tenant'])
+        if tenant_id not in tenants:
+            raise RowError(f'Unknown tenant: {tenant_id}')
+        values['tenant_id'] = tenant_id
+
+    if not values:
+        raise RowError('Nothing to change')
+    if values.get('lease_start', lease.lease_start) > values.get('lease_end', lease.lease_end):
+        raise RowError('lease_start is after lease_end')
+    return values
+
+
+def edit_leases(items, landlord):
+    """Apply per-item field changes, e.g. [{"id": 2, "rent": 1200}],
+    to leases on properties of `landlord`
+    Returns:
+        dict -- number of updated leases and the per-item errors
+    """
+    items = check_size(items)
+    report = Report()
+
+    owned = TenantPropertyRel.objects.filter(
+        rented_property__landlord=landlord).in_bulk(referenced_ids(items, 'id'))
+    tenants = Tenant.objects.filter(landlord=landlord).in_bulk(referenced_ids(items, 'tenant'))
+
+    changes = []
+    for item, lease in owned_changes(items, owned, report):
+        try:
+            fields = apply(lease, lease_values(item, lease, tenants))
+        except RowError as ex:
+            report.add(item['id'], str(ex))
+            continue
+        if fields:
+            changes.append((lease, fields))
+
+    with transaction.atomic():
+        write(TenantPropertyRel, changes)
+        if changes:
+            bulk_saved.send(
+                sender=TenantPropertyRel, landlord=landlord,
+                queryset=TenantPropertyRel.objects.filter(pk__in=[lease.pk for lease, _ in changes])
+            )
+
+    return report.result(updated=len(changes))
+
+
+def owned_ids(ids, owned, report):
+    """The ids of `owned` (id -> tenant id) in request order, reporting the rest"""
+    found = []
+    seen = set()
+    for item_id in ids:
+        try:
+            pk = parse_id(item_id)
+            if pk in seen:
+                raise RowError(f'Duplicate id: {pk}')
+            seen.add(pk)
+            if pk not in owned:
+                raise RowError(f'Not found: {pk}')
+        except RowError as ex:
+            report.add(item_id, str(ex))
+            continue
+        found.append(pk)
+    return found
+
+
+def raw_delete(queryset):
+    """One DELETE without collecting the rows or sending post_delete
+    for each of them. Callers remove dependent rows first and bring
+    the derived data up to date
+    """
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def delete_rows(model, queryset, ids, landlord, dependents=()):
+    """Delete the rows of `queryset` whose ids are listed, in batches"""
+    ids = check_size(ids)
+    report = Report()
+
+    wanted = set()
+    for item_id in ids:
+        try:
+            wanted.add(int(item_id))
+        except (TypeError, ValueError):
+            pass
+    owned = dict(queryset.filter(pk__in=wanted).values_list('id', 'tenant_id'))
+    found = owned_ids(ids, owned, report)
+
+    with transaction.atomic():
+        for chunk in range(0, len(found), BATCH_SIZE):
+            batch = found[chunk:chunk + BATCH_SIZE]
+            for dependent, field in dependents:
+                dependent.objects.filter(**{f'{field}__in': batch}).delete()
+            raw_delete(model.objects.filter(pk__in=batch))
+        if found:
+            bulk_deleted.send(
+                sender=model, landlord=landlord,
+                ids=found, tenant_ids={owned[pk] for pk in found}
+            )
+
+    return report.result(deleted=len(found))
+
+
+def delete_payments(ids, landlord):
+    """Delete payments of `landlord` by id
+    Returns:
+        dict -- number of deleted payments and the per-item errors
+    """
+    return delete_rows(Payment, Payment.objects.filter(landlord=landlord), ids, landlord)
+
+
+def delete_leases(ids, landlord):
+    """Delete leases on properties of `landlord` by id, with their
+    ledger entries
+    Returns:
+        dict -- number of deleted leases and the per-item errors
+    """
+    return delete_rows(
+        TenantPropertyRel,
+        TenantPropertyRel.objects.filter(rented_property__landlord=landlord),
+        ids, landlord, dependents=[(LedgerEntry, 'lease_id')])
@@ -0,0 +1,85 @@
+"""Negotiated compression of large response bodies
+
+Clients sending `Accept-Encoding: br` get brotli when the brotli package
+is installed, `gzip` otherwise. Bodies under COMPRESSION['MIN_SIZE'] and
+streamed exports are left alone. Lists served by `versioned` views
+carry an ETag, their compressed bodies are kept in `compressed` so a
+10,000 row list is only compressed once per change.
+"""
+import gzip
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from crosscheckapi.authentication import TTLCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+compressed = TTLCache(settings.COMPRESSION['MAX_SIZE'], settings.COMPRESSION['TTL'])
+
+
+def accepted(header):
+    """Codings of an Accept-Encoding header the client did not refuse"""
+    codings = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q=') and quality[2:].strip('0.') == '':
+            continue
+        codings.add(coding.strip().lower())
+    return codings
+
+
+def negotiate(header):
+    """The coding to answer with, None for the identity"""
+    codings = accepted(header)
+    if brotli is not None and ('br' in codings or '*' in codings):
+        return 'br'
+    if 'gzip' in codings or '*' in codings:
+        return 'gzip'
+    return None
+
+
+def compress(content, coding):
+    options = settings.COMPRESSION
+    if coding == 'br':
+        return brotli.compress(content, quality=options['BROTLI_QUALITY'])
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(content, options['GZIP_LEVEL'], mtime=0)
+
+
+class CompressionMiddleware:
+    """Compresses rendered bodies for the clients accepting it"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.streaming or response.has_header('Content-Encoding')
+                or len(response.content) < settings.COMPRESSION['MIN_SIZE']):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        etag = response.get('ETag')
+        key = (etag, request.get_full_path(), coding) if etag and response.status_code == 200 else None
+        content = compressed.get(key) if key else None
+        if content is None:
+            content = compress(response.content, coding)
+            if len(content) >= len(response.content):
+                return response
+            if key:
+                compressed.set(key, content)
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = coding
+        # The compressed bytes differ, the representation does not
+        if etag and etag.startswith('"'):
+            response['ETag'] = f'W/{etag}'
+        return response
@@ -0,0 +1,206 @@
+"""Live change events per landlord, streamed to clients at /events
+
+Writes to tenants, properties, leases and payments publish a compact
+event once their transaction commits:
+
+    {"resource": "payments", "action": "saved", "ids": [4, 5]}
+
+`ids` is left out when more than EVENTS['MAX_IDS'] rows changed, the
+client then refetches (GET /sync) instead.
+
+The backend (EVENTS['BACKEND']) carries events between processes:
+MemoryBackend only within the process, enough for a single server and
+for tests, PostgresBackend through LISTEN / NOTIFY. Every process
+hands the events it receives to its `hub`, which fans them out to the
+open streams of the landlord.
+
+Each stream owns a queue of at most EVENTS['QUEUE_SIZE'] events. A
+client reading too slowly to keep up is not waited for: its queue is
+emptied and it receives a single `overflow` event asking it to refetch.
+An idle stream is a coroutine waiting on an empty queue, nothing runs
+for it but a heartbeat comment every HEARTBEAT_SECONDS.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Sent instead of the events dropped from a full queue
+OVERFLOW = {"action": "overflow"}
+
+
+class Subscription:
+    """One open stream: a bounded queue filled from any thread and
+    drained by a coroutine on `loop`
+    """
+
+    def __init__(self, landlord_id, loop, size):
+        self.landlord_id = landlord_id
+        self.loop = loop
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+    def push(self, event):
+        """Runs on the subscription's loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Everything queued is stale now, one event says so
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+            self.overflowed = True
+
+    async def next(self):
+        event = await self.queue.get()
+        if event is OVERFLOW:
+            self.overflowed = False
+        return event
+
+
+class Hub:
+    """landlord id -> open subscriptions of this process"""
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, landlord_id, loop=None):
+        subscription = Subscription(
+            landlord_id, loop or asyncio.get_event_loop(), settings.EVENTS['QUEUE_SIZE'])
+        with self.lock:
+            self.subscriptions[landlord_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.landlord_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.landlord_id]
+
+    def listening(self, landlord_id=None):
+        with self.lock:
+            if landlord_id is None:
+                return bool(self.subscriptions)
+            return landlord_id in self.subscriptions
+
+    def deliver(self, landlord_id, event):
+        """Queue `event` on every stream of the landlord. Safe to call
+        from any thread, the queues are only touched on their loops
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(landlord_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # The loop closed under a stream that did not unsubscribe
+                self.unsubscribe(subscription)
+
+    def clear(self):
+        with self.lock:
+            self.subscriptions.clear()
+
+
+hub = Hub()
+
+
+class MemoryBackend:
+    """Events stay in this process"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def listening(self, landlord_id=None):
+        return self.hub.listening(landlord_id)
+
+    def publish(self, landlord_id, event):
+        self.hub.deliver(landlord_id, event)
+
+    def start(self):
+        pass
+
+
+class PostgresBackend:
+    """Events travel as NOTIFY on the `crosscheck_events` channel, which
+    PostgreSQL delivers on commit. Every process with open streams runs
+    one thread listening on its own connection
+    """
+    channel = 'crosscheck_events'
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def listening(self, landlord_id=None):
+        # Streams of other processes are not known here
+        return True
+
+    def publish(self, landlord_id, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps([landlord_id, event])])
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.listen, name='events', daemon=True)
+                self.thread.start()
+
+    def listen(self):
+        wrapper = connections['default']
+        listener = wrapper.get_new_connection(wrapper.get_connection_params())
+        listener.autocommit = True
+        with listener.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        try:
+            while True:
+                if select.select([listener], [], [], settings.EVENTS['HEARTBEAT_SECONDS']) == ([], [], []):
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    notify = listener.notifies.pop(0)
+                    landlord_id, event = json.loads(notify.payload)
+                    self.hub.deliver(landlord_id, event)
+        except Exception:
+            logger.exception('Lost the event listener connection')
+        finally:
+            listener.close()
+
+
+backend = None
+
+
+def get_backend():
+    global backend
+    if backend is None:
+        backend = import_string(settings.EVENTS['BACKEND'])(hub)
+    return backend
+
+
+def listening(landlord_id=None):
+    """False when no stream could receive the event, to skip the work"""
+    return get_backend().listening(landlord_id)
+
+
+def publish(landlord_id, resource, action, ids=None):
+    """Send one event to the streams of the landlord once the current
+    transaction commits. Without `ids` clients refetch the resource
+    """
+    event = {"resource": resource, "action": action}
+    if ids is not None:
+        ids = list(ids)
+        if len(ids) <= settings.EVENTS['MAX_IDS']:
+            event["ids"] = ids
+    transaction.on_commit(lambda: get_backend().publish(landlord_id, event))
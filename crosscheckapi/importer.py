@@ -0,0 +1,186 @@
+"""Streaming bulk import of payments"""
+import csv
+import json
+import math
+import re
+from datetime import date
+from itertools import chain
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from crosscheckapi.models import Payment, PaymentType, Tenant
+from crosscheckapi.signals import bulk_saved
+
+# Only the first errors are reported back, the rest are counted
+MAX_REPORTED_ERRORS = 1000
+
+# Bytes that are not UTF-8, as kept by the surrogateescape error handler
+UNDECODABLE = re.compile('[\udc80-\udcff]')
+
+
+class RowError(Exception):
+    """A row that can not be imported"""
+
+
+def parse_date(value):
+    """Dates come from the client as `YYYY-MM-DD` or a full datetime string.
+    Splitting the datetime string on the T keeps the date
+    """
+    try:
+        return date.fromisoformat(str(value).split('T')[0].strip())
+    except ValueError:
+        raise RowError(f'Invalid date: {value}')
+
+
+def parse_amount(value):
+    """Amounts are stored as integers. The user may include a $
+    or thousands separators, which are stripped before converting
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        pass
+    try:
+        amount = float(str(value).replace('$', '').replace(',', '').strip())
+    except ValueError:
+        raise RowError(f'Invalid amount: {value}')
+    # inf and nan parse as floats but are no amounts
+    if not math.isfinite(amount):
+        raise RowError(f'Invalid amount: {value}')
+    return int(amount)
+
+
+def read_lines(stream, chunk_size=64 * 1024):
+    """Split a binary stream into lines, reading it in large chunks"""
+    if stream is None:
+        return
+    buffer = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (buffer + chunk).split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if buffer:
+        yield buffer
+
+
+def read_rows(stream, content_type):
+    """Yield one dict per line of a CSV or NDJSON request body
+    without reading the whole body into memory. A leading byte order mark
+    is skipped, rows that are not valid UTF-8 are yielded as RowError
+    """
+    lines = read_lines(stream)
+    first = next(lines, b'')
+    if first.startswith(b'\xef\xbb\xbf'):
+        first = first[3:]
+    lines = (line.decode('utf-8', 'surrogateescape') for line in chain([first], lines))
+
+    if content_type == 'text/csv':
+        for row in csv.DictReader(lines):
+            if any(isinstance(value, str) and UNDECODABLE.search(value) for value in row.values()):
+                yield RowError('Not valid UTF-8')
+            else:
+                yield row
+        return
+
+    for line in lines:
+        if not line.strip():
+            continue
+        if UNDECODABLE.search(line):
+            yield RowError('Not valid UTF-8')
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def build_payment(row, landlord, tenants, payment_types):
+    """Turn one parsed row into an unsaved Payment"""
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError('Malformed row')
+    try:
+        tenant_id = int(row.get('tenant') or row.get('full_name'))
+        type_id = int(row['type'])
+        ref_num = row['ref_num']
+        payment = Payment(
+            date=parse_date(row['date']),
+            amount=parse_amount(row['amount']),
+        )
+    except KeyError as ex:
+        raise RowError(f'Missing field: {ex.args[0]}')
+    except (TypeError, ValueError):
+        raise RowError('tenant and type must be ids')
+
+    if tenant_id not in tenants:
+        raise RowError(f'Unknown tenant: {tenant_id}')
+    if type_id not in payment_types:
+        raise RowError(f'Unknown payment type: {type_id}')
+
+    payment.ref_num = ref_num or ''
+    payment.tenant = tenants[tenant_id]
+    payment.payment_type = payment_types[type_id]
+    payment.landlord = landlord
+    return payment
+
+
+def import_payments(rows, landlord, batch_size=None):
+    """Insert payments from an iterable of row dicts in batches
+
+    Each batch resolves its tenants with one query, payment types are
+    loaded once, and everything is inserted in a single transaction.
+    Returns:
+        dict -- number of created rows and the per-row errors
+    """
+    batch_size = batch_size or settings.PAYMENT_IMPORT_BATCH_SIZE
+    payment_types = PaymentType.objects.in_bulk()
+    created = 0
+    errors = []
+    error_count = 0
+
+    def flush(batch):
+        nonlocal error_count
+        tenant_ids = set()
+        for _, row in batch:
+            try:
+                tenant_ids.add(int(row.get('tenant') or row.get('full_name')))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        tenants = Tenant.objects.filter(landlord=landlord).in_bulk(tenant_ids)
+
+        payments = []
+        for number, row in batch:
+            try:
+                payments.append(build_payment(row, landlord, tenants, payment_types))
+            except RowError as ex:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": number, "reason": str(ex)})
+
+        Payment.objects.bulk_create(payments, batch_size=batch_size)
+        return len(payments)
+
+    with transaction.atomic():
+        last_id = Payment.objects.aggregate(Max('id'))['id__max'] or 0
+
+        batch = []
+        for number, row in enumerate(rows, start=1):
+            batch.append((number, row))
+            if len(batch) >= batch_size:
+                created += flush(batch)
+                batch = []
+        if batch:
+            created += flush(batch)
+
+        # bulk_create skips post_save, let the derived data catch up
+        bulk_saved.send(
+            sender=Payment, landlord=landlord,
+            queryset=Payment.objects.filter(landlord=landlord, id__gt=last_id)
+        )
+
+    return {"created": created, "error_count": error_count, "errors": errors}
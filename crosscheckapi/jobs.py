@@ -0,0 +1,210 @@
+"""Database backed background jobs, no broker needed
+
+The API enqueues rows in the Job table and answers right away. Workers
+started with `manage.py runworker` claim due jobs, run the handler
+registered for their kind in a thread or process pool and store the
+result, which clients poll at GET /jobs/{id}.
+
+Claiming uses SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it, so workers never wait for each other. SQLite has no row
+locks: there every job is claimed with a conditional UPDATE instead and
+a job taken by another worker in the meantime simply updates no row.
+"""
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+import django
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from crosscheckapi.models import Job
+
+logger = logging.getLogger(__name__)
+
+# kind -> function(job) returning the JSON result
+handlers = {}
+
+# Progress is written at most this often per job
+PROGRESS_INTERVAL = 1
+
+
+class PermanentError(Exception):
+    """Fails the job right away, retrying can not help"""
+
+
+def handler(kind):
+    """Register the function running jobs of `kind`"""
+    def decorator(function):
+        handlers[kind] = function
+        return function
+    return decorator
+
+
+def enqueue(kind, payload=None, landlord=None, input=None, max_attempts=None):
+    """Queue a job. `input` is an optional django File saved with it"""
+    job = Job(
+        kind=kind, payload=payload or {}, landlord=landlord,
+        max_attempts=max_attempts or settings.JOBS['MAX_ATTEMPTS'])
+    if input is not None:
+        job.input.save(input.name, input, save=False)
+    job.save()
+    return job
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker, limit):
+    """Mark up to `limit` due jobs as running for `worker`
+    Returns:
+        list -- ids of the claimed jobs
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    running = dict(
+        status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+        attempts=F('attempts') + 1)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**running)
+        return ids
+
+    ids = []
+    for pk in due.values_list('id', flat=True)[:limit]:
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**running):
+            ids.append(pk)
+    return ids
+
+
+def backoff(attempts):
+    """Seconds before the next attempt, doubling with jitter"""
+    options = settings.JOBS
+    delay = min(options['BACKOFF_SECONDS'] * 2 ** (attempts - 1), options['MAX_BACKOFF_SECONDS'])
+    return delay * random.uniform(0.5, 1)
+
+
+def fail(job_id, error, permanent=False):
+    """Queue the job again after a backoff, or fail it for good"""
+    job = Job.objects.get(pk=job_id)
+    now = timezone.now()
+    if permanent or job.attempts >= job.max_attempts:
+        Job.objects.filter(pk=job_id).update(
+            status=Job.FAILED, error=error, finished_at=now, heartbeat_at=None)
+    else:
+        Job.objects.filter(pk=job_id).update(
+            status=Job.QUEUED, error=error, heartbeat_at=None,
+            run_at=now + timedelta(seconds=backoff(job.attempts)))
+
+
+def report(job, done, total=None):
+    """Record progress (`done` out of `total`, or a 0-1 fraction) and
+    refresh the heartbeat. Cheap to call in a loop, the row is written
+    at most once per PROGRESS_INTERVAL
+    """
+    now = time.monotonic()
+    if now - getattr(job, '_reported', 0) < PROGRESS_INTERVAL:
+        return
+    job._reported = now
+    job.progress = min(done / total, 1) if total else done
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, heartbeat_at=timezone.now())
+
+
+def execute(job_id):
+    """Run one claimed job and store its outcome"""
+    try:
+        job = Job.objects.select_related('landlord').get(pk=job_id)
+        function = handlers.get(job.kind)
+        if function is None:
+            raise PermanentError(f'Unknown job kind: {job.kind}')
+        result = function(job)
+    except PermanentError as ex:
+        fail(job_id, str(ex), permanent=True)
+    except Exception as ex:
+        logger.exception('Job %s failed', job_id)
+        fail(job_id, f'{type(ex).__name__}: {ex}')
+    else:
+        Job.objects.filter(pk=job_id).update(
+            status=Job.SUCCEEDED, result=result, error='', progress=1,
+            output=job.output.name, finished_at=timezone.now(), heartbeat_at=None)
+
+
+def run_in_pool(job_id):
+    """execute() in a pool thread or process, which manages its own
+    database connections like a request would
+    """
+    close_old_connections()
+    try:
+        execute(job_id)
+    finally:
+        close_old_connections()
+
+
+def requeue_stale():
+    """Running jobs whose worker stopped beating count as a failed attempt"""
+    limit = timezone.now() - timedelta(seconds=settings.JOBS['STALE_SECONDS'])
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=limit)
+    for pk in stale.values_list('id', flat=True):
+        fail(pk, 'The worker stopped responding')
+
+
+class Worker:
+    """Claims due jobs and runs them in a pool of `concurrency` threads
+    or processes until stopped. With `burst` it returns once no job is
+    due instead of polling forever
+    """
+
+    def __init__(self, pool=None, concurrency=None, burst=False):
+        options = settings.JOBS
+        self.pool = pool or options['POOL']
+        self.concurrency = concurrency or options['CONCURRENCY']
+        self.burst = burst
+        self.name = worker_name()
+        self.stopping = False
+
+    def executor(self):
+        if self.pool == 'process':
+            # Spawned, not forked: forked children would share the
+            # parent's database connections
+            return ProcessPoolExecutor(
+                self.concurrency, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup)
+        return ThreadPoolExecutor(self.concurrency, thread_name_prefix='job')
+
+    def run(self):
+        """Returns the number of jobs run"""
+        poll = settings.JOBS['POLL_SECONDS']
+        # future -> job id
+        running = {}
+        count = 0
+
+        with self.executor() as executor:
+            while True:
+                if not self.stopping and len(running) < self.concurrency:
+                    requeue_stale()
+                    for pk in claim(self.name, self.concurrency - len(running)):
+                        running[executor.submit(run_in_pool, pk)] = pk
+
+                if not running:
+                    if self.stopping or self.burst:
+                        return count
+                    time.sleep(poll)
+                    continue
+
+                Job.objects.filter(pk__in=running.values()).update(heartbeat_at=timezone.now())
+                done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pk = running.pop(future)
+                    count += 1
+                    # execute() handles errors itself, this is a crashed process
+                    if future.exception() is not None:
+                        logger.error('Job %s crashed its worker: %r', pk, future.exception())
+                        fail(pk, f'Worker crashed: {future.exception()!r}')
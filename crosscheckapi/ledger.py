@@ -0,0 +1,143 @@
+"""Rent ledger: expected versus received rent per lease per month
+
+A payment counts toward a lease when it belongs to the lease's tenant,
+its date falls inside the lease, and it either has no property or the
+lease's property. Entries are refreshed by the signals in
+`crosscheckapi.signals` and rebuilt by `manage.py rebuild_ledger`.
+"""
+from calendar import monthrange
+from datetime import date
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from crosscheckapi.models import LedgerEntry, Payment, TenantPropertyRel
+
+# Leases rebuilt per aggregate query
+BATCH_SIZE = 500
+
+
+def first_of_month(day):
+    return day.replace(day=1)
+
+
+def last_of_month(day):
+    return day.replace(day=monthrange(day.year, day.month)[1])
+
+
+def lease_months(lease):
+    """First day of every month the lease covers"""
+    month = first_of_month(lease.lease_start)
+    months = []
+    while month <= lease.lease_end:
+        months.append(month)
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return months
+
+
+def lease_payments(lease, start=None, end=None):
+    """Payments counting toward `lease`, optionally within a date range"""
+    start = max(start or lease.lease_start, lease.lease_start)
+    end = min(end or lease.lease_end, lease.lease_end)
+    return Payment.objects.filter(
+        tenant_id=lease.tenant_id, date__range=(start, end)
+    ).filter(
+        Q(rented_property__isnull=True) | Q(rented_property_id=lease.rented_property_id)
+    )
+
+
+def rebuild_leases(lease_ids):
+    """Replace every entry of some leases: one query reads the leases,
+    one aggregate the payments of all of them per lease and month, then
+    one DELETE and a bulk INSERT
+    """
+    # The base managers also see leases of soft deleted tenants and
+    # properties, whose entries stay consistent until the purge
+    leases = (TenantPropertyRel._base_manager.filter(pk__in=lease_ids)
+              .annotate(landlord_id=F('rented_property__landlord_id'))
+              .only('id', 'tenant_id', 'rented_property_id', 'rent', 'lease_start', 'lease_end'))
+
+    # Every condition sits in one filter() so they share the payment join
+    received = {
+        (row['id'], row['month']): row for row in TenantPropertyRel._base_manager.filter(
+            Q(tenant__payment__rented_property__isnull=True) |
+            Q(tenant__payment__rented_property_id=F('rented_property_id')),
+            pk__in=lease_ids,
+            tenant__payment__date__gte=F('lease_start'),
+            tenant__payment__date__lte=F('lease_end'),
+        )
+        .annotate(month=TruncMonth('tenant__payment__date'))
+        .values('id', 'month')
+        .annotate(total=Sum('tenant__payment__amount'), count=Count('tenant__payment__id'))
+        .order_by()
+    }
+
+    entries = []
+    for lease in leases:
+        for month in lease_months(lease):
+            row = received.get((lease.id, month), {'total': 0, 'count': 0})
+            entries.append(LedgerEntry(
+                lease_id=lease.id,
+                landlord_id=lease.landlord_id,
+                tenant_id=lease.tenant_id,
+                rented_property_id=lease.rented_property_id,
+                month=month,
+                expected=lease.rent,
+                received=row['total'],
+                balance=lease.rent - row['total'],
+                payment_count=row['count'],
+            ))
+
+    with transaction.atomic():
+        LedgerEntry._base_manager.filter(lease_id__in=lease_ids).delete()
+        LedgerEntry.objects.bulk_create(entries)
+
+
+def rebuild_lease(lease):
+    """Replace every entry of one lease"""
+    rebuild_leases([lease.pk])
+
+
+def refresh_month(lease, month):
+    """Recompute a single lease month after one of its payments changed"""
+    totals = lease_payments(lease, month, last_of_month(month)).aggregate(
+        total=Sum('amount'), count=Count('id'))
+    received = totals['total'] or 0
+
+    # Leases saved before the ledger existed have no entries
+    # until `manage.py rebuild_ledger` runs
+    LedgerEntry.objects.filter(lease=lease, month=month).update(
+        received=received,
+        balance=lease.rent - received,
+        payment_count=totals['count'],
+    )
+
+
+def refresh_payment(tenant_id, day, rented_property_id=None):
+    """Refresh the month of every lease a payment with these values counts toward"""
+    leases = TenantPropertyRel.objects.filter(
+        tenant_id=tenant_id
+    ).active_on(day)
+    if rented_property_id is not None:
+        leases = leases.filter(rented_property_id=rented_property_id)
+
+    for lease in leases:
+        refresh_month(lease, first_of_month(day))
+
+
+def rebuild_tenants(tenant_ids):
+    """Rebuild every lease of some tenants, after payments were written in bulk"""
+    return rebuild(TenantPropertyRel.objects.filter(tenant_id__in=tenant_ids))
+
+
+def rebuild(leases=None, progress=None):
+    """Rebuild the ledger of every lease in `leases` (all by default),
+    BATCH_SIZE leases at a time. `progress(done, total)` is called
+    after each batch when given
+    """
+    leases = leases if leases is not None else TenantPropertyRel.objects.all()
+    lease_ids = list(leases.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(lease_ids), BATCH_SIZE):
+        rebuild_leases(lease_ids[start:start + BATCH_SIZE])
+        if progress:
+            progress(min(start + BATCH_SIZE, len(lease_ids)), len(lease_ids))
+    return len(lease_ids)
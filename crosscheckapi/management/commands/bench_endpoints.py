@@ -0,0 +1,248 @@
+"""Latency, query count and memory of every API route"""
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from crosscheck.urls import router
+from crosscheckapi import tokens
+from crosscheckapi.authentication import credentials
+from crosscheckapi.benchmark import count_queries, percentile
+from crosscheckapi.sync import encode_cursor
+from crosscheckapi.models import Landlord, Payment, PaymentType, Property, Tenant, TenantPropertyRel
+
+
+class Rollback(Exception):
+    """Raised to undo the writes of a write benchmark"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every route against the current database and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--landlord', type=int,
+                            help='Landlord to authenticate as, defaults to the one with most payments')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default='bench.json')
+        parser.add_argument('--compare', help='Earlier report to print the change against')
+        parser.add_argument('--signed-tokens', action='store_true',
+                            help='Enable SIGNED_TOKENS and authenticate with a signed access token')
+
+    def handle(self, *args, **options):
+        if options['signed_tokens']:
+            with override_settings(SIGNED_TOKENS=dict(settings.SIGNED_TOKENS, ENABLED=True)):
+                return self.run(options)
+        return self.run(options)
+
+    def run(self, options):
+        landlord = self.pick_landlord(options['landlord'])
+        self.client = APIClient()
+        if options['signed_tokens']:
+            access = tokens.issue(landlord.user_id, landlord.id)['access']
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        else:
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {landlord.user.auth_token.key}')
+
+        cases = self.cases(landlord)
+        covered = {name.split('?')[0] for name, *_ in cases}
+        for name in self.routes():
+            if name not in covered and name != 'api-root':
+                self.stderr.write(f'No benchmark case for route {name}')
+
+        results = {}
+        for name, method, url, data in cases:
+            results[name] = self.measure(method, url, data, options['iterations'])
+            row = results[name]
+            self.stdout.write(
+                f'{name:<28} p50 {row["p50_ms"]:>9.2f} ms  p95 {row["p95_ms"]:>9.2f} ms'
+                f'  {row["queries"]:>5} queries  {row["peak_kib"]:>9.1f} KiB'
+            )
+
+        report = {
+            'commit': self.commit(),
+            'vendor': connection.vendor,
+            'python': platform.python_version(),
+            'landlord': landlord.id,
+            'signed_tokens': options['signed_tokens'],
+            'rows': {
+                'tenants': Tenant.objects.filter(landlord=landlord).count(),
+                'properties': Property.objects.filter(landlord=landlord).count(),
+                'payments': Payment.objects.filter(landlord=landlord).count(),
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Report written to {options["output"]}'))
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def pick_landlord(self, pk):
+        landlords = Landlord.objects.select_related('user__auth_token')
+        if pk:
+            return landlords.get(pk=pk)
+        landlord_id = (Payment.objects.values('landlord_id')
+                       .order_by().annotate(total=Count('id'))
+                       .order_by('-total').values_list('landlord_id', flat=True).first())
+        if landlord_id is None:
+            raise CommandError('No payments found, run generate_data first')
+        return landlords.get(pk=landlord_id)
+
+    def cases(self, landlord):
+        """(name, method, url, body) for every route, with real ids.
+        The body is a dict sent as JSON or a (body, content type) pair
+        """
+        tenant = Tenant.objects.filter(landlord=landlord).first()
+        rental = Property.objects.filter(landlord=landlord).first()
+        payment = Payment.objects.filter(landlord=landlord).first()
+        payment_type = PaymentType.objects.first()
+        payment_ids = list(Payment.objects.filter(landlord=landlord).order_by('id').values_list('id', flat=True)[:200])
+        lease_ids = list(TenantPropertyRel.objects.filter(
+            rented_property__landlord=landlord).order_by('id').values_list('id', flat=True)[:50])
+        year = date.today().year
+        new_payment = {
+            'date': f'{year}-01-05', 'amount': '$1,000', 'ref_num': 'bench',
+            'full_name': tenant.id, 'type': payment_type.id,
+        }
+
+        return [
+            ('tenant-list', 'get', '/tenants', None),
+            ('tenant-list?search', 'get', '/tenants?search=smith', None),
+            ('tenant-list?table', 'get', '/tenants?table', None),
+            ('tenant-detail', 'get', f'/tenants/{tenant.id}', None),
+            ('tenant-export', 'get', '/tenants/export', None),
+            ('tenant-destroy', 'delete', f'/tenants/{tenant.id}', None),
+            ('tenant-create', 'post', '/tenants',
+             {'full_name': 'Bench Tenant', 'phone_number': '5550000000', 'email': 'b@x.com'}),
+            ('payment-list', 'get', '/payments', None),
+            ('payment-list?cursor', 'get', '/payments?cursor=', None),
+            ('payment-list?date', 'get', f'/payments?date={year}-01-01/{year}-03-31', None),
+            ('payment-list?tenant', 'get', f'/payments?tenant={tenant.id}', None),
+            ('payment-list?keyword', 'get', '/payments?keyword=smith', None),
+            ('payment-detail', 'get', f'/payments/{payment.id}', None),
+            ('payment-export', 'get', '/payments/export', None),
+            ('payment-summary', 'get', f'/payments/summary?group=month,type&date={year - 1}-01-01/{year}-12-31', None),
+            ('payment-create', 'post', '/payments', new_payment),
+            ('payment-update', 'put', f'/payments/{payment.id}', new_payment),
+            ('payment-destroy', 'delete', f'/payments/{payment.id}', None),
+            ('payment-match', 'post', '/payments/match', (
+                'Date,Description,Amount\n' + ''.join(
+                    f'{year}-01-0{1 + i % 9},ZELLE FROM {tenant.full_name},{1000 + 25 * i}\n'
+                    for i in range(1000)), 'text/csv')),
+            ('payment-bulk', 'post', '/payments/bulk', (
+                '\n'.join(json.dumps(new_payment) for _ in range(1000)), 'application/x-ndjson')),
+            ('payment-bulk-patch', 'patch', '/payments/bulk',
+             [{'id': pk, 'amount': 1000 + i} for i, pk in enumerate(payment_ids)]),
+            ('payment-bulk-delete', 'delete', '/payments/bulk', {'ids': payment_ids}),
+            ('property-list', 'get', '/properties', None),
+            ('property-detail', 'get', f'/properties/{rental.id}', None),
+            ('property-export', 'get', '/properties/export', None),
+            ('property-destroy', 'delete', f'/properties/{rental.id}', None),
+            ('property-occupancy', 'get', '/properties/occupancy', None),
+            ('property-timeline', 'get', f'/properties/{rental.id}/timeline?start={year - 3}-01-01', None),
+            ('property-lease', 'post', f'/properties/{rental.id}/lease', {
+                'tenant': tenant.id, 'lease_start': f'{year}-01-01',
+                'lease_end': f'{year}-12-31', 'rent': 1000}),
+            ('property-leases-bulk', 'patch', '/properties/leases/bulk',
+             [{'id': pk, 'rent': 1500} for pk in lease_ids]),
+            ('property-leases-bulk-delete', 'delete', '/properties/leases/bulk', {'ids': lease_ids}),
+            ('paymenttype-list', 'get', '/paymenttypes', None),
+            ('job-list', 'get', '/jobs', None),
+            ('ledger-list', 'get', f'/ledger?start={year}-01&end={year}-12', None),
+            ('sync-list', 'get', '/sync', None),
+            ('typeahead-list', 'get', f'/typeahead?q={tenant.full_name[:3]}', None),
+            ('sync-list?since', 'get', f'/sync?since={encode_cursor(timezone.now())}', None),
+            ('login', 'post', '/login', {'username': landlord.user.username, 'password': 'password'}),
+        ]
+
+    def request(self, method, url, data):
+        if isinstance(data, tuple):
+            body, content_type = data
+            response = getattr(self.client, method)(url, body, content_type=content_type)
+        else:
+            response = getattr(self.client, method)(url, data, format='json')
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        if response.status_code >= 400:
+            raise CommandError(f'{method.upper()} {url} returned {response.status_code}')
+        return size
+
+    def measure(self, method, url, data, iterations):
+        """Every run happens in a rolled back transaction so writes
+        do not change the dataset
+        """
+        # Warm up the credential cache and the connection. Reads run once
+        # outside the rollback so the resource versions they create stay
+        credentials.clear()
+        if method == 'get':
+            self.request(method, url, data)
+        self.run_once(method, url, data)
+
+        # Memory is traced on a separate run, tracing slows everything down
+        tracemalloc.start()
+        size, queries = self.run_once(method, url, data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            self.run_once(method, url, data)
+            timings.append(time.perf_counter() - start)
+
+        return {
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p95_ms': percentile(timings, 95) * 1000,
+            'queries': queries,
+            'peak_kib': peak / 1024,
+            'bytes': size,
+        }
+
+    def run_once(self, method, url, data):
+        """Returns the response size and the number of queries it took"""
+        try:
+            with transaction.atomic():
+                with count_queries() as queries:
+                    size = self.request(method, url, data)
+                raise Rollback(size, queries.count)
+        except Rollback as done:
+            return done.args
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, path, results):
+        with open(path) as f:
+            before = json.load(f)['results']
+
+        self.stdout.write(f'\nChange against {path}')
+        for name, row in results.items():
+            if name not in before:
+                continue
+            old = before[name]
+            change = (row['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            self.stdout.write(
+                f'{name:<28} p50 {old["p50_ms"]:>9.2f} -> {row["p50_ms"]:>9.2f} ms ({change:+.0f}%)'
+                f'  queries {old["queries"]} -> {row["queries"]}'
+            )
+
+    def routes(self):
+        """Route names registered on the router, for spotting missing cases"""
+        return sorted({url.name for url in router.urls if url.name})
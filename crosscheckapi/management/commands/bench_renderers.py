@@ -0,0 +1,100 @@
+"""Compare JSON renderers, parsers and compression on a payment list"""
+import io
+import time
+from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from crosscheckapi import compression
+from crosscheckapi.models import Landlord, Payment, PaymentType, Tenant
+from crosscheckapi.parsers import FastJSONParser
+from crosscheckapi.renderers import FastJSONRenderer
+from crosscheckapi.versions import bodies
+from crosscheckapi.views.payment import PAYMENT_VALUES, serialize_payment
+
+
+class Rollback(Exception):
+    """Raised to throw the benchmark data away"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rendering, parsing and compressing a list of payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def measure(self, label, repeat, work):
+        """Best wall time of `work` over `repeat` runs and the size it returns"""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = work()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f'{label:<28} {best * 1000:>10.1f} ms {size / 1024:>10.1f} KiB')
+
+    def run(self, rows, repeat):
+        user = User.objects.create_user(username='bench@example.com', password='bench')
+        landlord = Landlord.objects.create(user=user)
+        payment_type = PaymentType.objects.create(label='Bench')
+        Tenant.objects.bulk_create([
+            Tenant(full_name=f'Tenant {i}', email=f't{i}@example.com', phone_number='5550000000',
+                   landlord=landlord) for i in range(rows // 10 or 1)
+        ])
+        tenants = list(Tenant.objects.filter(landlord=landlord))
+        start = date(2020, 1, 1)
+        Payment.objects.bulk_create([
+            Payment(date=start + timedelta(days=i % 365), amount=1000 + i, ref_num=str(i),
+                    tenant=tenants[i % len(tenants)], payment_type=payment_type, landlord=landlord)
+            for i in range(rows)
+        ])
+        data = [serialize_payment(row) for row in Payment.objects.filter(
+            landlord=landlord).order_by('-date', '-id').values(*PAYMENT_VALUES)]
+        content = FastJSONRenderer().render(data)
+
+        self.stdout.write(f'{f"{rows:,} payments":<28} {"time":>13} {"size":>14}')
+        self.measure('render JSONRenderer', repeat, lambda: len(JSONRenderer().render(data)))
+        self.measure('render FastJSONRenderer', repeat, lambda: len(FastJSONRenderer().render(data)))
+
+        def parse(parser):
+            parser.parse(io.BytesIO(content))
+            return len(content)
+
+        self.measure('parse JSONParser', repeat, lambda: parse(JSONParser()))
+        self.measure('parse FastJSONParser', repeat, lambda: parse(FastJSONParser()))
+        self.measure('identity', 1, lambda: len(content))
+        self.measure('gzip', repeat, lambda: len(compression.compress(content, 'gzip')))
+        if compression.brotli is not None:
+            self.measure('brotli', repeat, lambda: len(compression.compress(content, 'br')))
+        else:
+            self.stdout.write(f'{"brotli":<28} not installed')
+
+        # The whole request with empty caches, then the cached bodies
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+
+        def get(**headers):
+            response = client.get('/payments', **headers)
+            return len(response.content)
+
+        def cold(**headers):
+            bodies.clear()
+            compression.compressed.clear()
+            return get(**headers)
+
+        self.measure('GET /payments', repeat, cold)
+        self.measure('GET /payments gzip', repeat, lambda: cold(HTTP_ACCEPT_ENCODING='gzip'))
+        self.measure('GET /payments gzip cached', repeat, lambda: get(HTTP_ACCEPT_ENCODING='gzip'))
@@ -0,0 +1,95 @@
+"""Compare ModelSerializer and values() read paths for payments and leases"""
+import time
+from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework import serializers
+from crosscheckapi.benchmark import count_queries
+from crosscheckapi.models import (
+    Landlord, Payment, PaymentType, Property, Tenant, TenantPropertyRel
+)
+from crosscheckapi.views.payment import PAYMENT_VALUES, PaymentSerializer, serialize_payment
+from crosscheckapi.views.property import LEASE_VALUES, serialize_lease
+
+
+class Rollback(Exception):
+    """Raised to throw the benchmark data away"""
+
+
+class DepthTwoLeaseSerializer(serializers.ModelSerializer):
+    """The depth=2 lease serializer the property view used before"""
+    class Meta:
+        model = TenantPropertyRel
+        fields = ('id', 'lease_start', 'lease_end', 'rent', 'tenant', 'active')
+        depth = 2
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the payment and lease read paths per 1,000 rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def measure(self, label, rows, repeat, render):
+        """Best wall time and query count of `render` over `repeat` runs"""
+        best = None
+        for _ in range(repeat):
+            with count_queries() as queries:
+                start = time.perf_counter()
+                render()
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        per_thousand = 1000 / rows
+        self.stdout.write(
+            f'{label:<28} {best * 1000 * per_thousand:>10.1f} ms'
+            f' {queries.count * per_thousand:>10.1f} queries'
+        )
+
+    def run(self, rows, repeat):
+        user = User.objects.create_user(username='bench@example.com', password='bench')
+        landlord = Landlord.objects.create(user=user)
+        payment_type = PaymentType.objects.create(label='Bench')
+        rental = Property.objects.create(
+            street='1 Bench St', city='Nashville', state='TN',
+            postal_code='37201', landlord=landlord)
+
+        Tenant.objects.bulk_create([
+            Tenant(full_name=f'Tenant {i}', landlord=landlord) for i in range(rows)
+        ])
+        tenants = list(Tenant.objects.filter(landlord=landlord))
+        start = date(2020, 1, 1)
+        Payment.objects.bulk_create([
+            Payment(date=start + timedelta(days=i % 365), amount=1000, ref_num=str(i),
+                    tenant=tenants[i], payment_type=payment_type, landlord=landlord)
+            for i in range(rows)
+        ])
+        TenantPropertyRel.objects.bulk_create([
+            TenantPropertyRel(lease_start=start, lease_end=start + timedelta(days=365),
+                              rent=1000, tenant=tenants[i], rented_property=rental)
+            for i in range(rows)
+        ])
+
+        # Querysets are cloned with .all() on every run so results are not cached
+        payments = Payment.objects.filter(landlord=landlord).order_by('-date', '-id')
+        leases = TenantPropertyRel.objects.filter(rented_property=rental).with_active()
+
+        self.stdout.write(f'{"per 1,000 rows":<28} {"time":>13} {"queries":>18}')
+        self.measure('payments ModelSerializer', rows, repeat, lambda: PaymentSerializer(
+            payments.all(), many=True).data)
+        self.measure('payments values()', rows, repeat, lambda: [
+            serialize_payment(row) for row in payments.values(*PAYMENT_VALUES)])
+        self.measure('leases ModelSerializer', rows, repeat, lambda: DepthTwoLeaseSerializer(
+            leases.all(), many=True).data)
+        self.measure('leases values()', rows, repeat, lambda: [
+            serialize_lease(row) for row in leases.order_by('id').values(*LEASE_VALUES)])
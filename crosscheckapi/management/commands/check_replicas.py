@@ -0,0 +1,27 @@
+"""Run the replica health checks the database router relies on"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from crosscheck.routers import health
+
+
+class Command(BaseCommand):
+    help = 'Check that every read replica answers and report its replication lag'
+
+    def handle(self, *args, **options):
+        replicas = settings.DATABASE_ROUTING['REPLICAS']
+        if not replicas:
+            self.stdout.write('No replicas configured, every query uses the primary')
+            return
+
+        failed = 0
+        for alias in replicas:
+            healthy, lag = health.check(alias)
+            if healthy:
+                self.stdout.write(self.style.SUCCESS(f'{alias}: healthy, {lag:.1f} s behind'))
+            else:
+                failed += 1
+                state = 'unreachable' if lag is None else f'{lag:.1f} s behind'
+                self.stdout.write(self.style.ERROR(f'{alias}: skipped by the router, {state}'))
+
+        if failed:
+            raise CommandError(f'{failed} of {len(replicas)} replicas are unhealthy')
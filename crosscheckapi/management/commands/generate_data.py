@@ -0,0 +1,148 @@
+"""Generate a large synthetic dataset with bulk inserts"""
+import binascii
+import os
+import random
+from datetime import date, timedelta
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from crosscheckapi import ledger
+from crosscheckapi.ledger import lease_months
+from crosscheckapi.models import (
+    Landlord, Payment, PaymentType, Property, Tenant, TenantPropertyRel
+)
+from crosscheckapi.signals import bulk_saved
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael',
+               'Linda', 'David', 'Elizabeth', 'William', 'Barbara', 'Maria', 'Jose']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller',
+              'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Wilson']
+STREETS = ['Main St', 'Oak Ave', 'Maple Dr', 'Cedar Ln', 'Elm St', 'Church St',
+           'Broadway', 'Lakeview Dr', 'Hillcrest Rd', 'Park Ave']
+CITIES = [('Nashville', 'TN', '372'), ('Memphis', 'TN', '381'), ('Louisville', 'KY', '402'),
+          ('Atlanta', 'GA', '303'), ('Birmingham', 'AL', '352')]
+PAYMENT_TYPES = ['Cash', 'Check', 'Money Order', 'Bank Transfer', 'Venmo', 'Zelle']
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Generate landlords, tenants, properties, leases and monthly payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--landlords', type=int, default=10)
+        parser.add_argument('--tenants', type=int, default=200,
+                            help='Tenants (and properties) per landlord')
+        parser.add_argument('--years', type=int, default=5,
+                            help='Years of yearly leases and monthly payments')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.start = date(date.today().year - options['years'], 1, 1)
+        self.years = options['years']
+
+        payment_types = list(PaymentType.objects.all())
+        if not payment_types:
+            PaymentType.objects.bulk_create([PaymentType(label=label) for label in PAYMENT_TYPES])
+            payment_types = list(PaymentType.objects.all())
+        self.payment_types = payment_types
+
+        # One hash for every generated user, PBKDF2 is slow on purpose
+        self.password = make_password('password')
+        self.run_id = binascii.hexlify(os.urandom(4)).decode()
+
+        for number in range(options['landlords']):
+            with transaction.atomic():
+                landlord = self.create_landlord(number)
+                self.create_tenants(landlord, options['tenants'])
+            self.stdout.write(f'Landlord {number + 1}/{options["landlords"]} done')
+
+        self.stdout.write(self.style.SUCCESS('Done, log in with any generated email and "password"'))
+
+    def create_landlord(self, number):
+        user = User.objects.create(
+            username=f'landlord{number}-{self.run_id}@example.com',
+            email=f'landlord{number}-{self.run_id}@example.com',
+            password=self.password)
+        Token.objects.create(user=user)
+        return Landlord.objects.create(user=user)
+
+    def create_tenants(self, landlord, count):
+        """Each tenant rents their own property with one lease per year"""
+        rand = self.random
+
+        Tenant.objects.bulk_create([
+            Tenant(
+                full_name=f'{rand.choice(FIRST_NAMES)} {rand.choice(LAST_NAMES)}',
+                phone_number=f'{rand.randint(200, 999)}555{rand.randint(1000, 9999)}',
+                email=f'tenant{i}.{landlord.id}@example.com',
+                landlord=landlord)
+            for i in range(count)
+        ], batch_size=self.batch_size)
+
+        properties = []
+        for _ in range(count):
+            city, state, zip_prefix = rand.choice(CITIES)
+            properties.append(Property(
+                street=f'{rand.randint(100, 9999)} {rand.choice(STREETS)}',
+                city=city, state=state, postal_code=f'{zip_prefix}{rand.randint(10, 99)}',
+                landlord=landlord))
+        Property.objects.bulk_create(properties, batch_size=self.batch_size)
+
+        # SQLite does not return ids from bulk_create, read them back
+        tenants = list(Tenant.objects.filter(landlord=landlord).order_by('id'))
+        rentals = list(Property.objects.filter(landlord=landlord).order_by('id'))
+
+        leases = []
+        for tenant, rental in zip(tenants, rentals):
+            rent = rand.randrange(700, 2500, 25)
+            for year in range(self.years):
+                start = date(self.start.year + year, 1, 1)
+                leases.append(TenantPropertyRel(
+                    lease_start=start, lease_end=date(start.year, 12, 31),
+                    rent=rent + 25 * year, tenant=tenant, rented_property=rental))
+        TenantPropertyRel.objects.bulk_create(leases, batch_size=self.batch_size)
+
+        for batch in batched(self.payments(landlord, leases), self.batch_size):
+            Payment.objects.bulk_create(batch)
+
+        # bulk_create skips post_save, let the derived data catch up.
+        # The ledger is rebuilt once below, not by the leases' and again
+        # by the payments' signal
+        for model in (Tenant, Property, TenantPropertyRel, Payment):
+            bulk_saved.send(
+                sender=model, landlord=landlord, rebuild_ledger=False,
+                queryset=model.objects.filter(
+                    **{'tenant__landlord' if model is TenantPropertyRel else 'landlord': landlord}))
+        ledger.rebuild(TenantPropertyRel.objects.filter(tenant__landlord=landlord))
+
+    def payments(self, landlord, leases):
+        """Monthly payments, mostly on time and in full"""
+        rand = self.random
+        today = date.today()
+        for lease in leases:
+            for month in lease_months(lease):
+                if month > today or rand.random() < 0.03:
+                    continue
+                amount = lease.rent if rand.random() > 0.1 else lease.rent // 2
+                yield Payment(
+                    date=month + timedelta(days=rand.randint(0, 9)),
+                    amount=amount,
+                    ref_num=f'{rand.randint(100000, 999999)}',
+                    tenant=lease.tenant,
+                    rented_property=lease.rented_property,
+                    payment_type=rand.choice(self.payment_types),
+                    landlord=landlord)
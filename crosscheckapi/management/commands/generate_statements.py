@@ -0,0 +1,42 @@
+"""Write the year-end payment statements of a landlord into a zip archive"""
+from django.core.management.base import BaseCommand, CommandError
+from crosscheckapi import statements
+from crosscheckapi.jobs import enqueue
+from crosscheckapi.models import Landlord
+
+
+class Command(BaseCommand):
+    help = 'Render every tenant statement of a year in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--landlord', type=int, required=True)
+        parser.add_argument('--year', type=int, required=True)
+        parser.add_argument('--output', help='Zip file to write, defaults to statements-YEAR.zip')
+        parser.add_argument('--formats', default=','.join(statements.FORMATS),
+                            help='Comma separated, out of csv and html')
+        parser.add_argument('--workers', type=int,
+                            help='Rendering processes, defaults to the number of cores')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue a job for `manage.py runworker` instead')
+
+    def handle(self, *args, **options):
+        try:
+            landlord = Landlord.objects.get(pk=options['landlord'])
+        except Landlord.DoesNotExist:
+            raise CommandError(f'Unknown landlord: {options["landlord"]}')
+        formats = [fmt for fmt in options['formats'].split(',') if fmt]
+        unknown = set(formats) - set(statements.FORMATS)
+        if unknown or not formats:
+            raise CommandError(f'Unknown formats: {", ".join(sorted(unknown)) or "none given"}')
+
+        if options['background']:
+            job = enqueue('statements', {'year': options['year'], 'formats': formats}, landlord)
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.id}'))
+            return
+
+        output = options['output'] or f'statements-{options["year"]}.zip'
+        with open(output, 'wb') as file:
+            count = statements.generate(
+                landlord, options['year'], file, formats, options['workers'])
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} statements to {output}'))
@@ -0,0 +1,36 @@
+"""Remove soft deleted tenants and properties with their payments,
+leases and ledger entries
+"""
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from crosscheckapi.jobs import enqueue
+from crosscheckapi.purge import purge
+
+
+class Command(BaseCommand):
+    help = 'Purge soft deleted tenants and properties in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=0,
+                            help='Only purge rows deleted at least this many hours ago')
+        parser.add_argument('--batch-size', type=int,
+                            help='Rows per DELETE, defaults to PURGE_BATCH_SIZE')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to wait between batches')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue a job for `manage.py runworker` instead')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options['older_than'])
+        if options['background']:
+            job = enqueue('purge_deleted', {
+                'before': before.isoformat(), 'batch_size': options['batch_size']})
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.id}'))
+            return
+
+        counts = purge(before, options['batch_size'], options['pause'])
+
+        summary = ', '.join(
+            f'{count} {model._meta.verbose_name_plural}' for model, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Purged {summary or "nothing"}'))
@@ -0,0 +1,34 @@
+"""Rebuild the rent ledger from leases and payments"""
+from django.core.management.base import BaseCommand, CommandError
+from crosscheckapi import ledger
+from crosscheckapi.jobs import enqueue
+from crosscheckapi.models import Landlord, TenantPropertyRel
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-lease, per-month rent ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--landlord', type=int, help='Only rebuild one landlord')
+        parser.add_argument('--background', action='store_true',
+                            help='Queue a job for `manage.py runworker` instead')
+
+    def handle(self, *args, **options):
+        if options['background']:
+            if options['landlord']:
+                try:
+                    job = enqueue('rebuild_ledger', landlord=Landlord.objects.get(pk=options['landlord']))
+                except Landlord.DoesNotExist:
+                    raise CommandError(f'No landlord {options["landlord"]}')
+            else:
+                job = enqueue('rebuild_ledger', {'all': True})
+            self.stdout.write(self.style.SUCCESS(f'Queued job {job.id}'))
+            return
+
+        leases = TenantPropertyRel.objects.all()
+        if options['landlord']:
+            leases = leases.filter(rented_property__landlord_id=options['landlord'])
+
+        count = ledger.rebuild(leases)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the ledger of {count} leases'))
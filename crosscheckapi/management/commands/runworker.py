@@ -0,0 +1,31 @@
+"""Run queued background jobs"""
+import signal
+from django.core.management.base import BaseCommand
+from crosscheckapi.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Claim and run background jobs until stopped with SIGTERM or Ctrl-C'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', choices=['thread', 'process'],
+                            help="Run jobs in threads or processes, defaults to JOBS['POOL']")
+        parser.add_argument('--concurrency', type=int,
+                            help="Jobs run at once, defaults to JOBS['CONCURRENCY']")
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is due')
+
+    def handle(self, *args, **options):
+        worker = Worker(options['pool'], options['concurrency'], options['burst'])
+
+        def stop(signum, frame):
+            # Finish the running jobs, a second signal stops right away
+            worker.stopping = True
+            signal.signal(signum, signal.SIG_DFL)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f'Worker {worker.name}: {worker.concurrency} jobs at once in a {worker.pool} pool')
+        count = worker.run()
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs'))
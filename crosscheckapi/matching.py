@@ -0,0 +1,335 @@
+"""Match bank statement deposits to tenants and leases
+
+A statement (CSV or OFX) is read into `StatementLine`s. The landlord's
+leases around the statement dates are loaded once and indexed:
+
+* rent amount -> tenants (hash index on the expected rent)
+* normalized full name -> tenants, and name token -> tenants
+* reference pattern -> tenants, learned from earlier payments' ref_num
+
+Each line then only scores the few tenants those indexes return. The
+score weighs payer name similarity (trigram Dice), the amount against
+the rent, a known reference pattern and the distance to the due date
+(the first of the month).
+"""
+import csv
+import heapq
+import io
+import re
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+from crosscheckapi.importer import RowError, parse_amount, parse_date
+from crosscheckapi.models import Payment, TenantPropertyRel
+from crosscheckapi.models.tenantpropertyrel import covers
+
+StatementLine = namedtuple('StatementLine', 'number date amount name ref')
+
+# Words banks put around the payer's name
+NOISE = {
+    'ACH', 'CREDIT', 'DEP', 'DEPOSIT', 'FROM', 'MOBILE', 'ONLINE', 'PAYMENT',
+    'PMT', 'RENT', 'TRANSFER', 'VENMO', 'ZELLE', 'CASHAPP', 'CHECK', 'CHK', 'REF',
+}
+
+WEIGHTS = {'name': 0.45, 'amount': 0.3, 'ref': 0.15, 'date': 0.1}
+
+# Candidates scoring lower are not proposed
+MIN_SCORE = 0.3
+
+# A name token shared by more tenants than this is too common to
+# narrow the search on its own
+MAX_POSTING = 200
+
+# Days of payments, up to the last statement line, read to learn
+# reference patterns
+HISTORY_DAYS = 120
+
+# Statement references looked up per query for already recorded payments
+RECORDED_CHUNK = 5000
+
+CSV_COLUMNS = {
+    'date': ('date', 'posted', 'posting date', 'transaction date'),
+    'amount': ('amount', 'credit', 'deposit'),
+    'name': ('name', 'payee', 'payer', 'description'),
+    'ref': ('ref_num', 'reference', 'memo', 'check number'),
+}
+
+
+def read_csv_statement(text):
+    """Header names are matched case-insensitively against CSV_COLUMNS"""
+    reader = csv.DictReader(io.StringIO(text))
+    headers = {name.strip().lower(): name for name in reader.fieldnames or []}
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        columns[field] = next((headers[name] for name in names if name in headers), None)
+    if columns['date'] is None or columns['amount'] is None:
+        raise RowError('The statement needs a date and an amount column')
+
+    for number, row in enumerate(reader, start=2):
+        yield number, {field: row.get(column) or '' for field, column in columns.items() if column}
+
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|$)', re.S | re.I)
+OFX_TAG = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def read_ofx_statement(text):
+    """OFX 1.x (SGML, unclosed tags) and 2.x (XML) transaction lists"""
+    for number, block in enumerate(OFX_TRANSACTION.findall(text), start=1):
+        tags = {tag.upper(): value.strip() for tag, value in OFX_TAG.findall(block)}
+        posted = tags.get('DTPOSTED', '')[:8]
+        yield number, {
+            'date': f'{posted[:4]}-{posted[4:6]}-{posted[6:8]}',
+            'amount': tags.get('TRNAMT', ''),
+            'name': tags.get('NAME', '') or tags.get('PAYEE', ''),
+            'ref': tags.get('MEMO', '') or tags.get('CHECKNUM', '') or tags.get('REFNUM', ''),
+        }
+
+
+def read_statement(text, content_type):
+    """Parse a statement into deposit lines and per-line errors.
+    Withdrawals are skipped
+    """
+    reader = read_csv_statement if content_type == 'text/csv' else read_ofx_statement
+    lines = []
+    errors = []
+    for number, row in reader(text):
+        try:
+            line = StatementLine(
+                number, parse_date(row['date']), parse_amount(row['amount']),
+                row.get('name', ''), row.get('ref', ''))
+        except RowError as ex:
+            errors.append({'line': number, 'reason': str(ex)})
+            continue
+        if line.amount > 0:
+            lines.append(line)
+    return lines, errors
+
+
+def tokens(name):
+    return [word for word in re.findall(r'[A-Z0-9]+', name.upper())
+            if word not in NOISE and len(word) > 1]
+
+
+def name_key(words):
+    """Word order does not matter: `SMITH JOHN` is `JOHN SMITH`"""
+    return ' '.join(sorted(words))
+
+
+def trigrams(words):
+    """pg_trgm style trigrams: each word padded with two leading and
+    one trailing space
+    """
+    grams = set()
+    for word in words:
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def dice(a, b):
+    if not a or not b:
+        return 0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+DIGITS = re.compile(r'\d+')
+SEPARATORS = re.compile(r'[^A-Z#]+')
+LETTERS = re.compile(r'[A-Z]{3}')
+
+
+def ref_pattern(ref):
+    """Digits vary between payments, the rest of a reference rarely does:
+    `ZELLE JSMITH 8812` and `ZELLE JSMITH 9120` both give `ZELLE JSMITH #`
+    """
+    if not ref or ref.isdigit():
+        return None
+    pattern = SEPARATORS.sub(' ', DIGITS.sub('#', ref.upper())).strip()
+    return pattern if LETTERS.search(pattern) else None
+
+
+def due_distance(day):
+    """Days between `day` and the closest first of the month"""
+    next_month = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return min(day.day - 1, (next_month - day).days)
+
+
+class LeaseIndex:
+    """In-memory indexes over a landlord's leases and payment history"""
+
+    def __init__(self, landlord, lines, window):
+        start = min(line.date for line in lines)
+        end = max(line.date for line in lines)
+        self.window = window
+        self.leases_by_tenant = defaultdict(list)
+        self.rent_tenants = defaultdict(set)
+        self.by_name = defaultdict(set)
+        self.by_token = defaultdict(set)
+        self.tenant_trigrams = {}
+        self.tenant_names = {}
+
+        leases = TenantPropertyRel.objects.filter(
+            tenant__landlord=landlord
+        ).overlapping(start - timedelta(days=window), end + timedelta(days=window)).values(
+            'id', 'tenant_id', 'tenant__full_name', 'rented_property_id',
+            'rent', 'lease_start', 'lease_end')
+
+        trigram_sets = {}
+        for lease in leases:
+            tenant_id = lease['tenant_id']
+            # Day numbers compare faster than dates in the scoring loop
+            first = lease['lease_start'].toordinal()
+            last = lease['lease_end'].toordinal()
+            self.leases_by_tenant[tenant_id].append(
+                (first, last, first - window, last + window, lease))
+            self.rent_tenants[lease['rent']].add(tenant_id)
+            if tenant_id not in self.tenant_names:
+                words = tokens(lease['tenant__full_name'])
+                key = name_key(words)
+                self.tenant_names[tenant_id] = lease['tenant__full_name']
+                if key not in trigram_sets:
+                    trigram_sets[key] = trigrams(words)
+                self.tenant_trigrams[tenant_id] = trigram_sets[key]
+                self.by_name[key].add(tenant_id)
+                for word in words:
+                    self.by_token[word].add(tenant_id)
+
+        # Reference patterns of earlier payments. References made of
+        # digits only have no pattern and are left in the database
+        self.by_pattern = defaultdict(set)
+        history = Payment.objects.filter(
+            landlord=landlord, date__range=(end - timedelta(days=HISTORY_DAYS), end),
+            ref_num__regex=r'[A-Za-z]',
+        ).values_list('tenant_id', 'ref_num').distinct()
+        for tenant_id, ref_num in history:
+            pattern = ref_pattern(ref_num)
+            if pattern:
+                self.by_pattern[pattern].add(tenant_id)
+
+        # Payments already recorded with the reference of a statement line
+        self.recorded = {}
+        refs = sorted({line.ref.strip() for line in lines if line.ref.strip()})
+        for offset in range(0, len(refs), RECORDED_CHUNK):
+            recorded = Payment.objects.filter(
+                landlord=landlord, date__range=(start, end),
+                ref_num__in=refs[offset:offset + RECORDED_CHUNK],
+            ).values_list('id', 'date', 'amount', 'ref_num')
+            for payment_id, day, amount, ref_num in recorded:
+                self.recorded[(day, amount, ref_num.strip().upper())] = payment_id
+
+    def name_candidates(self, words):
+        """Exact normalized name first, then tenants sharing name tokens"""
+        if not words:
+            return set()
+        exact = self.by_name.get(name_key(words))
+        if exact:
+            return set(exact)
+
+        postings = [self.by_token[word] for word in words if word in self.by_token]
+        rare = [posting for posting in postings if len(posting) <= MAX_POSTING]
+        if rare:
+            return set().union(*rare)
+        if postings:
+            common = set.intersection(*postings)
+            if len(common) <= MAX_POSTING:
+                return common
+        return set()
+
+    def candidates(self, line, limit):
+        """The `limit` best scoring leases for a statement line"""
+        words = tokens(line.name) or tokens(line.ref)
+        tenant_ids = self.name_candidates(words)
+
+        # A pattern shared by many tenants (`CHECK #`) says nothing
+        pattern = ref_pattern(line.ref)
+        pattern_tenants = self.by_pattern.get(pattern, set()) if pattern else set()
+        if len(pattern_tenants) > MAX_POSTING:
+            pattern_tenants = set()
+        tenant_ids |= pattern_tenants
+
+        # Nothing from the name or reference: fall back on the rent amount.
+        # Many tenants with the same name: keep those paying this rent
+        rent_tenants = self.rent_tenants.get(line.amount, set())
+        if not tenant_ids:
+            if len(rent_tenants) <= MAX_POSTING:
+                tenant_ids = rent_tenants
+        elif len(tenant_ids) > limit:
+            tenant_ids = (tenant_ids & rent_tenants) | pattern_tenants or tenant_ids
+
+        day = line.date.toordinal()
+        due_score = max(0, 1 - due_distance(line.date) / self.window)
+        line_trigrams = trigrams(words)
+        # Tenants sharing a name share the trigram set, score it once
+        name_scores = {}
+
+        scored = []
+        for tenant_id in tenant_ids:
+            tenant_trigrams = self.tenant_trigrams[tenant_id]
+            name_score = name_scores.get(id(tenant_trigrams))
+            if name_score is None:
+                name_score = name_scores[id(tenant_trigrams)] = dice(line_trigrams, tenant_trigrams)
+            ref_score = 1 if tenant_id in pattern_tenants else 0
+            for first, last, early, late, lease in self.leases_by_tenant[tenant_id]:
+                if covers(first, last, day):
+                    date_score = due_score
+                elif covers(early, late, day):
+                    # Paid early for the first month or late for the last one
+                    date_score = 0
+                else:
+                    continue
+
+                amount_score = amount_match(line.amount, lease['rent'])
+                total = (WEIGHTS['name'] * name_score + WEIGHTS['amount'] * amount_score +
+                         WEIGHTS['ref'] * ref_score + WEIGHTS['date'] * date_score)
+                if total >= MIN_SCORE:
+                    scored.append((-total, lease['id'], lease,
+                                   (name_score, amount_score, ref_score, date_score)))
+
+        return [
+            self.describe(lease, -total, parts)
+            for total, _, lease, parts in heapq.nsmallest(limit, scored, key=lambda row: row[:2])
+        ]
+
+    def describe(self, lease, total, parts):
+        return {
+            'lease': lease['id'],
+            'tenant': lease['tenant_id'],
+            'full_name': self.tenant_names[lease['tenant_id']],
+            'rented_property': lease['rented_property_id'],
+            'rent': lease['rent'],
+            'score': round(total, 3),
+            'reasons': [part for part, value in zip(WEIGHTS, parts) if value >= 0.5],
+        }
+
+
+def amount_match(amount, rent):
+    """1 for the rent, less for several months at once or a part payment"""
+    if amount == rent:
+        return 1
+    if rent and amount % rent == 0 and amount // rent <= 3:
+        return 0.6
+    if rent and rent % amount == 0:
+        return 0.4
+    return 0
+
+
+def match_statement(lines, landlord, limit=3, window=10):
+    """Propose up to `limit` leases for every deposit line
+
+    Returns:
+        list -- one dict per line with its scored candidates, best first,
+        and the id of an identical payment already recorded if any
+    """
+    if not lines:
+        return []
+    index = LeaseIndex(landlord, lines, window)
+
+    return [{
+        'line': line.number,
+        'date': line.date.isoformat(),
+        'amount': line.amount,
+        'name': line.name,
+        'ref': line.ref,
+        'recorded_payment': index.recorded.get(
+            (line.date, line.amount, line.ref.strip().upper())),
+        'candidates': index.candidates(line, limit),
+    } for line in lines]
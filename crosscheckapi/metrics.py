@@ -0,0 +1,194 @@
+"""Per-route request metrics kept in process and rendered for Prometheus"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, +Inf is implied
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Fixed-bucket histogram. Observing is a bisect and two additions"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteMetrics:
+    """Everything recorded for one (route, action) pair"""
+
+    def __init__(self):
+        self.duration = Histogram(SECONDS_BUCKETS)
+        self.db_duration = Histogram(SECONDS_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.size = Histogram(BYTES_BUCKETS)
+        self.statuses = {}
+
+
+class Registry:
+    """(route, action) -> RouteMetrics, shared by every thread of the process"""
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, action, status, duration, db_duration, queries, size):
+        with self.lock:
+            metrics = self.routes.get((route, action))
+            if metrics is None:
+                metrics = self.routes[(route, action)] = RouteMetrics()
+            metrics.duration.observe(duration)
+            metrics.db_duration.observe(db_duration)
+            metrics.queries.observe(queries)
+            if size is not None:
+                metrics.size.observe(size)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = []
+
+            lines.append('# HELP crosscheck_requests_total Requests by route, action and status')
+            lines.append('# TYPE crosscheck_requests_total counter')
+            for (route, action), metrics in routes:
+                for code, count in sorted(metrics.statuses.items()):
+                    lines.append(
+                        f'crosscheck_requests_total{{route="{route}",action="{action}",'
+                        f'status="{code}"}} {count}')
+
+            for name, attribute, help_text in (
+                ('crosscheck_request_duration_seconds', 'duration', 'Wall time per request'),
+                ('crosscheck_db_duration_seconds', 'db_duration', 'Time spent in the database per request'),
+                ('crosscheck_db_queries', 'queries', 'Queries per request'),
+                ('crosscheck_response_size_bytes', 'size', 'Response body size, streamed bodies excluded'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (route, action), metrics in routes:
+                    histogram = getattr(metrics, attribute)
+                    labels = f'route="{route}",action="{action}"'
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """Database execute wrapper timing every query of a request.
+    Keeps the SQL too when the slow request log is on. Parameters are
+    left out, they carry token keys and tenant details
+    """
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql and len(self.statements) < settings.METRICS['SLOW_LOG_MAX_QUERIES']:
+                self.statements.append((elapsed, sql))
+
+
+def route_of(request):
+    """Route name and viewset action of a resolved request, e.g.
+    ('payment-list', 'create'). Function views use their HTTP method
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', request.method.lower()
+
+    route = match.url_name or match.view_name or match.func.__name__
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return route, action
+
+
+class MetricsMiddleware:
+    """Records wall time, database time, query count, response size
+    and status of every request into `registry`.
+
+    Requests slower than METRICS['SLOW_REQUEST_MS'] are logged with
+    the SQL they ran. Streamed bodies are produced after the view
+    returns, so only the time to the first byte is recorded for them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.METRICS
+        if not options['ENABLED']:
+            return self.get_response(request)
+
+        slow_ms = options['SLOW_REQUEST_MS']
+        timer = QueryTimer(keep_sql=slow_ms is not None)
+
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        route, action = route_of(request)
+        size = None if response.streaming else len(response.content)
+        registry.record(
+            route, action, response.status_code,
+            duration, timer.duration, timer.count, size)
+
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            self.log_slow(request, route, action, response, duration, timer)
+
+        return response
+
+    def log_slow(self, request, route, action, response, duration, timer):
+        statements = '\n'.join(
+            f'  {elapsed * 1000:8.2f} ms  {sql}'
+            for elapsed, sql in timer.statements)
+        logger.warning(
+            'Slow request %s %s (%s %s) %s in %.0f ms, %d queries in %.0f ms\n%s',
+            request.method, request.get_full_path(), route, action,
+            response.status_code, duration * 1000, timer.count,
+            timer.duration * 1000, statements)
@@ -0,0 +1,62 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Searchable columns per table, mirrored from crosscheckapi.search
+SEARCH_FIELDS = {
+    'crosscheckapi_tenant': ('phone_number', 'email', 'full_name'),
+    'crosscheckapi_property': ('street', 'city', 'state', 'postal_code'),
+    'crosscheckapi_payment': ('ref_num',),
+}
+
+
+def create_search_index(apps, schema_editor):
+    """Trigram GIN indexes on PostgreSQL, FTS5 shadow tables on SQLite"""
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, fields in SEARCH_FIELDS.items():
+            for field in fields:
+                schema_editor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_{field}_trgm '
+                    f'ON {table} USING gin (UPPER({field}) gin_trgm_ops)'
+                )
+
+    elif vendor == 'sqlite':
+        for table, fields in SEARCH_FIELDS.items():
+            try:
+                schema_editor.execute(
+                    f'CREATE VIRTUAL TABLE {table}_search '
+                    f'USING fts5({", ".join(fields)}, tokenize="trigram")'
+                )
+            except OperationalError:
+                # SQLite older than 3.34 or built without FTS5,
+                # search falls back to icontains
+                return
+            columns = ", ".join(f"COALESCE({field}, '')" for field in fields)
+            schema_editor.execute(
+                f'INSERT INTO {table}_search (rowid, {", ".join(fields)}) '
+                f'SELECT id, {columns} FROM {table}'
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    for table, fields in SEARCH_FIELDS.items():
+        if vendor == 'postgresql':
+            for field in fields:
+                schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{field}_trgm')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
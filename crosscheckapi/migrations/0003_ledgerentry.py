@@ -0,0 +1,37 @@
+# Generated by Django 3.1.7 on 2026-10-18 11:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0002_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('expected', models.IntegerField()),
+                ('received', models.IntegerField(default=0)),
+                ('balance', models.IntegerField()),
+                ('payment_count', models.IntegerField(default=0)),
+                ('landlord', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crosscheckapi.landlord')),
+                ('lease', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crosscheckapi.tenantpropertyrel')),
+                ('rented_property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crosscheckapi.property')),
+                ('tenant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crosscheckapi.tenant')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['landlord', 'month'], name='ledger_landlord_month'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ledgerentry',
+            unique_together={('lease', 'month')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.7 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0003_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['landlord', 'date', 'id'], name='payment_landlord_date'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['landlord', 'tenant', 'date'], name='payment_landlord_tenant'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['tenant', 'date'], name='payment_tenant_date'),
+        ),
+        migrations.AddIndex(
+            model_name='tenantpropertyrel',
+            index=models.Index(fields=['rented_property', 'lease_start', 'lease_end'], name='lease_property_dates'),
+        ),
+        migrations.AddIndex(
+            model_name='tenantpropertyrel',
+            index=models.Index(fields=['tenant', 'lease_start', 'lease_end'], name='lease_tenant_dates'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=20)),
+                ('landlord_id', models.IntegerField(default=0)),
+                ('version', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('resource', 'landlord_id')},
+            },
+        ),
+    ]
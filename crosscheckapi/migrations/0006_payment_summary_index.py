@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0005_resourceversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['landlord', 'date', 'payment_type', 'tenant', 'rented_property', 'amount'], name='payment_summary'),
+        ),
+    ]
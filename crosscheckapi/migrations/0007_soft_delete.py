@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0006_payment_summary_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='property_deleted'),
+        ),
+        migrations.AddIndex(
+            model_name='tenant',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='tenant_deleted'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:30
+
+import crosscheckapi.models.job
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0007_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('succeeded', 'succeeded'), ('failed', 'failed')], default='queued', max_length=10)),
+                ('payload', models.JSONField(default=dict)),
+                ('result', models.JSONField(blank=True, default=None, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('input', models.FileField(blank=True, storage=crosscheckapi.models.job.job_storage, upload_to='input/%Y/%m/')),
+                ('output', models.FileField(blank=True, storage=crosscheckapi.models.job.job_storage, upload_to='output/%Y/%m/')),
+                ('progress', models.FloatField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('heartbeat_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('landlord', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='crosscheckapi.landlord')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_at'], name='job_queue'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['landlord', 'created_at'], name='job_landlord'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0008_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jti', models.CharField(blank=True, default='', max_length=32)),
+                ('user_id', models.IntegerField()),
+                ('revoked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='revokedtoken',
+            index=models.Index(fields=['expires_at'], name='revokedtoken_expires'),
+        ),
+    ]
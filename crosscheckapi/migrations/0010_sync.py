@@ -0,0 +1,64 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crosscheckapi', '0009_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=20)),
+                ('landlord_id', models.IntegerField()),
+                ('object_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='tenantpropertyrel',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['landlord', 'updated_at'], name='payment_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['landlord', 'updated_at'], name='property_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='tenant',
+            index=models.Index(fields=['landlord', 'updated_at'], name='tenant_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='tenantpropertyrel',
+            index=models.Index(fields=['updated_at'], name='lease_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['landlord_id', 'deleted_at'], name='tombstone_landlord'),
+        ),
+    ]
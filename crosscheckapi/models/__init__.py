@@ -3,4 +3,10 @@ from .payment import Payment
 from .paymenttype import PaymentType
 from .property import Property
 from .tenant import Tenant
-from .tenantpropertyrel import TenantPropertyRel
\ No newline at end of file
+from .tenantpropertyrel import TenantPropertyRel
+from .ledgerentry import LedgerEntry
+
+from .resourceversion import ResourceVersion
+from .job import Job
+from .revokedtoken import RevokedToken
+from .tombstone import Tombstone
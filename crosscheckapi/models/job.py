@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.utils import timezone
+
+
+def job_storage():
+    """Input and output files of jobs, outside the static and media roots"""
+    return FileSystemStorage(location=settings.JOBS['FILES_DIR'])
+
+
+class Job(models.Model):
+    """Background work queued by the API and run by `manage.py runworker`.
+    Maintained by crosscheckapi.jobs
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = [(status, status) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)]
+
+    kind = models.CharField(max_length=50)
+    landlord = models.ForeignKey("Landlord", on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(default=None, null=True, blank=True)
+    error = models.TextField(default='', blank=True)
+    input = models.FileField(upload_to='input/%Y/%m/', storage=job_storage, blank=True)
+    output = models.FileField(upload_to='output/%Y/%m/', storage=job_storage, blank=True)
+    # 0 to 1, reported by the handler while it runs
+    progress = models.FloatField(default=0)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # Not claimed before this time, pushed back after each failed attempt
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(default=None, null=True, blank=True)
+    finished_at = models.DateTimeField(default=None, null=True, blank=True)
+    worker = models.CharField(max_length=100, default='', blank=True)
+    # Refreshed with the progress. Running jobs that stop beating
+    # belonged to a worker that died and are claimed again
+    heartbeat_at = models.DateTimeField(default=None, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The claim query: due queued jobs, oldest first
+            models.Index(fields=['status', 'run_at'], name='job_queue'),
+            models.Index(fields=['landlord', 'created_at'], name='job_landlord'),
+        ]
@@ -0,0 +1,24 @@
+from django.db import models
+from .softdelete import LiveManager
+
+class LedgerEntry(models.Model):
+    """Expected versus received rent for one lease and one month.
+    Maintained by crosscheckapi.ledger, never edited by hand
+    """
+    lease = models.ForeignKey("TenantPropertyRel", on_delete=models.CASCADE)
+    landlord = models.ForeignKey("Landlord", on_delete=models.CASCADE)
+    tenant = models.ForeignKey("Tenant", on_delete=models.CASCADE)
+    rented_property = models.ForeignKey("Property", on_delete=models.CASCADE)
+    month = models.DateField(auto_now=False, auto_now_add=False)
+    expected = models.IntegerField()
+    received = models.IntegerField(default=0)
+    balance = models.IntegerField()
+    payment_count = models.IntegerField(default=0)
+
+    objects = LiveManager(parents=('tenant', 'rented_property'))
+
+    class Meta:
+        unique_together = (('lease', 'month'),)
+        indexes = [
+            models.Index(fields=['landlord', 'month'], name='ledger_landlord_month'),
+        ]
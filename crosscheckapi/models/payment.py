@@ -1,4 +1,5 @@
 from django.db import models
+from .softdelete import LiveManager
 
 class Payment(models.Model):
     date = models.DateField(auto_now=False, auto_now_add=False)
@@ -7,4 +8,25 @@ class Payment(models.Model):
     tenant = models.ForeignKey("Tenant", on_delete=models.CASCADE)
     rented_property = models.ForeignKey("Property", on_delete=models.CASCADE, default=None, blank=True, null=True)
     payment_type = models.ForeignKey("PaymentType", on_delete=models.CASCADE)
-    landlord = models.ForeignKey("Landlord", on_delete=models.CASCADE)
\ No newline at end of file
+    landlord = models.ForeignKey("Landlord", on_delete=models.CASCADE)
+    # Read by GET /sync, see crosscheckapi.sync
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = LiveManager(parents=('tenant', 'rented_property'))
+
+    class Meta:
+        indexes = [
+            # Payments.list: landlord, date range, newest first (and the cursor)
+            models.Index(fields=['landlord', 'date', 'id'], name='payment_landlord_date'),
+            # Payments.list?tenant=
+            models.Index(fields=['landlord', 'tenant', 'date'], name='payment_landlord_tenant'),
+            # Ledger: a tenant's payments inside a lease
+            models.Index(fields=['tenant', 'date'], name='payment_tenant_date'),
+            # Payments.summary: every grouped and summed column, so the
+            # aggregate is answered from the index alone
+            models.Index(
+                fields=['landlord', 'date', 'payment_type', 'tenant', 'rented_property', 'amount'],
+                name='payment_summary'),
+            # GET /sync
+            models.Index(fields=['landlord', 'updated_at'], name='payment_updated'),
+        ]
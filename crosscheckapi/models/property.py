@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Q
+from .softdelete import LiveManager
 
 class Property(models.Model):
     street = models.CharField(max_length=100)
@@ -6,6 +8,19 @@ class Property(models.Model):
     state = models.CharField(max_length=50)
     postal_code = models.CharField(max_length=50)
     landlord = models.ForeignKey("Landlord", on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField(default=None, blank=True, null=True)
+    # Read by GET /sync, see crosscheckapi.sync
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = LiveManager(own=True)
+
+    class Meta:
+        indexes = [
+            # Soft deleted properties awaiting the purge
+            models.Index(fields=['deleted_at'], name='property_deleted',
+                         condition=Q(deleted_at__isnull=False)),
+            models.Index(fields=['landlord', 'updated_at'], name='property_updated'),
+        ]
 
     @property
     def lease(self):
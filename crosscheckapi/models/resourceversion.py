@@ -0,0 +1,14 @@
+from django.db import models
+
+class ResourceVersion(models.Model):
+    """Counter bumped on every write to a resource, per landlord.
+    Maintained by crosscheckapi.versions
+    """
+    resource = models.CharField(max_length=20)
+    # 0 for global resources (payment types). Not a foreign key so
+    # the row survives the cascades that delete a landlord's data
+    landlord_id = models.IntegerField(default=0)
+    version = models.BigIntegerField()
+
+    class Meta:
+        unique_together = (('resource', 'landlord_id'),)
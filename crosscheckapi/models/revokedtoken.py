@@ -0,0 +1,19 @@
+from django.db import models
+from django.utils import timezone
+
+class RevokedToken(models.Model):
+    """A revoked signed token (`jti`), or every token of `user_id`
+    issued up to `revoked_at` when `jti` is empty. Only kept until the
+    tokens it covers would have expired anyway. Maintained by
+    crosscheckapi.tokens
+    """
+    jti = models.CharField(max_length=32, blank=True, default='')
+    # Not a foreign key so the row outlives a deleted user
+    user_id = models.IntegerField()
+    revoked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='revokedtoken_expires'),
+        ]
@@ -1,10 +1,25 @@
 from django.db import models
+from django.db.models import Q
+from .softdelete import LiveManager
 
 class Tenant(models.Model):
     phone_number = models.CharField(max_length=15, default=None, blank=True, null=True)
     email = models.CharField(max_length=150, default=None, blank=True, null=True)
     full_name = models.CharField(max_length=150)
     landlord = models.ForeignKey("Landlord", on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField(default=None, blank=True, null=True)
+    # Read by GET /sync, see crosscheckapi.sync
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = LiveManager(own=True)
+
+    class Meta:
+        indexes = [
+            # Soft deleted tenants awaiting the purge
+            models.Index(fields=['deleted_at'], name='tenant_deleted',
+                         condition=Q(deleted_at__isnull=False)),
+            models.Index(fields=['landlord', 'updated_at'], name='tenant_updated'),
+        ]
 
     @property
     def rented_property(self):
@@ -1,4 +1,46 @@
+from datetime import date
 from django.db import models
+from django.db.models import BooleanField, Case, Q, Value, When
+from .softdelete import LiveManager
+
+
+class LeaseQuerySet(models.QuerySet):
+    """Queries shared by every view that needs to know if a lease is active"""
+
+    def active_on(self, day=None):
+        """Leases that cover `day` (defaults to today), boundaries included"""
+        return self.filter(active_q(day))
+
+    def overlapping(self, start, end):
+        """Leases active on at least one day between `start` and `end`"""
+        return self.filter(overlap_q(start, end))
+
+    def with_active(self, day=None):
+        """Annotate the `active` flag in SQL instead of looping in Python"""
+        return self.annotate(active=Case(
+            When(active_q(day), then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField()
+        ))
+
+
+def active_q(day=None):
+    """A lease is active when lease_start <= day <= lease_end"""
+    day = day or date.today()
+    return Q(lease_start__lte=day, lease_end__gte=day)
+
+
+def overlap_q(start, end):
+    """A lease overlaps [start, end] when lease_start <= end and
+    lease_end >= start, with the same inclusive boundaries as active_q
+    """
+    return Q(lease_start__lte=end, lease_end__gte=start)
+
+
+def covers(lease_start, lease_end, day):
+    """active_q for code holding lease dates in memory"""
+    return lease_start <= day <= lease_end
+
 
 class TenantPropertyRel(models.Model):
     lease_start = models.DateField(auto_now=False, auto_now_add=False)
@@ -6,6 +48,21 @@ class TenantPropertyRel(models.Model):
     rent = models.IntegerField()
     tenant = models.ForeignKey("Tenant", on_delete=models.CASCADE)
     rented_property = models.ForeignKey("Property", on_delete=models.CASCADE)
+    # Read by GET /sync, see crosscheckapi.sync
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = LiveManager.from_queryset(LeaseQuerySet)(parents=('tenant', 'rented_property'))
+
+    class Meta:
+        indexes = [
+            # Leases of a property / of a tenant active on a date
+            models.Index(fields=['rented_property', 'lease_start', 'lease_end'],
+                         name='lease_property_dates'),
+            models.Index(fields=['tenant', 'lease_start', 'lease_end'],
+                         name='lease_tenant_dates'),
+            # GET /sync, joined to the properties of the landlord
+            models.Index(fields=['updated_at'], name='lease_updated'),
+        ]
 
     @property
     def active(self):
@@ -13,4 +70,4 @@ class TenantPropertyRel(models.Model):
 
     @active.setter
     def active(self, value):
-        self.__active = value
\ No newline at end of file
+        self.__active = value
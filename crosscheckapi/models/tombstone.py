@@ -0,0 +1,18 @@
+from django.db import models
+from django.utils import timezone
+
+class Tombstone(models.Model):
+    """A deleted tenant, property, lease or payment, so GET /sync can
+    tell clients to drop it. Maintained by crosscheckapi.signals
+    """
+    # Resource name as in crosscheckapi.versions.RESOURCES
+    resource = models.CharField(max_length=20)
+    # Not foreign keys, the rows are gone
+    landlord_id = models.IntegerField()
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['landlord_id', 'deleted_at'], name='tombstone_landlord'),
+        ]
@@ -0,0 +1,99 @@
+"""Occupancy and vacancy over lease intervals
+
+Leases are closed intervals [lease_start, lease_end], the rule defined
+once by `active_q` and `overlap_q` next to the lease model. The database
+does the range filtering with them. Gaps and overlaps then come from a
+single sweep over each property's leases sorted by start date instead
+of day-by-day loops.
+"""
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+from crosscheckapi.models import Property, TenantPropertyRel
+
+ONE_DAY = timedelta(days=1)
+
+LEASE_FIELDS = ('id', 'rented_property_id', 'tenant_id', 'lease_start', 'lease_end', 'rent')
+
+
+def leases_between(start, end, **filters):
+    """Lease rows overlapping [start, end], by property then start date"""
+    return (TenantPropertyRel.objects.filter(**filters)
+            .overlapping(start, end)
+            .order_by('rented_property_id', 'lease_start', 'id')
+            .values(*LEASE_FIELDS))
+
+
+def sweep(leases, start, end):
+    """Walk leases sorted by lease_start once, clipped to [start, end]
+
+    Returns:
+        dict -- occupied days, vacancy gaps as (first, last) day pairs
+        and overlapping lease id pairs
+    """
+    gaps = []
+    overlaps = []
+    occupied = 0
+    # Day after the end of the occupied span seen so far
+    cursor = start
+    # (lease_end, id) of the leases still running at the current start
+    running = []
+
+    for lease in leases:
+        first = max(lease['lease_start'], start)
+        last = min(lease['lease_end'], end)
+
+        while running and running[0][0] < lease['lease_start']:
+            heapq.heappop(running)
+        overlaps.extend((other, lease['id']) for _, other in sorted(running, key=lambda r: r[1]))
+        heapq.heappush(running, (lease['lease_end'], lease['id']))
+
+        if first > cursor:
+            gaps.append((cursor, first - ONE_DAY))
+        if last >= cursor:
+            occupied += (last - max(first, cursor)).days + 1
+            cursor = last + ONE_DAY
+
+    if cursor <= end:
+        gaps.append((cursor, end))
+
+    return {'occupied_days': occupied, 'gaps': gaps, 'overlaps': overlaps}
+
+
+def portfolio(landlord, start, end, day):
+    """Occupancy of every property of `landlord` between `start` and
+    `end`, plus the leases active on `day`. Three queries
+    """
+    by_property = defaultdict(list)
+    for lease in leases_between(start, end, rented_property__landlord=landlord):
+        by_property[lease['rented_property_id']].append(lease)
+
+    active = defaultdict(list)
+    for rented_property_id, lease_id in (
+            TenantPropertyRel.objects.filter(rented_property__landlord=landlord)
+            .active_on(day).order_by('id').values_list('rented_property_id', 'id')):
+        active[rented_property_id].append(lease_id)
+
+    total_days = (end - start).days + 1
+    rows = []
+    for rental in Property.objects.filter(landlord=landlord).order_by('id').values('id', 'street'):
+        timeline = sweep(by_property.get(rental['id'], []), start, end)
+        rows.append({
+            'id': rental['id'],
+            'street': rental['street'],
+            'active_leases': active.get(rental['id'], []),
+            'occupied_days': timeline['occupied_days'],
+            'vacant_days': total_days - timeline['occupied_days'],
+            'occupancy': round(timeline['occupied_days'] / total_days, 4),
+            'gaps': timeline['gaps'],
+            'overlaps': timeline['overlaps'],
+        })
+    return rows
+
+
+def property_timeline(rented_property_id, start, end):
+    """Leases, vacancy gaps and overlapping leases of one property"""
+    leases = list(leases_between(start, end, rented_property_id=rented_property_id))
+    timeline = sweep(leases, start, end)
+    timeline['leases'] = leases
+    return timeline
@@ -0,0 +1,73 @@
+"""Keyset (cursor) pagination for the plain ViewSets"""
+import base64
+from datetime import date
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(day, pk):
+    """Opaque cursor pointing at the last row of a page"""
+    raw = f'{day.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the (date, id) pair stored in a cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        day, pk = raw.split('|')
+        day, pk = date.fromisoformat(day), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    # Ids are positive 64 bit integers, the database rejects anything larger
+    if not 0 < pk < 2 ** 63:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return day, pk
+
+
+def page_size(request):
+    """Page size requested by the client, capped at MAX_PAGE_SIZE"""
+    size = request.query_params.get('page_size', None)
+    if size is None:
+        return settings.REST_FRAMEWORK.get('PAGE_SIZE', 10)
+    try:
+        return max(1, min(int(size), MAX_PAGE_SIZE))
+    except ValueError:
+        raise ValidationError({'page_size': 'Must be an integer'})
+
+
+def keyset_page(queryset, request, field='date'):
+    """Slice one page of `queryset` ordered by (`field` DESC, id DESC)
+
+    The cursor holds the sort key of the last row already sent, so the
+    next page is found with an index range scan instead of an OFFSET.
+    Works on model instances and on `values()` rows.
+    Returns:
+        tuple -- (list of rows, next cursor or None)
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+
+    cursor = request.query_params.get('cursor', '')
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': last_value}) |
+            Q(**{field: last_value, 'id__lt': last_id})
+        )
+
+    size = page_size(request)
+    rows = list(queryset[:size + 1])
+
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor(last[field], last['id'])
+        else:
+            next_cursor = encode_cursor(getattr(last, field), last.id)
+
+    return rows, next_cursor
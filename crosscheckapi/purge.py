@@ -0,0 +1,83 @@
+"""Soft deletes of tenants and properties and their background purge
+
+Deleting a tenant or property through the API is one UPDATE setting
+`deleted_at`. The default managers hide it and every payment, lease
+and ledger entry pointing to it right away. `manage.py purge_deleted`
+removes those rows later in batches of PURGE_BATCH_SIZE, each a plain
+DELETE ... WHERE id IN in its own short transaction, instead of the
+deletion collector loading every cascaded row inside the request. It
+also drops the sync tombstones older than SYNC['TOMBSTONE_DAYS'].
+"""
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from crosscheckapi import search
+from crosscheckapi.bulk import raw_delete
+from crosscheckapi.models import LedgerEntry, Payment, Property, Tenant, TenantPropertyRel, Tombstone
+from crosscheckapi.signals import bulk_deleted
+
+# (model, foreign key) of the rows removed with a tenant or property,
+# children before their parents
+CASCADES = {
+    Tenant: [
+        (LedgerEntry, 'tenant_id'),
+        (Payment, 'tenant_id'),
+        (TenantPropertyRel, 'tenant_id'),
+    ],
+    Property: [
+        (LedgerEntry, 'rented_property_id'),
+        (Payment, 'rented_property_id'),
+        (TenantPropertyRel, 'rented_property_id'),
+    ],
+}
+
+
+def soft_delete(instance, landlord):
+    """Hide a tenant or property and everything pointing to it"""
+    model = type(instance)
+    model._base_manager.filter(pk=instance.pk).update(deleted_at=timezone.now())
+    bulk_deleted.send(sender=model, landlord=landlord, ids=[instance.pk])
+
+
+def purge_rows(model, batch_size, pause=0, **filters):
+    """Delete the rows matching `filters` in batches. Returns the count"""
+    rows = model._base_manager.filter(**filters).values_list('id', flat=True)
+    count = 0
+    while True:
+        with transaction.atomic():
+            ids = list(rows[:batch_size])
+            if not ids:
+                return count
+            if model in search.SEARCH_FIELDS:
+                search.unindex(model, ids)
+            raw_delete(model._base_manager.filter(pk__in=ids))
+        count += len(ids)
+        # Let other writers take the locks between batches
+        time.sleep(pause)
+
+
+def purge(before=None, batch_size=None, pause=0):
+    """Remove the tenants and properties soft deleted before `before`
+    (all by default) and the rows pointing to them
+    Returns:
+        Counter -- deleted rows per model
+    """
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    counts = Counter()
+    for model, cascades in CASCADES.items():
+        doomed = model._base_manager.filter(deleted_at__isnull=False)
+        if before is not None:
+            doomed = doomed.filter(deleted_at__lt=before)
+
+        for pk in list(doomed.values_list('id', flat=True)):
+            for child, field in cascades:
+                counts[child] += purge_rows(child, batch_size, pause, **{field: pk})
+            counts[model] += raw_delete(model._base_manager.filter(pk=pk))
+
+    # GET /sync refuses cursors older than this, their tombstones can go
+    expired = timezone.now() - timedelta(days=settings.SYNC['TOMBSTONE_DAYS'])
+    counts[Tombstone] += purge_rows(Tombstone, batch_size, pause, deleted_at__lt=expired)
+    return counts
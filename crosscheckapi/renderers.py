@@ -0,0 +1,69 @@
+"""Renderers for the formats the API can answer with"""
+import csv
+import io
+import json
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """The default renderer. Encodes with orjson when it is installed,
+    several times faster than the stdlib on long lists, and falls back
+    to DRF's JSONRenderer otherwise or when indentation is asked for.
+
+    Dates, times, decimals and the other types orjson does not handle
+    like DRF go through DRF's encoder, so both produce the same JSON.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        content = orjson.dumps(
+            data, default=JSONEncoder().default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        # Escaped by JSONRenderer as well, they end a line in JavaScript
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+
+class CSVRenderer(BaseRenderer):
+    """Selected with `?format=csv`. Export views stream their own body,
+    this only renders error responses
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        buffer = io.StringIO()
+        if rows and isinstance(rows[0], dict):
+            writer = csv.DictWriter(buffer, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        return buffer.getvalue().encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Selected with `?format=ndjson`, one JSON document per line"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, default=str) + '\n' for row in rows).encode(self.charset)
@@ -0,0 +1,145 @@
+"""Indexed substring search behind the `search` and `keyword` query parameters
+
+On PostgreSQL the `icontains` lookups are served by trigram GIN indexes
+on UPPER(column), which is the expression Django's `icontains` compiles to.
+On SQLite every searchable model gets an FTS5 shadow table using the
+trigram tokenizer, kept in sync by the signals in `crosscheckapi.signals`.
+
+Both backends only decide which rows match. `search` orders them the
+same way on either database: rows with a column equal to the term
+first, then rows with a column starting with it, then the rest, each
+group by id.
+"""
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from crosscheckapi.models import Payment, Property, Tenant
+
+# Searchable columns for each model
+SEARCH_FIELDS = {
+    Tenant: ('phone_number', 'email', 'full_name'),
+    Property: ('street', 'city', 'state', 'postal_code'),
+    Payment: ('ref_num',),
+}
+
+# The trigram tokenizer can not match anything shorter than this
+MIN_TERM_LENGTH = 3
+
+_fts_tables = {}
+
+
+def fts_table(model):
+    """Name of the SQLite FTS5 shadow table for a model"""
+    return f'{model._meta.db_table}_search'
+
+
+def fts_enabled(using=connection):
+    """True when the database has the FTS5 shadow tables"""
+    if using.vendor != 'sqlite':
+        return False
+    if using.alias not in _fts_tables:
+        _fts_tables[using.alias] = set(using.introspection.table_names())
+    return fts_table(Tenant) in _fts_tables[using.alias]
+
+
+def reset():
+    """Forget which shadow tables exist, e.g. after migrating"""
+    _fts_tables.clear()
+
+
+def search_q(model, term, fields=None, prefix=''):
+    """Build a Q object matching `term` against the model's searchable columns
+
+    Arguments:
+        model -- one of the models in SEARCH_FIELDS
+        term -- the text typed by the user
+        fields -- limit the match to some of the searchable columns
+        prefix -- lookup path when filtering a related model, e.g. 'tenant__'
+    """
+    fields = fields or SEARCH_FIELDS[model]
+
+    if fts_enabled() and len(term) >= MIN_TERM_LENGTH:
+        phrase = '"' + term.replace('"', '""') + '"'
+        match = '{' + ' '.join(fields) + '} : ' + phrase
+        sql = f'SELECT rowid FROM {fts_table(model)} WHERE {fts_table(model)} MATCH %s'
+        return Q(**{f'{prefix}id__in': RawSQL(sql, (match,))})
+
+    query = Q()
+    for field in fields:
+        query |= Q(**{f'{prefix}{field}__icontains': term})
+    return query
+
+
+def relevance(model, term):
+    """Expression ordering rows by how well they match `term`: 0 when a
+    column equals it, 1 when a column starts with it, 2 otherwise
+    """
+    exact = Q()
+    starts = Q()
+    for field in SEARCH_FIELDS[model]:
+        exact |= Q(**{f'{field}__iexact': term})
+        starts |= Q(**{f'{field}__istartswith': term})
+    return Case(
+        When(exact, then=Value(0)), When(starts, then=Value(1)),
+        default=Value(2), output_field=IntegerField())
+
+
+def search(queryset, term):
+    """Filter a queryset of a searchable model by `term`, best matches first"""
+    model = queryset.model
+    return queryset.filter(search_q(model, term)).order_by(relevance(model, term), 'id')
+
+
+def index_instance(instance):
+    """Add or refresh a row in the shadow table"""
+    model = type(instance)
+    if not fts_enabled():
+        return
+    fields = SEARCH_FIELDS[model]
+    values = [getattr(instance, field) or '' for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {fts_table(model)} WHERE rowid = %s', [instance.pk])
+        cursor.execute(
+            f'INSERT INTO {fts_table(model)} (rowid, {", ".join(fields)}) '
+            f'VALUES (%s, {", ".join(["%s"] * len(fields))})',
+            [instance.pk, *values]
+        )
+
+
+def unindex_instance(instance):
+    """Remove a row from the shadow table"""
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {fts_table(type(instance))} WHERE rowid = %s', [instance.pk])
+
+
+def unindex(model, ids):
+    """Remove the shadow table rows of deleted objects"""
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {fts_table(model)} WHERE rowid IN ({", ".join(["%s"] * len(ids))})',
+            list(ids))
+
+
+def reindex(queryset):
+    """Refresh the shadow table rows of every object in `queryset`
+    with two statements, for rows written in bulk
+    """
+    model = queryset.model
+    if not fts_enabled():
+        return
+    fields = SEARCH_FIELDS[model]
+    table = fts_table(model)
+    ids_sql, params = queryset.values('id').query.sql_with_params()
+    columns = ", ".join(f"COALESCE({field}, '')" for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE rowid IN ({ids_sql})', params)
+        cursor.execute(
+            f'INSERT INTO {table} (rowid, {", ".join(fields)}) '
+            f'SELECT id, {columns} FROM {model._meta.db_table} WHERE id IN ({ids_sql})',
+            params
+        )
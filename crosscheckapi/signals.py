@@ -0,0 +1,272 @@
+"""Signal receivers keeping derived data in sync with the models"""
+from django.conf import settings
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.contrib.auth.models import User
+from django.dispatch import Signal, receiver
+from rest_framework.authtoken.models import Token
+from crosscheckapi import events, ledger, search, sync, tokens, typeahead, versions
+from crosscheckapi.authentication import credentials
+from crosscheckapi.models import (
+    Landlord, Payment, PaymentType, Property, Tenant, TenantPropertyRel
+)
+
+# Sent after rows were written with bulk_create, bulk_update or
+# QuerySet.update(), which skip post_save.
+# Arguments: landlord, queryset -- the rows that changed, and for
+# payments optionally tenant_ids -- tenants some of them moved away from.
+# For payments and leases, rebuild_ledger=False when the sender
+# rebuilds the ledger itself
+bulk_saved = Signal()
+
+# Sent after rows were deleted without post_delete for each of them,
+# or soft deleted (tenants and properties).
+# Arguments: landlord, ids -- the deleted rows, and for payments
+# tenant_ids -- their tenants
+bulk_deleted = Signal()
+
+
+@receiver(post_save, sender=Tenant)
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=Payment)
+def index_search(sender, instance, **kwargs):
+    """Refresh the search shadow table row"""
+    search.index_instance(instance)
+
+
+@receiver(bulk_saved)
+def index_search_bulk(sender, queryset, **kwargs):
+    """Refresh the search shadow table for rows written in bulk"""
+    if sender in search.SEARCH_FIELDS:
+        search.reindex(queryset)
+
+
+@receiver(post_delete, sender=Tenant)
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=Payment)
+def unindex_search(sender, instance, **kwargs):
+    """Drop the search shadow table row"""
+    search.unindex_instance(instance)
+
+
+@receiver(bulk_deleted)
+def unindex_search_bulk(sender, ids, **kwargs):
+    if sender in search.SEARCH_FIELDS:
+        search.unindex(sender, ids)
+
+
+@receiver(post_migrate)
+def reset_search(sender, **kwargs):
+    """The shadow tables may have been created or dropped"""
+    search.reset()
+
+
+def payment_key(payment):
+    """The values deciding which lease months a payment counts toward"""
+    day = Payment._meta.get_field('date').to_python(payment.date)
+    return (payment.tenant_id, day, payment.rented_property_id)
+
+
+@receiver(pre_save, sender=Payment)
+def remember_ledger_payment(sender, instance, **kwargs):
+    """Keep the stored values so the old lease month can be refreshed"""
+    instance._ledger_previous = None
+    if instance.pk is not None:
+        instance._ledger_previous = Payment.objects.filter(pk=instance.pk).values_list(
+            'tenant_id', 'date', 'rented_property_id').first()
+
+
+@receiver(post_save, sender=Payment)
+def update_ledger_payment(sender, instance, **kwargs):
+    """Refresh the lease months the payment moved out of and into"""
+    current = payment_key(instance)
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous is not None and previous != current:
+        ledger.refresh_payment(*previous)
+    ledger.refresh_payment(*current)
+
+
+@receiver(post_delete, sender=Payment)
+def delete_ledger_payment(sender, instance, **kwargs):
+    ledger.refresh_payment(*payment_key(instance))
+
+
+@receiver(bulk_saved, sender=Payment)
+def update_ledger_bulk(sender, queryset, tenant_ids=(), rebuild_ledger=True, **kwargs):
+    if not rebuild_ledger:
+        return
+    ledger.rebuild_tenants(queryset.values('tenant_id').distinct())
+    if tenant_ids:
+        ledger.rebuild_tenants(tenant_ids)
+
+
+@receiver(bulk_deleted, sender=Payment)
+def delete_ledger_bulk(sender, tenant_ids, **kwargs):
+    ledger.rebuild_tenants(tenant_ids)
+
+
+@receiver(post_save, sender=TenantPropertyRel)
+def update_ledger_lease(sender, instance, **kwargs):
+    """A new or edited lease changes its months and expected rent.
+    Deleted leases take their entries with them through the cascade
+    """
+    ledger.rebuild_lease(instance)
+
+
+@receiver(bulk_saved, sender=TenantPropertyRel)
+def update_ledger_leases_bulk(sender, queryset, rebuild_ledger=True, **kwargs):
+    if rebuild_ledger:
+        ledger.rebuild(queryset)
+
+
+@receiver(post_save, sender=Tenant)
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=TenantPropertyRel)
+@receiver(post_save, sender=Payment)
+@receiver(post_save, sender=PaymentType)
+@receiver(post_delete, sender=Tenant)
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=TenantPropertyRel)
+@receiver(post_delete, sender=Payment)
+@receiver(post_delete, sender=PaymentType)
+def bump_version(sender, instance, **kwargs):
+    """Cached list responses and ETags of the resource are stale"""
+    versions.bump_instance(instance)
+
+
+@receiver(bulk_saved)
+@receiver(bulk_deleted)
+def bump_version_bulk(sender, landlord, **kwargs):
+    if sender in versions.RESOURCES:
+        versions.bump(versions.RESOURCES[sender], landlord.id if landlord else 0)
+
+
+@receiver(bulk_deleted, sender=Tenant)
+@receiver(bulk_deleted, sender=Property)
+def bump_cascaded_versions(sender, landlord, **kwargs):
+    """Leases and payments of soft deleted rows are hidden with them"""
+    for resource in ('leases', 'payments'):
+        versions.bump(resource, landlord.id if landlord else 0)
+
+
+
+@receiver(post_delete, sender=Tenant)
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=TenantPropertyRel)
+@receiver(post_delete, sender=Payment)
+def bury_instance(sender, instance, **kwargs):
+    """Tell clients syncing incrementally to drop the row"""
+    landlord_id = versions.landlord_of(instance)
+    if landlord_id is not None:
+        sync.bury(versions.RESOURCES[sender], landlord_id, [instance.pk])
+
+
+@receiver(bulk_deleted)
+def bury_bulk(sender, landlord, ids, **kwargs):
+    if landlord is None or sender not in sync.CASCADED:
+        return
+    sync.bury(versions.RESOURCES[sender], landlord.id, ids)
+    # Hidden along with a soft deleted tenant or property
+    sync.bury_cascaded(sender, landlord.id, ids)
+
+
+def publish_instance(instance, action):
+    """Push the change to the landlord's open event streams"""
+    if not events.listening():
+        return
+    landlord_id = versions.landlord_of(instance)
+    if landlord_id is not None and events.listening(landlord_id):
+        events.publish(landlord_id, versions.RESOURCES[type(instance)], action, [instance.pk])
+
+
+@receiver(post_save, sender=Tenant)
+@receiver(post_save, sender=Property)
+@receiver(post_save, sender=TenantPropertyRel)
+@receiver(post_save, sender=Payment)
+def publish_saved(sender, instance, **kwargs):
+    publish_instance(instance, 'saved')
+
+
+@receiver(post_delete, sender=Tenant)
+@receiver(post_delete, sender=Property)
+@receiver(post_delete, sender=TenantPropertyRel)
+@receiver(post_delete, sender=Payment)
+def publish_deleted(sender, instance, **kwargs):
+    publish_instance(instance, 'deleted')
+
+
+@receiver(bulk_saved)
+def publish_bulk_saved(sender, landlord, queryset, **kwargs):
+    if sender in sync.CASCADED and landlord is not None and events.listening(landlord.id):
+        # One id more than sent tells there were too many
+        ids = queryset.values_list('id', flat=True)[:settings.EVENTS['MAX_IDS'] + 1]
+        events.publish(landlord.id, versions.RESOURCES[sender], 'saved', ids)
+
+
+@receiver(bulk_deleted)
+def publish_bulk_deleted(sender, landlord, ids, **kwargs):
+    if sender in sync.CASCADED and landlord is not None and events.listening(landlord.id):
+        events.publish(landlord.id, versions.RESOURCES[sender], 'deleted', ids)
+        # Hidden along with a soft deleted tenant or property
+        for model, _ in sync.CASCADED[sender]:
+            events.publish(landlord.id, versions.RESOURCES[model], 'deleted')
+
+
+@receiver(post_save, sender=Tenant)
+@receiver(post_save, sender=Property)
+def typeahead_saved(sender, instance, **kwargs):
+    """Update the landlord's typeahead index, if this process built it"""
+    if instance.deleted_at is not None:
+        typeahead.deleted(sender, instance.landlord_id, [instance.pk])
+        return
+    columns = typeahead.SOURCES[typeahead.TYPES[sender]][1]
+    typeahead.saved(sender, instance.landlord_id, [tuple(getattr(instance, column) for column in columns)])
+
+
+@receiver(post_delete, sender=Tenant)
+@receiver(post_delete, sender=Property)
+def typeahead_deleted(sender, instance, **kwargs):
+    typeahead.deleted(sender, instance.landlord_id, [instance.pk])
+
+
+@receiver(bulk_saved)
+def typeahead_bulk_saved(sender, landlord, queryset, **kwargs):
+    if sender in typeahead.TYPES and landlord is not None and typeahead.indexes.loaded(landlord.id):
+        columns = typeahead.SOURCES[typeahead.TYPES[sender]][1]
+        typeahead.saved(sender, landlord.id, queryset.values_list(*columns))
+
+
+@receiver(bulk_deleted)
+def typeahead_bulk_deleted(sender, landlord, ids, **kwargs):
+    if sender in typeahead.TYPES and landlord is not None:
+        typeahead.deleted(sender, landlord.id, ids)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    credentials.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    """Deactivated or deleted users must not stay authenticated"""
+    credentials.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def revoke_inactive_user_tokens(sender, instance, created, **kwargs):
+    """Signed tokens are checked without reading the user, deny them"""
+    if settings.SIGNED_TOKENS['ENABLED'] and not created and not instance.is_active:
+        tokens.denylist.revoke_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    if settings.SIGNED_TOKENS['ENABLED']:
+        tokens.denylist.revoke_user(instance.pk)
+
+
+@receiver(post_save, sender=Landlord)
+@receiver(post_delete, sender=Landlord)
+def forget_landlord(sender, instance, **kwargs):
+    credentials.invalidate_user(instance.user_id)
@@ -0,0 +1,198 @@
+"""Year-end payment statements of every tenant of a landlord
+
+The database work is three queries: the tenants with their leases of
+the year, the expected rent per tenant from the ledger, and every
+payment of the year in one streamed query ordered by tenant. A single
+merge pass over the payment stream builds one plain dict per tenant.
+Batches of those are rendered to CSV and HTML in a process pool and
+written into a zip archive as they come back, in tenant order, with at
+most a few batches per process in flight so memory stays flat.
+"""
+import csv
+import html
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import django
+from django.conf import settings
+from django.db.models import Sum
+from crosscheckapi.models import LedgerEntry, Payment, Tenant, TenantPropertyRel
+
+FORMATS = ('csv', 'html')
+
+# Tenants rendered per task sent to the pool
+BATCH_SIZE = 200
+
+# Batches submitted per process before waiting for the oldest one
+IN_FLIGHT = 2
+
+PAYMENT_HEADERS = ('date', 'amount', 'ref_num', 'payment_type', 'property')
+
+
+def slug(value):
+    return re.sub(r'[^a-z0-9]+', '-', value.lower()).strip('-') or 'tenant'
+
+
+def collect(landlord, year):
+    """Yield one statement dict per tenant with a lease or a payment in `year`"""
+    start, end = date(year, 1, 1), date(year, 12, 31)
+
+    leases = defaultdict(list)
+    for row in (TenantPropertyRel.objects.filter(rented_property__landlord=landlord)
+                .overlapping(start, end).order_by('tenant_id', 'lease_start')
+                .values_list('tenant_id', 'rented_property__street', 'rented_property__city',
+                             'lease_start', 'lease_end', 'rent')):
+        leases[row[0]].append(row[1:])
+
+    expected = dict(
+        LedgerEntry.objects.filter(landlord=landlord, month__range=(start, end))
+        .values('tenant_id').annotate(total=Sum('expected'))
+        .values_list('tenant_id', 'total'))
+
+    payments = iter(
+        Payment.objects.filter(landlord=landlord, date__range=(start, end))
+        .order_by('tenant_id', 'date', 'id')
+        .values_list('tenant_id', 'date', 'amount', 'ref_num',
+                     'payment_type__label', 'rented_property__street')
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE))
+    pending = next(payments, None)
+
+    tenants = (Tenant.objects.filter(landlord=landlord).order_by('id')
+               .values_list('id', 'full_name', 'email', 'phone_number'))
+    for tenant_id, full_name, email, phone_number in tenants.iterator():
+        # Both sides are ordered by tenant id, so each payment is
+        # looked at once. Payments of tenants that are not listed (of
+        # another landlord, or soft deleted) are skipped
+        while pending is not None and pending[0] < tenant_id:
+            pending = next(payments, None)
+        rows = []
+        while pending is not None and pending[0] == tenant_id:
+            rows.append(pending[1:])
+            pending = next(payments, None)
+
+        if not rows and tenant_id not in leases:
+            continue
+        yield {
+            'id': tenant_id,
+            'name': full_name,
+            'email': email or '',
+            'phone_number': phone_number or '',
+            'year': year,
+            'leases': leases.get(tenant_id, []),
+            'payments': rows,
+            'expected': expected.get(tenant_id, 0),
+        }
+
+
+def render_csv(statement):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(PAYMENT_HEADERS)
+    for day, amount, ref_num, payment_type, street in statement['payments']:
+        writer.writerow((day.isoformat(), amount, ref_num, payment_type, street or ''))
+    return buffer.getvalue()
+
+
+def render_html(statement):
+    escape = html.escape
+    received = sum(row[1] for row in statement['payments'])
+    leases = ''.join(
+        f'<tr><td>{escape(street)}, {escape(city)}</td><td>{start}</td><td>{end}</td>'
+        f'<td>{rent}</td></tr>'
+        for street, city, start, end, rent in statement['leases'])
+    payments = ''.join(
+        f'<tr><td>{day}</td><td>{amount}</td><td>{escape(ref_num)}</td>'
+        f'<td>{escape(payment_type)}</td><td>{escape(street or "")}</td></tr>'
+        for day, amount, ref_num, payment_type, street in statement['payments'])
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>{statement["year"]} statement - {escape(statement["name"])}</title>'
+        '<style>body{font-family:sans-serif}table{border-collapse:collapse}'
+        'td,th{border:1px solid #999;padding:2px 8px}</style></head><body>'
+        f'<h1>{statement["year"]} payment statement</h1>'
+        f'<p>{escape(statement["name"])}<br>{escape(statement["email"])}<br>'
+        f'{escape(statement["phone_number"])}</p>'
+        '<h2>Leases</h2><table><tr><th>Property</th><th>Start</th><th>End</th>'
+        f'<th>Rent</th></tr>{leases}</table>'
+        '<h2>Payments</h2><table><tr><th>Date</th><th>Amount</th><th>Reference</th>'
+        f'<th>Type</th><th>Property</th></tr>{payments}</table>'
+        f'<p>Expected: {statement["expected"]}<br>Received: {received}<br>'
+        f'Balance: {statement["expected"] - received}</p></body></html>'
+    )
+
+
+RENDERERS = {'csv': render_csv, 'html': render_html}
+
+
+def render_batch(statements, formats):
+    """Runs in a pool process. Returns (archive name, encoded text)
+    pairs and the summary row of every statement
+    """
+    files = []
+    summary = []
+    for statement in statements:
+        name = f'{statement["id"]}-{slug(statement["name"])}'
+        for fmt in formats:
+            files.append((f'{fmt}/{name}.{fmt}', RENDERERS[fmt](statement).encode()))
+        received = sum(row[1] for row in statement['payments'])
+        summary.append((statement['id'], statement['name'], len(statement['payments']),
+                        statement['expected'], received, statement['expected'] - received))
+    return files, summary
+
+
+def batches(statements, size):
+    batch = []
+    for statement in statements:
+        batch.append(statement)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(landlord, year, file, formats=FORMATS, workers=None, progress=None):
+    """Write the statements of `landlord` for `year` into a zip archive
+    in the binary `file`. `progress(done, total)` gets the number of
+    statements written so far out of the landlord's tenants, an upper
+    bound since tenants without leases or payments that year are skipped
+    Returns:
+        int -- number of statements
+    """
+    workers = workers or os.cpu_count() or 1
+    summary = io.StringIO()
+    writer = csv.writer(summary)
+    writer.writerow(('tenant_id', 'name', 'payments', 'expected', 'received', 'balance'))
+    count = 0
+    total = Tenant.objects.filter(landlord=landlord).count() if progress else None
+
+    # Spawned, not forked, like the job worker's process pool
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=django.setup) as executor, \
+            zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED) as archive:
+
+        def write(future):
+            nonlocal count
+            files, rows = future.result()
+            for name, content in files:
+                archive.writestr(name, content)
+            writer.writerows(rows)
+            count += len(rows)
+            if progress:
+                progress(count, total)
+
+        running = deque()
+        for batch in batches(collect(landlord, year), BATCH_SIZE):
+            running.append(executor.submit(render_batch, batch, formats))
+            if len(running) >= workers * IN_FLIGHT:
+                write(running.popleft())
+        while running:
+            write(running.popleft())
+
+        archive.writestr('summary.csv', summary.getvalue())
+    return count
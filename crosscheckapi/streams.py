@@ -0,0 +1,147 @@
+"""ASGI endpoint streaming the change events of crosscheckapi.events
+
+    GET /events
+    Authorization: Token <key>    (or Bearer <signed access token>)
+
+Browsers' EventSource can not send headers, `?token=` works as well.
+Every event is one `data:` line of JSON, see crosscheckapi.events.
+The credentials are checked again every EVENTS['REAUTH_SECONDS'], the
+stream ends once they are revoked or expired.
+Served by crosscheck.asgi next to the Django application, Django 3.1
+has no asynchronous streaming responses.
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import exceptions
+from crosscheckapi import events
+from crosscheckapi.authentication import CachedTokenAuthentication, SignedTokenAuthentication
+
+HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    # Proxies must pass every event on right away
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def authorization(scope):
+    """The Authorization header, or the `token` query parameter as one"""
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            return value.decode('latin-1')
+    token = parse_qs(scope['query_string'].decode('latin-1')).get('token')
+    if token:
+        keyword = 'Bearer' if token[0].startswith('a.') else 'Token'
+        return f'{keyword} {token[0]}'
+    return None
+
+
+def resolve_landlord(header):
+    """Landlord id of the credentials, with the authentication classes
+    of the API. None when they are missing or invalid
+    """
+    request = SimpleNamespace(META={'HTTP_AUTHORIZATION': header}, landlord=None)
+    try:
+        for authentication in (CachedTokenAuthentication(), SignedTokenAuthentication()):
+            if authentication.authenticate(request) is not None:
+                return request.landlord.id if request.landlord else None
+    except exceptions.AuthenticationFailed:
+        pass
+    return None
+
+
+@sync_to_async
+def authenticate(header):
+    """resolve_landlord() in the thread Django runs requests in, handling
+    its database connection like a request would
+    """
+    close_old_connections()
+    try:
+        return resolve_landlord(header)
+    finally:
+        close_old_connections()
+
+
+def encode(event):
+    return b'data: ' + json.dumps(event, separators=(',', ':')).encode() + b'\n\n'
+
+
+async def respond(send, status, reason):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({"reason": reason}).encode()})
+
+
+async def disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_events(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await respond(send, 405, 'Use GET')
+
+    header = authorization(scope)
+    landlord_id = header and await authenticate(header)
+    if landlord_id is None:
+        return await respond(send, 401, 'Invalid or missing credentials')
+
+    events.get_backend().start()
+    subscription = events.hub.subscribe(landlord_id)
+    gone = asyncio.ensure_future(disconnected(receive))
+    # Stays pending while the stream is idle, a heartbeat does not replace it
+    next_event = None
+    heartbeat = settings.EVENTS['HEARTBEAT_SECONDS']
+    reauth = settings.EVENTS['REAUTH_SECONDS']
+    loop = asyncio.get_running_loop()
+    recheck = loop.time() + reauth
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': HEADERS})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(subscription.next())
+            await asyncio.wait({next_event, gone}, timeout=heartbeat,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if gone.done():
+                break
+            # On a clock of its own, busy streams never wait a whole heartbeat
+            if loop.time() >= recheck:
+                if await authenticate(header) != landlord_id:
+                    await send({'type': 'http.response.body', 'body': b': credentials revoked\n\n'})
+                    break
+                recheck = loop.time() + reauth
+            if next_event.done():
+                body = encode(next_event.result())
+                next_event = None
+            else:
+                body = b': ping\n\n'
+            # Waits while the client's socket buffer is full, the
+            # subscription's bounded queue takes the backpressure
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        events.hub.unsubscribe(subscription)
+        for task in (gone, next_event):
+            if task is not None:
+                task.cancel()
+
+
+class EventStreamRouter:
+    """Sends requests for `path` to the event stream and everything
+    else to the Django application
+    """
+
+    def __init__(self, application, path='/events'):
+        self.application = application
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            return await stream_events(scope, receive, send)
+        return await self.application(scope, receive, send)
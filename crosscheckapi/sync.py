@@ -0,0 +1,139 @@
+"""Incremental sync: the rows changed and deleted since a cursor
+
+Tenants, properties, leases and payments carry `updated_at`, set on
+every save and by the bulk writes. Deletes, including the rows hidden
+with a soft deleted tenant or property, leave a Tombstone.
+
+The cursor is the server time the sync started, in microseconds.
+A row saved just before that by a transaction still open would be
+missed, so every sync reaches OVERLAP_SECONDS further back: clients
+may receive a row twice and must apply changes as upserts. Cursors
+older than the tombstones kept (TOMBSTONE_DAYS) are refused, the client
+has to start again without one.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from crosscheckapi import versions
+from crosscheckapi.models import Payment, Property, Tenant, TenantPropertyRel, Tombstone
+
+# resource -> (model, landlord lookup, columns sent)
+RESOURCES = {
+    'tenants': (Tenant, 'landlord', ('id', 'full_name', 'email', 'phone_number')),
+    'properties': (Property, 'landlord', ('id', 'street', 'city', 'state', 'postal_code')),
+    'leases': (TenantPropertyRel, 'rented_property__landlord', (
+        'id', 'tenant_id', 'rented_property_id', 'lease_start', 'lease_end', 'rent')),
+    'payments': (Payment, 'landlord', (
+        'id', 'date', 'amount', 'ref_num', 'tenant_id', 'rented_property_id', 'payment_type_id')),
+}
+
+# model -> (child, foreign key) of the rows a bulk delete of the model
+# also hides, see crosscheckapi.purge
+CASCADED = {
+    Tenant: [(TenantPropertyRel, 'tenant_id'), (Payment, 'tenant_id')],
+    Property: [(TenantPropertyRel, 'rented_property_id'), (Payment, 'rented_property_id')],
+    TenantPropertyRel: [],
+    Payment: [],
+}
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def encode_cursor(moment):
+    return str(int(moment.timestamp() * 1_000_000))
+
+
+def decode_cursor(cursor):
+    """Raises ValueError for anything but a cursor sent by encode_cursor"""
+    microseconds = int(cursor)
+    if microseconds < 0:
+        raise ValueError(f'Negative cursor: {cursor}')
+    try:
+        return datetime.fromtimestamp(microseconds / 1_000_000, dt_timezone.utc)
+    except (OverflowError, OSError):
+        # Past the dates the platform can represent
+        raise ValueError(f'Cursor out of range: {cursor}')
+
+
+def serialize(row, columns):
+    """Flat JSON for one `values_list(*columns)` row. Foreign keys lose
+    their `_id`, clients join them with the other resources
+    """
+    data = {}
+    for column, value in zip(columns, row):
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        data[column[:-3] if column.endswith('_id') else column] = value
+    return data
+
+
+def changes(landlord, cursor=None):
+    """Rows changed and deleted since `cursor`, every live row without one
+    Returns:
+        dict -- the new cursor, changed rows per resource and deleted ids
+        per resource
+    """
+    now = timezone.now()
+    options = settings.SYNC
+    since = None
+    if cursor:
+        since = decode_cursor(cursor)
+        if since < now - timedelta(days=options['TOMBSTONE_DAYS']):
+            raise CursorExpired('Cursor expired, sync again without one')
+        since -= timedelta(seconds=options['OVERLAP_SECONDS'])
+
+    result = {}
+    deleted = {}
+    for resource, (model, owner, columns) in RESOURCES.items():
+        rows = model.objects.filter(**{owner: landlord})
+        if since is not None:
+            rows = rows.filter(updated_at__gt=since)
+        result[resource] = [serialize(row, columns) for row in rows.order_by('id').values_list(*columns)]
+        deleted[resource] = []
+
+    if since is not None:
+        tombstones = (Tombstone.objects.filter(landlord_id=landlord.id, deleted_at__gt=since)
+                      .order_by('id').values_list('resource', 'object_id'))
+        for resource, object_id in tombstones:
+            deleted[resource].append(object_id)
+
+    # Never behind a cursor sent earlier, even if the clock went back
+    cursor = encode_cursor(max(now, since + timedelta(seconds=options['OVERLAP_SECONDS']))
+                           if since is not None else now)
+    return {"cursor": cursor, **result, "deleted": deleted}
+
+
+def bury(resource, landlord_id, ids):
+    """Record deleted rows of `resource`"""
+    now = timezone.now()
+    Tombstone.objects.bulk_create([
+        Tombstone(resource=resource, landlord_id=landlord_id, object_id=pk, deleted_at=now)
+        for pk in ids
+    ])
+
+
+def bury_cascaded(model, landlord_id, ids):
+    """Record the rows hidden with soft deleted `model` rows, with one
+    INSERT ... SELECT instead of reading their ids first
+    """
+    if not CASCADED[model]:
+        return
+    quote = connection.ops.quote_name
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    selects = []
+    params = []
+    for child, field in CASCADED[model]:
+        placeholders = ', '.join(['%s'] * len(ids))
+        selects.append(
+            f'SELECT %s, %s, {quote("id")}, %s FROM {quote(child._meta.db_table)} '
+            f'WHERE {quote(field)} IN ({placeholders})')
+        params += [versions.RESOURCES[child], landlord_id, now, *ids]
+
+    columns = ', '.join(quote(name) for name in ('resource', 'landlord_id', 'object_id', 'deleted_at'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(Tombstone._meta.db_table)} ({columns}) '
+            + ' UNION ALL '.join(selects), params)
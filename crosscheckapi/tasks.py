@@ -0,0 +1,95 @@
+"""Handlers of the background job kinds, see crosscheckapi.jobs"""
+import tempfile
+from django.core.files import File
+from django.utils.dateparse import parse_datetime
+from crosscheckapi import ledger, statements
+from crosscheckapi.export import (
+    FORMATS, PAYMENT_COLUMNS, PROPERTY_COLUMNS, TENANT_COLUMNS, write_export
+)
+from crosscheckapi.importer import import_payments, read_rows
+from crosscheckapi.jobs import PermanentError, handler, report
+from crosscheckapi.models import Payment, Property, Tenant, TenantPropertyRel
+from crosscheckapi.purge import purge
+
+# resource -> (model, columns, ordering) of the export job
+EXPORTS = {
+    'payments': (Payment, PAYMENT_COLUMNS, ('-date', '-id')),
+    'tenants': (Tenant, TENANT_COLUMNS, ('id',)),
+    'properties': (Property, PROPERTY_COLUMNS, ('id',)),
+}
+
+# Kinds clients may queue themselves through POST /jobs
+CLIENT_KINDS = {'export', 'rebuild_ledger', 'statements'}
+
+
+@handler('import_payments')
+def import_payments_job(job):
+    """The body of a POST /payments/bulk sent with Prefer: respond-async"""
+    size = job.input.size
+    with job.input.open('rb') as stream:
+        def rows():
+            for row in read_rows(stream, job.payload['content_type']):
+                report(job, stream.tell(), size)
+                yield row
+
+        return import_payments(rows(), job.landlord, job.payload.get('batch_size'))
+
+
+@handler('export')
+def export_job(job):
+    """An export written to the job's output file instead of streamed"""
+    resource = job.payload.get('resource')
+    fmt = job.payload.get('format', 'csv')
+    if resource not in EXPORTS or fmt not in FORMATS:
+        raise PermanentError(f'Can not export {resource} as {fmt}')
+
+    model, columns, ordering = EXPORTS[resource]
+    rows = model.objects.filter(landlord=job.landlord).order_by(*ordering)
+    with tempfile.TemporaryFile() as file:
+        count = write_export(rows, columns, fmt, file)
+        file.seek(0)
+        job.output.save(f'{resource}.{fmt}', File(file), save=False)
+    # The header line is not a row
+    return {'rows': count - 1 if fmt == 'csv' else count}
+
+
+@handler('rebuild_ledger')
+def rebuild_ledger_job(job):
+    """The ledger of the job's landlord. Every landlord's only with
+    {"all": true}, which `manage.py rebuild_ledger --background` sends
+    and POST /jobs refuses
+    """
+    if job.landlord is not None:
+        leases = TenantPropertyRel.objects.filter(rented_property__landlord=job.landlord)
+    elif job.payload.get('all') is True:
+        leases = TenantPropertyRel.objects.all()
+    else:
+        raise PermanentError('Rebuild the ledger of a landlord, or send {"all": true}')
+    return {'leases': ledger.rebuild(leases, progress=lambda done, total: report(job, done, total))}
+
+
+@handler('purge_deleted')
+def purge_job(job):
+    """Queued by `manage.py purge_deleted --background`"""
+    before = job.payload.get('before')
+    counts = purge(before and parse_datetime(before), job.payload.get('batch_size'))
+    return {model._meta.model_name: count for model, count in counts.items()}
+
+
+@handler('statements')
+def statements_job(job):
+    """Year-end statements of the job's landlord as a zip archive"""
+    try:
+        year = int(job.payload.get('year'))
+    except (TypeError, ValueError):
+        raise PermanentError('Send the year of the statements')
+    formats = job.payload.get('formats') or statements.FORMATS
+    if job.landlord is None or not set(formats) <= set(statements.FORMATS):
+        raise PermanentError(f'Can not render statements as {", ".join(formats)}')
+
+    with tempfile.TemporaryFile() as file:
+        count = statements.generate(
+            job.landlord, year, file, formats, progress=lambda done, total: report(job, done, total))
+        file.seek(0)
+        job.output.save(f'statements-{year}.zip', File(file), save=False)
+    return {'statements': count}
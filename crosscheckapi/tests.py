@@ -1,3 +1,1624 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
+import re
+import threading
+import time
+import zipfile
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from django.db import connection
+from django.db.models import Count, Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+from crosscheck import routers as routing
+from crosscheck.routers import PrimaryReplicaRouter, ReplicaMiddleware
+from crosscheckapi import events, jobs, ledger, search, statements, streams
+from crosscheckapi.authentication import CredentialCache, credentials
+from crosscheckapi.export import PAYMENT_COLUMNS
+from crosscheckapi.metrics import registry
+from crosscheckapi.occupancy import sweep
+from crosscheckapi.parsers import FastJSONParser
+from crosscheckapi.purge import purge
+from crosscheckapi.renderers import FastJSONRenderer
+from crosscheckapi.signals import bulk_saved
+from crosscheckapi.streams import EventStreamRouter
+from crosscheckapi.tokens import denylist
+from crosscheckapi.typeahead import indexes
+from crosscheckapi.versions import bodies
+from crosscheckapi.models import (
+    Job, Landlord, LedgerEntry, Payment, PaymentType, Property, Tenant, TenantPropertyRel
+)
 
-# Create your tests here.
+
+class CrossCheckTestCase(APITestCase):
+    """Creates an authenticated landlord and helpers to build their data"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='landlord@test.com', password='pw')
+        self.token = Token.objects.create(user=self.user)
+        self.landlord = Landlord.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        # Resolve the credentials once so query counts only cover the view
+        credentials.clear()
+        self.client.get('/paymenttypes')
+
+    def create_leased_tenants(self, count):
+        """Give the landlord `count` tenants, each leasing their own property"""
+        today = date.today()
+        for i in range(count):
+            tenant = Tenant.objects.create(
+                full_name=f'Tenant {i}', phone_number='555', landlord=self.landlord)
+            rental = Property.objects.create(
+                street=f'{i} Main St', city='Nashville', state='TN',
+                postal_code='37201', landlord=self.landlord)
+            TenantPropertyRel.objects.create(
+                tenant=tenant, rented_property=rental, rent=1000,
+                lease_start=today - timedelta(days=30),
+                lease_end=today + timedelta(days=30))
+            TenantPropertyRel.objects.create(
+                tenant=tenant, rented_property=rental, rent=900,
+                lease_start=today - timedelta(days=400),
+                lease_end=today - timedelta(days=31))
+        return tenant, rental
+
+
+class LeaseQueryCountTests(CrossCheckTestCase):
+    """The lease endpoints run a constant number of queries"""
+
+    def test_tenant_list_does_not_grow_with_tenants(self):
+        # One query reads the resource versions, see ConditionalGetTests
+        self.create_leased_tenants(2)
+        with self.assertNumQueries(3):
+            response = self.client.get('/tenants')
+        self.assertEqual(len(response.data), 2)
+
+        self.create_leased_tenants(20)
+        with self.assertNumQueries(3):
+            response = self.client.get('/tenants')
+        self.assertEqual(len(response.data), 22)
+
+        leases = response.data[0]['rented_property']
+        self.assertEqual([lease['active'] for lease in leases], [True, False])
+        self.assertEqual(leases[0]['rented_property']['street'], '0 Main St')
+
+    def test_tenant_retrieve(self):
+        tenant, _ = self.create_leased_tenants(5)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/tenants/{tenant.id}')
+        self.assertEqual(len(response.data['rented_property']), 2)
+
+    def test_tenant_without_lease_is_null(self):
+        tenant = Tenant.objects.create(full_name='No Lease', landlord=self.landlord)
+        response = self.client.get(f'/tenants/{tenant.id}')
+        self.assertIsNone(response.data['rented_property'])
+
+    def test_property_retrieve(self):
+        _, rental = self.create_leased_tenants(5)
+        TenantPropertyRel.objects.create(
+            tenant=Tenant.objects.first(), rented_property=rental, rent=1,
+            lease_start=date.today(), lease_end=date.today())
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/properties/{rental.id}')
+        self.assertEqual(len(response.data['lease']), 3)
+        self.assertTrue(all(
+            lease['tenant']['landlord']['id'] == self.landlord.id
+            for lease in response.data['lease']))
+        # Lease boundaries are inclusive
+        self.assertEqual(
+            [lease['active'] for lease in response.data['lease']], [True, False, True])
+
+
+class CachedTokenAuthenticationTests(CrossCheckTestCase):
+    """Token, user and landlord are resolved once and then cached"""
+
+    def test_landlord_is_resolved_without_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get('/paymenttypes')
+
+    def test_first_request_resolves_in_one_query(self):
+        credentials.clear()
+        with self.assertNumQueries(2):
+            response = self.client.get('/paymenttypes')
+        self.assertEqual(response.status_code, 200)
+
+    def test_deleted_token_is_rejected(self):
+        self.token.delete()
+        response = self.client.get('/paymenttypes')
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/paymenttypes')
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(AUTH_CACHE=dict(settings.AUTH_CACHE, ALIAS='default'))
+    def test_invalidation_reaches_other_workers(self):
+        # Two workers sharing the cache
+        first, second = CredentialCache(), CredentialCache()
+        cached = (self.user, self.token, self.landlord)
+        first.set(self.token.key, cached)
+        self.assertEqual(second.get(self.token.key), cached)
+
+        second.invalidate(self.token.key)
+        self.assertIsNone(first.get(self.token.key))
+
+
+class SignedTokenTests(CrossCheckTestCase):
+    """Signed access tokens are checked without touching the database"""
+
+    def setUp(self):
+        super().setUp()
+        denylist.clear()
+        self.enabled = self.settings(SIGNED_TOKENS=dict(settings.SIGNED_TOKENS, ENABLED=True))
+        self.enabled.enable()
+        self.addCleanup(self.enabled.disable)
+        self.user.set_password('pw')
+        self.user.save()
+        self.client.credentials()
+        response = self.client.post(
+            '/login', {"username": 'landlord@test.com', "password": 'pw'}, format='json')
+        self.tokens = response.json()
+
+    def get(self, access):
+        return self.client.get('/paymenttypes', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_authenticates_without_queries(self):
+        self.assertEqual(self.get(self.tokens['access']).status_code, 200)
+        # Only the resource versions, like a cached DRF token
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.tokens['access']).status_code, 200)
+
+        self.assertEqual(self.get(self.tokens['access'][:-2] + 'xx').status_code, 401)
+        self.assertEqual(self.get(self.tokens['refresh']).status_code, 401)
+
+    def test_refresh_rotates(self):
+        response = self.client.post(
+            '/token/refresh', {"refresh": self.tokens['refresh']}, format='json')
+        self.assertEqual(self.get(response.json()['access']).status_code, 200)
+
+        reused = self.client.post(
+            '/token/refresh', {"refresh": self.tokens['refresh']}, format='json')
+        self.assertEqual((reused.status_code, reused.json()), (401, {"reason": 'Token revoked.'}))
+
+    def test_revocation(self):
+        response = self.client.post('/token/revoke', {"token": self.tokens['access']}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get(self.tokens['access']).status_code, 401)
+
+        # Another process learns about revocations from the table
+        denylist.clear()
+        self.assertEqual(self.get(self.tokens['access']).status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(self.tokens['access']).status_code, 401)
+        response = self.client.post(
+            '/token/refresh', {"refresh": self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+def explain(sql):
+    """The query plan of a captured query as text"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Test tables are tiny, make the planner show whether
+            # an index could be used at all
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return '\n'.join(row[-1] for row in cursor.fetchall())
+
+
+FULL_SCAN = {
+    'sqlite': re.compile(r'^SCAN (TABLE )?crosscheckapi_\w+', re.MULTILINE),
+    'postgresql': re.compile(r'Seq Scan on crosscheckapi_\w+'),
+}
+
+
+class SearchTests(CrossCheckTestCase):
+    """?search and ?keyword match the same rows through the FTS5 shadow
+    tables as through icontains, best matches first
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(search.fts_enabled())
+        self.tenants = [
+            Tenant.objects.create(full_name=full_name, phone_number=phone, email=email, landlord=self.landlord)
+            for full_name, phone, email in [
+                ('Ann Smith', '615-555-0101', 'ann@example.com'),
+                ('Smith', '615-555-0102', None),
+                ('Smithers', '(629) 555-0103', 'smithers@mail.test'),
+                ('Bob Smithson', '615-555-0104', 'bob@example.com'),
+                ('Jo Li', '931-555-0105', 'jo@li.test'),
+            ]
+        ]
+        self.properties = [
+            Property.objects.create(street=street, city=city, state='TN', postal_code=postal_code,
+                                    landlord=self.landlord)
+            for street, city, postal_code in [
+                ('12 Main St', 'Nashville', '37201'), ('4 Maine Ave', 'Memphis', '38101'),
+                ('9 Oak Ln', 'Mainstown', '37202'),
+            ]
+        ]
+        Tenant.objects.create(full_name='Smith', landlord=Landlord.objects.create(
+            user=User.objects.create_user(username='other@test.com')))
+
+    def found(self, url, term):
+        return [row['id'] for row in self.client.get(url, {'search': term}).data]
+
+    def test_ordering(self):
+        ann, smith, smithers, bob, _ = (tenant.id for tenant in self.tenants)
+        # Equal to the term, then starting with it, then the rest by id
+        self.assertEqual(self.found('/tenants', 'smith'), [smith, smithers, ann, bob])
+        main, maine, oak = (rental.id for rental in self.properties)
+        self.assertEqual(self.found('/properties', 'main'), [oak, main, maine])
+        # Without a search, by id
+        self.assertEqual([row['id'] for row in self.client.get('/tenants').data],
+                         sorted(tenant.id for tenant in self.tenants))
+
+    def test_fts_matches_icontains(self):
+        terms = ['s', 'Li', 'smith', 'SMITHERS', 'ith', 'h S', '@example', 'mail.test',
+                 '555-010', '(629)', '0105', 'main', 'Nashville', '3720', 'tn', 'nobody', '"']
+        for url in ('/tenants', '/properties'):
+            indexed = {term: self.found(url, term) for term in terms}
+            bodies.clear()
+            with mock.patch('crosscheckapi.search.fts_enabled', return_value=False):
+                scanned = {term: self.found(url, term) for term in terms}
+            self.assertEqual(indexed, scanned, url)
+            bodies.clear()
+
+    def test_payment_keyword(self):
+        cash = PaymentType.objects.create(label='Cash')
+        payments = [
+            Payment.objects.create(date=date(2021, 1, 1), amount=1, ref_num=ref_num, tenant=tenant,
+                                   payment_type=cash, landlord=self.landlord)
+            for ref_num, tenant in [('CHK-1001', self.tenants[4]), ('li', self.tenants[0])]
+        ]
+        for term, expected in [('chk-10', [payments[0]]), ('li', payments), ('Smi', [payments[1]])]:
+            response = self.client.get('/payments', {'keyword': term})
+            self.assertEqual(sorted(row['id'] for row in response.data),
+                             sorted(payment.id for payment in expected), term)
+
+    def indexed(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {search.fts_table(model)}')
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_index_follows_writes(self):
+        tenant = self.tenants[4]
+        tenant.full_name = 'Jo Quill'
+        tenant.save()
+        self.assertEqual(self.found('/tenants', 'quill'), [tenant.id])
+        self.assertEqual(self.found('/tenants', 'jo li'), [])
+
+        Tenant.objects.filter(pk=tenant.pk).update(full_name='Jo Quorum')
+        bulk_saved.send(sender=Tenant, landlord=self.landlord, queryset=Tenant.objects.filter(pk=tenant.pk))
+        self.assertEqual(self.found('/tenants', 'quorum'), [tenant.id])
+
+        rental = self.properties[2]
+        rental.delete()
+        self.assertNotIn(rental.id, self.indexed(Property))
+        self.assertEqual(self.found('/properties', 'oak'), [])
+
+    def test_purge_unindexes(self):
+        tenant = self.tenants[0]
+        payment = Payment.objects.create(
+            date=date(2021, 1, 1), amount=1, ref_num='purged', tenant=tenant,
+            payment_type=PaymentType.objects.create(label='Cash'), landlord=self.landlord)
+        self.client.delete(f'/tenants/{tenant.id}')
+        self.assertNotIn(tenant.id, self.indexed(Tenant))
+        self.assertIn(payment.id, self.indexed(Payment))
+
+        purge()
+        self.assertNotIn(payment.id, self.indexed(Payment))
+        self.assertEqual(self.indexed(Tenant), set(Tenant.objects.values_list('id', flat=True)))
+
+
+class KeysetPaginationTests(CrossCheckTestCase):
+    """?cursor pages through payments by (date, id) without OFFSET"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, _ = self.create_leased_tenants(2)
+        self.other = Tenant.objects.get(full_name='Tenant 0')
+        cash = PaymentType.objects.create(label='Cash')
+        # Several payments share each date, so the id breaks the ties
+        self.payments = [
+            Payment.objects.create(
+                date=date(2021, 1, 1) + timedelta(days=i // 4), amount=i, ref_num=f'r{i}',
+                tenant=self.tenant if i % 3 else self.other, payment_type=cash, landlord=self.landlord)
+            for i in range(11)
+        ]
+
+    def pages(self, **params):
+        """The ids of every page, following the cursors"""
+        pages = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get('/payments', {**params, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            # Pages already served come back rendered from the body cache
+            pages.append([row['id'] for row in response.json()['results']])
+            cursor = response.json()['next']
+        return pages
+
+    def expected(self, payments):
+        return [payment.id for payment in sorted(payments, key=lambda p: (p.date, p.id), reverse=True)]
+
+    def test_pages_cover_every_row_once(self):
+        for size in (1, 3, 4, 11, 50):
+            pages = self.pages(page_size=size)
+            self.assertEqual(sum(pages, []), self.expected(self.payments), size)
+            self.assertTrue(all(len(page) == size for page in pages[:-1]))
+        # A last page that is exactly full ends the walk
+        self.assertEqual(len(self.pages(page_size=11)), 1)
+
+    def test_writes_between_pages(self):
+        first = self.client.get('/payments', {'cursor': '', 'page_size': 4}).json()
+        # A payment sorting before the cursor does not shift the next page
+        Payment.objects.create(date=date(2022, 1, 1), amount=1, ref_num='new', tenant=self.tenant,
+                               payment_type=self.payments[0].payment_type, landlord=self.landlord)
+        second = self.client.get('/payments', {'cursor': first['next'], 'page_size': 4}).json()
+        self.assertEqual([row['id'] for row in first['results'] + second['results']],
+                         self.expected(self.payments)[:8])
+
+    def test_filters_apply_with_a_cursor(self):
+        pages = self.pages(page_size=2, tenant=self.tenant.id, date='2021-01-01/2021-01-02')
+        self.assertEqual(sum(pages, []), self.expected(
+            p for p in self.payments if p.tenant_id == self.tenant.id and p.date <= date(2021, 1, 2)))
+        pages = self.pages(page_size=2, keyword='r1')
+        self.assertEqual(sum(pages, []), self.expected(p for p in self.payments if p.ref_num.startswith('r1')))
+
+    def test_malformed_cursors(self):
+        def encode(raw):
+            return base64.urlsafe_b64encode(raw).decode()
+
+        for cursor in ['x', '!!!', 'é', encode(b'2021-01-01'), encode(b'2021-13-01|1'),
+                       encode(b'2021-01-01|one'), encode(b'2021-01-01|1|2'), encode(b'\xff\xfe|1'),
+                       encode(b'2021-01-01|' + b'9' * 30), encode(b'2021-01-01|-1')]:
+            response = self.client.get('/payments', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertIn('cursor', response.data)
+
+        response = self.client.get('/payments', {'cursor': '', 'page_size': 'ten'})
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryPlanTests(CrossCheckTestCase):
+    """The main queries of each endpoint are served by an index"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, self.rental = self.create_leased_tenants(3)
+        payment_type = PaymentType.objects.create(label='Cash')
+        for i in range(5):
+            Payment.objects.create(
+                date=date(2021, 1, i + 1), amount=100, ref_num=str(i), tenant=self.tenant,
+                rented_property=self.rental, payment_type=payment_type, landlord=self.landlord)
+
+    def assertIndexed(self, url, params=None):
+        """Fail if any SELECT run by the endpoint falls back to a full scan"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+
+        for query in queries.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            plan = explain(query['sql'])
+            self.assertNotRegex(
+                plan, FULL_SCAN[connection.vendor], f'{url}: {query["sql"]}\n{plan}')
+
+    def test_payment_list(self):
+        self.assertIndexed('/payments')
+        self.assertIndexed('/payments', {'date': '2021-01-02/2021-01-04'})
+        self.assertIndexed('/payments', {'tenant': self.tenant.id})
+
+    def test_payment_cursor(self):
+        response = self.client.get('/payments', {'cursor': '', 'page_size': 2})
+        self.assertIndexed('/payments', {'cursor': response.data['next'], 'page_size': 2})
+
+    def test_tenants(self):
+        self.assertIndexed('/tenants')
+        self.assertIndexed(f'/tenants/{self.tenant.id}')
+
+    def test_property(self):
+        self.assertIndexed(f'/properties/{self.rental.id}')
+
+    def test_ledger(self):
+        self.assertIndexed('/ledger', {'start': '2021-01', 'end': '2021-12'})
+
+    def test_payment_summary(self):
+        self.assertIndexed('/payments/summary', {'group': 'month,type', 'date': '2021-01-01/2021-12-31'})
+
+
+class MetricsTests(CrossCheckTestCase):
+    """Requests are recorded per route and action and served to staff only"""
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_records_route_and_action(self):
+        self.create_leased_tenants(2)
+        self.client.get('/tenants')
+        self.client.get('/tenants')
+
+        metrics = registry.routes[('tenant-list', 'list')]
+        self.assertEqual(metrics.statuses, {200: 2})
+        self.assertEqual(metrics.duration.count, 2)
+        self.assertEqual(metrics.queries.count, 2)
+
+    def test_metrics_requires_staff(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get('/tenants')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'crosscheck_requests_total{route="tenant-list",action="list",status="200"} 1',
+            response.content)
+        self.assertIn(
+            b'crosscheck_db_queries_bucket{route="tenant-list",action="list",le="+Inf"} 1',
+            response.content)
+
+
+
+class ConditionalGetTests(CrossCheckTestCase):
+    """List endpoints answer If-None-Match from the resource versions"""
+
+    def setUp(self):
+        super().setUp()
+        bodies.clear()
+        self.create_leased_tenants(3)
+
+    def test_not_modified(self):
+        response = self.client.get('/tenants')
+        etag = response['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/tenants', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_body_is_cached_until_a_write(self):
+        first = self.client.get('/tenants?table')
+        with self.assertNumQueries(1):
+            second = self.client.get('/tenants?table')
+        self.assertEqual(first.content, second.content)
+
+        Tenant.objects.create(full_name='New Tenant', landlord=self.landlord)
+        third = self.client.get('/tenants?table', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third['ETag'], first['ETag'])
+        # Version 1 sends the lookup table as a JSON string
+        self.assertIn('New Tenant', json.loads(third.data).values())
+
+    def test_lease_write_changes_tenant_etag(self):
+        etag = self.client.get('/tenants')['ETag']
+        lease = TenantPropertyRel.objects.first()
+        lease.rent = 1234
+        lease.save()
+        self.assertNotEqual(self.client.get('/tenants')['ETag'], etag)
+
+    def test_payment_types_are_global(self):
+        etag = self.client.get('/paymenttypes')['ETag']
+        PaymentType.objects.create(label='Zelle')
+        response = self.client.get('/paymenttypes', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Zelle', json.loads(response.data).values())
+
+
+class RenderingTests(CrossCheckTestCase):
+    """orjson renders like DRF, lookups are objects, big bodies compressed"""
+
+    def test_fast_renderer_matches_drf(self):
+        data = {
+            1: 'Line\u2028break', 'day': date(2021, 1, 2), 'rent': Decimal('12.50'),
+            'at': datetime(2021, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+            'rows': [{'id': 1, 'label': 'Cash'}, None, True, 1.5],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO(b'{"ids": [1, 2]}')), {'ids': [1, 2]})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"ids": ['))
+
+    def test_lookups_are_objects(self):
+        cash = PaymentType.objects.create(label='Cash')
+        # Clients not asking for a version keep the object encoded as a string
+        old = self.client.get('/paymenttypes')
+        self.assertEqual(json.loads(old.json()), {str(cash.id): 'Cash'})
+
+        version_2 = 'application/json; version=2'
+        response = self.client.get('/paymenttypes', HTTP_ACCEPT=version_2)
+        self.assertEqual(response.json(), {str(cash.id): 'Cash'})
+        self.assertNotEqual(old['ETag'], response['ETag'])
+
+        tenant, _ = self.create_leased_tenants(1)
+        self.assertEqual(self.client.get('/tenants?table', HTTP_ACCEPT=version_2).json(),
+                         {str(tenant.id): 'Tenant 0'})
+        self.assertEqual(json.loads(self.client.get('/tenants?table').json()), {str(tenant.id): 'Tenant 0'})
+
+    def test_compression(self):
+        self.create_leased_tenants(20)
+        plain = self.client.get('/tenants')
+        self.assertNotIn('Content-Encoding', plain)
+
+        response = self.client.get('/tenants', HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], f'W/{plain["ETag"]}')
+        self.assertEqual(self.client.get('/tenants', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # Small bodies are not worth it
+        response = self.client.get('/paymenttypes', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+
+
+class PaymentSummaryTests(CrossCheckTestCase):
+    """Totals come back as columns from one GROUP BY query"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, self.rental = self.create_leased_tenants(1)
+        cash = PaymentType.objects.create(label='Cash')
+        check = PaymentType.objects.create(label='Check')
+        for day, amount, payment_type in [
+            (date(2021, 1, 3), 100, cash), (date(2021, 1, 20), 50, check),
+            (date(2021, 2, 1), 100, cash), (date(2022, 1, 1), 999, cash),
+        ]:
+            Payment.objects.create(
+                date=day, amount=amount, ref_num='1', tenant=self.tenant,
+                payment_type=payment_type, landlord=self.landlord)
+        self.cash, self.check = cash, check
+
+    def test_grouped_by_month_and_type(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/payments/summary', {'group': 'month,type', 'date': '2021-01-01/2021-12-31'})
+        self.assertEqual(response.data, {
+            'columns': ['month', 'type', 'total', 'count'],
+            'month': ['2021-01', '2021-01', '2021-02'],
+            'type': [self.cash.id, self.check.id, self.cash.id],
+            'total': [100, 50, 100],
+            'count': [1, 1, 1],
+        })
+
+    def test_grand_total(self):
+        response = self.client.get('/payments/summary')
+        self.assertEqual(response.data, {
+            'columns': ['total', 'count'], 'total': [1249], 'count': [4]})
+
+    def test_unknown_group(self):
+        response = self.client.get('/payments/summary', {'group': 'street'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_filters(self):
+        for params in ({'date': '2021-01-01'}, {'date': '2021-01-01/someday'},
+                       {'date': '2021-01-01/2021-02-01/2021-03-01'}, {'tenant': 'x'}):
+            for url in ('/payments', '/payments/summary'):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400, (url, params))
+                self.assertIn(next(iter(params)), response.data)
+
+    def test_tenant_writes_change_the_summary(self):
+        response = self.client.get('/payments/summary', {'keyword': 'Tenant'})
+        self.assertEqual(response.data['count'], [4])
+        # The keyword matches tenant names
+        self.tenant.full_name = 'Renamed'
+        self.tenant.save()
+        response = self.client.get('/payments/summary', {'keyword': 'Tenant'},
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], [0])
+
+
+
+class OccupancyTests(CrossCheckTestCase):
+    """Lease intervals are closed, gaps and overlaps come from one sweep"""
+
+    def lease(self, lease_id, start, end):
+        return {'id': lease_id, 'lease_start': start, 'lease_end': end}
+
+    def test_sweep(self):
+        leases = [
+            self.lease(1, date(2020, 12, 1), date(2021, 1, 31)),
+            self.lease(2, date(2021, 1, 31), date(2021, 3, 31)),
+            self.lease(3, date(2021, 6, 1), date(2021, 6, 30)),
+        ]
+        timeline = sweep(leases, date(2021, 1, 1), date(2021, 12, 31))
+        self.assertEqual(timeline['gaps'], [
+            (date(2021, 4, 1), date(2021, 5, 31)),
+            (date(2021, 7, 1), date(2021, 12, 31)),
+        ])
+        self.assertEqual(timeline['overlaps'], [(1, 2)])
+        self.assertEqual(timeline['occupied_days'], 31 + 28 + 31 + 30)
+
+    def test_lease_ending_today_is_active(self):
+        tenant = Tenant.objects.create(full_name='Tenant', landlord=self.landlord)
+        rental = Property.objects.create(
+            street='1 Main St', city='Nashville', state='TN',
+            postal_code='37201', landlord=self.landlord)
+        lease = TenantPropertyRel.objects.create(
+            tenant=tenant, rented_property=rental, rent=1000,
+            lease_start=date.today() - timedelta(days=10), lease_end=date.today())
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/properties/occupancy')
+        self.assertEqual(response.data['properties'][0]['active_leases'], [lease.id])
+        self.assertEqual(response.data['occupied'], 1)
+        self.assertEqual(
+            self.client.get(f'/tenants/{tenant.id}').data['rented_property'][0]['active'], True)
+
+        response = self.client.get(
+            f'/properties/{rental.id}/timeline',
+            {'start': lease.lease_start.isoformat(), 'end': date.today().isoformat()})
+        self.assertEqual(response.data['gaps'], [])
+        self.assertEqual(response.data['leases'][0]['id'], lease.id)
+
+
+class StatementMatchTests(CrossCheckTestCase):
+    """Deposits are matched on name, rent, reference and due date"""
+
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        self.rental = Property.objects.create(
+            street='1 Main St', city='Nashville', state='TN',
+            postal_code='37201', landlord=self.landlord)
+        self.leases = {}
+        for name, rent in [('John Smith', 1000), ('Mary Jones', 1250), ('Maria Garcia', 900)]:
+            tenant = Tenant.objects.create(full_name=name, landlord=self.landlord)
+            self.leases[name] = TenantPropertyRel.objects.create(
+                tenant=tenant, rented_property=self.rental, rent=rent,
+                lease_start=today - timedelta(days=365), lease_end=today + timedelta(days=365))
+        cash = PaymentType.objects.create(label='Cash')
+        self.recorded = Payment.objects.create(
+            date=today.replace(day=1), amount=900, ref_num='ZELLE GARCIAM 1001',
+            tenant=self.leases['Maria Garcia'].tenant, payment_type=cash, landlord=self.landlord)
+        self.month = today.replace(day=2).isoformat()
+
+    def match(self, body, content_type='text/csv'):
+        response = self.client.post('/payments/match', body, content_type=content_type)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['matches']
+
+    def test_csv(self):
+        matches = self.match(
+            'Date,Description,Amount,Memo\n'
+            f'{self.month},ZELLE FROM SMITH JOHN,"1,000.00",\n'
+            f'{self.month},MOBILE DEPOSIT,1250,\n'
+            f'{self.month},Withdrawal,-50,\n'
+            f'{self.month},Unknown payer,900,ZELLE GARCIAM 2002\n')
+        self.assertEqual(len(matches), 3)
+
+        john, mary, maria = matches
+        self.assertEqual(john['candidates'][0]['lease'], self.leases['John Smith'].id)
+        self.assertEqual(set(john['candidates'][0]['reasons']), {'name', 'amount', 'date'})
+        # No name at all, the rent amount alone points at the lease
+        self.assertEqual(mary['candidates'][0]['lease'], self.leases['Mary Jones'].id)
+        # The reference follows the pattern of Maria's earlier payments
+        self.assertEqual(maria['candidates'][0]['lease'], self.leases['Maria Garcia'].id)
+        self.assertIn('ref', maria['candidates'][0]['reasons'])
+
+    def test_ofx_and_recorded_payments(self):
+        posted = self.recorded.date.strftime('%Y%m%d')
+        matches = self.match(
+            '<OFX><BANKTRANLIST>\n'
+            f'<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>{posted}120000<TRNAMT>900.00'
+            '<NAME>MARIA GARCIA<MEMO>ZELLE GARCIAM 1001\n'
+            f'<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>{posted}<TRNAMT>-20.00<NAME>FEE\n'
+            '</BANKTRANLIST></OFX>', 'application/x-ofx')
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(matches[0]['recorded_payment'], self.recorded.id)
+        self.assertEqual(matches[0]['candidates'][0]['lease'], self.leases['Maria Garcia'].id)
+
+    def test_unsupported_type(self):
+        response = self.client.post('/payments/match', {}, format='json')
+        self.assertEqual(response.status_code, 415)
+
+
+class LedgerTests(CrossCheckTestCase):
+    """Every write path leaves the same entries as a full rebuild"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant = Tenant.objects.create(full_name='Tenant', phone_number='555', landlord=self.landlord)
+        self.rental = Property.objects.create(
+            street='1 Main St', city='Nashville', state='TN', postal_code='37201', landlord=self.landlord)
+        self.other_rental = Property.objects.create(
+            street='2 Main St', city='Nashville', state='TN', postal_code='37201', landlord=self.landlord)
+        self.lease = TenantPropertyRel.objects.create(
+            tenant=self.tenant, rented_property=self.rental, rent=1000,
+            lease_start=date(2021, 1, 1), lease_end=date(2021, 3, 31))
+        self.cash = PaymentType.objects.create(label='Cash')
+
+    def entries(self):
+        """(month, expected, received, balance, payment count) per month"""
+        return [(month.month, *rest) for month, *rest in LedgerEntry.objects.filter(lease=self.lease)
+                .order_by('month').values_list('month', 'expected', 'received', 'balance', 'payment_count')]
+
+    def assertEntries(self, expected):
+        self.assertEqual(self.entries(), expected)
+        # A full rebuild agrees with the incremental updates
+        LedgerEntry.objects.all().delete()
+        ledger.rebuild()
+        self.assertEqual(self.entries(), expected)
+
+    def payment(self, day, amount):
+        return {'date': day, 'amount': amount, 'ref_num': '', 'full_name': self.tenant.id, 'type': self.cash.id}
+
+    def test_create_and_move(self):
+        self.assertEntries([(1, 1000, 0, 1000, 0), (2, 1000, 0, 1000, 0), (3, 1000, 0, 1000, 0)])
+
+        response = self.client.post('/payments', self.payment('2021-01-05', '$600'), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.post('/payments', self.payment('2021-01-20', '400'), format='json')
+        # Outside the lease
+        self.client.post('/payments', self.payment('2021-04-01', '999'), format='json')
+        self.assertEntries([(1, 1000, 1000, 0, 2), (2, 1000, 0, 1000, 0), (3, 1000, 0, 1000, 0)])
+
+        self.client.put(f'/payments/{response.data["id"]}', self.payment('2021-02-10', '600'), format='json')
+        self.assertEntries([(1, 1000, 400, 600, 1), (2, 1000, 600, 400, 1), (3, 1000, 0, 1000, 0)])
+
+        # Paid toward another property of the tenant
+        Payment.objects.create(date=date(2021, 3, 1), amount=50, ref_num='', tenant=self.tenant,
+                               rented_property=self.other_rental, payment_type=self.cash,
+                               landlord=self.landlord)
+        self.assertEntries([(1, 1000, 400, 600, 1), (2, 1000, 600, 400, 1), (3, 1000, 0, 1000, 0)])
+
+    def test_bulk(self):
+        rows = [self.payment('2021-01-05', 300), self.payment('2021-03-05', 700)]
+        response = self.client.post('/payments/bulk', '\n'.join(json.dumps(row) for row in rows),
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.data['created'], 2)
+        self.assertEntries([(1, 1000, 300, 700, 1), (2, 1000, 0, 1000, 0), (3, 1000, 700, 300, 1)])
+
+        ids = list(Payment.objects.order_by('date').values_list('id', flat=True))
+        self.client.patch('/payments/bulk', [{"id": ids[0], "date": "2021-02-01", "amount": 350}], format='json')
+        self.assertEntries([(1, 1000, 0, 1000, 0), (2, 1000, 350, 650, 1), (3, 1000, 700, 300, 1)])
+
+        self.client.delete('/payments/bulk', {"ids": ids}, format='json')
+        self.assertEntries([(1, 1000, 0, 1000, 0), (2, 1000, 0, 1000, 0), (3, 1000, 0, 1000, 0)])
+
+    def test_lease_edits(self):
+        Payment.objects.create(date=date(2021, 3, 1), amount=500, ref_num='', tenant=self.tenant,
+                               payment_type=self.cash, landlord=self.landlord)
+        self.lease.rent = 1200
+        self.lease.save()
+        self.assertEntries([(1, 1200, 0, 1200, 0), (2, 1200, 0, 1200, 0), (3, 1200, 500, 700, 1)])
+
+        response = self.client.patch('/properties/leases/bulk', [
+            {"id": self.lease.id, "lease_start": "2021-02-01", "lease_end": "2021-04-30"},
+        ], format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEntries([(2, 1200, 0, 1200, 0), (3, 1200, 500, 700, 1), (4, 1200, 0, 1200, 0)])
+
+
+class GenerateDataTests(CrossCheckTestCase):
+    """manage.py generate_data builds a consistent dataset"""
+
+    def test_generate(self):
+        with mock.patch.object(ledger, 'rebuild_leases', wraps=ledger.rebuild_leases) as rebuild:
+            call_command('generate_data', landlords=1, tenants=3, years=2, stdout=io.StringIO())
+        # The whole ledger of the landlord in one batch, not once per signal
+        self.assertEqual(rebuild.call_count, 1)
+
+        landlord = Landlord.objects.exclude(pk=self.landlord.pk).get()
+        self.assertEqual(Tenant.objects.filter(landlord=landlord).count(), 3)
+        leases = TenantPropertyRel.objects.filter(tenant__landlord=landlord)
+        self.assertEqual(leases.count(), 6)
+        self.assertEqual(LedgerEntry.objects.filter(landlord=landlord).count(), 6 * 12)
+        entries = LedgerEntry.objects.filter(landlord=landlord).aggregate(
+            received=Sum('received'), count=Sum('payment_count'))
+        payments = Payment.objects.filter(landlord=landlord).aggregate(
+            received=Sum('amount'), count=Count('id'))
+        self.assertEqual(entries, payments)
+
+
+class PaymentImportTests(CrossCheckTestCase):
+    """POST /payments/bulk imports CSV and NDJSON bodies in batches"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, _ = self.create_leased_tenants(1)
+        self.cash = PaymentType.objects.create(label='Cash')
+
+    def post(self, body, content_type='text/csv', query=''):
+        if isinstance(body, str):
+            body = body.encode()
+        return self.client.generic('POST', '/payments/bulk' + query, body, content_type=content_type)
+
+    def csv(self, count):
+        lines = ['date,amount,ref_num,tenant,type']
+        lines += [f'2021-01-{i % 28 + 1:02},"$1,00{i}",r{i},{self.tenant.id},{self.cash.id}' for i in range(count)]
+        return '\n'.join(lines) + '\n'
+
+    def test_csv(self):
+        response = self.post(self.csv(3))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"created": 3, "error_count": 0, "errors": []})
+        self.assertEqual(
+            list(Payment.objects.order_by('id').values_list('date', 'amount', 'ref_num', 'tenant', 'landlord')),
+            [(date(2021, 1, i + 1), 1000 + i, f'r{i}', self.tenant.id, self.landlord.id) for i in range(3)])
+
+    def test_ndjson(self):
+        rows = [{"date": "2021-01-05T00:00:00Z", "amount": 1000, "ref_num": "a",
+                 "tenant": self.tenant.id, "type": self.cash.id}]
+        response = self.post('\n'.join(json.dumps(row) for row in rows) + '\n\n', 'application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Payment.objects.get().date, date(2021, 1, 5))
+
+    def test_byte_order_mark(self):
+        response = self.post(b'\xef\xbb\xbf' + self.csv(1).encode())
+        self.assertEqual(response.data['created'], 1)
+
+    def test_row_errors(self):
+        stranger = Tenant.objects.create(
+            full_name='Other', landlord=Landlord.objects.create(
+                user=User.objects.create_user(username='other@test.com')))
+        body = (self.csv(1)
+                + f'someday,10,b,{self.tenant.id},{self.cash.id}\n'
+                + f'2021-01-01,ten,c,{self.tenant.id},{self.cash.id}\n'
+                + f'2021-01-01,10,d,{stranger.id},{self.cash.id}\n'
+                + f'2021-01-01,10,e,{self.tenant.id},999\n'
+                + f'2021-01-01,10,f,x,{self.cash.id}\n').encode()
+        body += f'2021-01-01,10,\xff,{self.tenant.id},{self.cash.id}\n'.encode('latin-1')
+        response = self.post(body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['error_count'], 6)
+        self.assertEqual(response.data['errors'], [
+            {"row": 2, "reason": "Invalid date: someday"},
+            {"row": 3, "reason": "Invalid amount: ten"},
+            {"row": 4, "reason": f"Unknown tenant: {stranger.id}"},
+            {"row": 5, "reason": "Unknown payment type: 999"},
+            {"row": 6, "reason": "tenant and type must be ids"},
+            {"row": 7, "reason": "Not valid UTF-8"},
+        ])
+
+        response = self.post(b'{"date": "2021-01-01"\n\xff\n', 'application/x-ndjson')
+        self.assertEqual(response.data['errors'], [
+            {"row": 1, "reason": "Malformed row"},
+            {"row": 2, "reason": "Not valid UTF-8"},
+        ])
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_infinite_amounts(self):
+        body = self.csv(2) + ''.join(
+            f'2021-01-01,{amount},x,{self.tenant.id},{self.cash.id}\n' for amount in ('inf', '1e400', 'NaN'))
+        response = self.post(body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], [
+            {"row": 3, "reason": "Invalid amount: inf"},
+            {"row": 4, "reason": "Invalid amount: 1e400"},
+            {"row": 5, "reason": "Invalid amount: NaN"},
+        ])
+
+        response = self.post(f'{{"date": "2021-01-01", "amount": Infinity, "ref_num": "", '
+                             f'"tenant": {self.tenant.id}, "type": {self.cash.id}}}\n', 'application/x-ndjson')
+        self.assertEqual(response.data['errors'], [{"row": 1, "reason": "Invalid amount: inf"}])
+        self.assertEqual(Payment.objects.count(), 2)
+
+    def test_batch_size(self):
+        # One query for the tenants of each batch
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(self.csv(5), query='?batch_size=2')
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual(
+            len([q for q in queries if q['sql'].startswith('SELECT "crosscheckapi_tenant"."id"')]), 3)
+
+        for batch_size in ('0', '-1', 'two'):
+            response = self.post(self.csv(1), query=f'?batch_size={batch_size}')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Payment.objects.count(), 5)
+
+    def test_unsupported_type(self):
+        response = self.post('[]', 'application/json')
+        self.assertEqual(response.status_code, 415)
+
+
+class ExportTests(CrossCheckTestCase):
+    """Exports stream every matching row as CSV or NDJSON"""
+
+    def setUp(self):
+        super().setUp()
+        self.other, _ = self.create_leased_tenants(2)
+        self.first = Tenant.objects.get(full_name='Tenant 0')
+        cash = PaymentType.objects.create(label='Cash')
+        self.payments = [
+            Payment.objects.create(
+                date=day, amount=amount, ref_num=ref_num, tenant=tenant,
+                payment_type=cash, landlord=self.landlord)
+            for day, amount, ref_num, tenant in [
+                (date(2021, 1, 5), 100, 'jan', self.first),
+                (date(2021, 2, 5), 200, 'feb', self.other),
+                (date(2021, 2, 5), 300, 'feb, late', self.first),
+            ]
+        ]
+        stranger = Landlord.objects.create(user=User.objects.create_user(username='other@test.com'))
+        Property.objects.create(street='9 Elm St', city='Memphis', state='TN', postal_code='38101',
+                                landlord=stranger)
+        Payment.objects.create(
+            date=date(2021, 1, 5), amount=1, ref_num='jan', payment_type=cash, landlord=stranger,
+            tenant=Tenant.objects.create(full_name='Tenant 9', landlord=stranger))
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content).decode()
+        response.close()
+        return response, body
+
+    def payment_row(self, payment):
+        payment.refresh_from_db()
+        return [str(payment.id), payment.date.isoformat(), str(payment.amount), payment.ref_num,
+                str(payment.tenant_id), payment.tenant.full_name, 'Cash',
+                str(payment.rented_property_id or '')]
+
+    def test_payments_csv(self):
+        response, body = self.export('/payments/export')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="payments.csv"')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], [header for header, _ in PAYMENT_COLUMNS])
+        # Most recent first, the later id first on the same day
+        self.assertEqual(rows[1:], [self.payment_row(self.payments[i]) for i in (2, 1, 0)])
+
+    def test_payments_ndjson(self):
+        response, body = self.export('/payments/export', format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2], {
+            'id': self.payments[0].id, 'date': '2021-01-05', 'amount': 100, 'ref_num': 'jan',
+            'tenant_id': self.first.id, 'tenant': 'Tenant 0', 'payment_type': 'Cash',
+            'rented_property_id': Payment.objects.get(pk=self.payments[0].pk).rented_property_id,
+        })
+
+    def test_payment_filters(self):
+        def ids(**params):
+            _, body = self.export('/payments/export', format='ndjson', **params)
+            return [json.loads(line)['id'] for line in body.splitlines()]
+
+        jan, feb, late = (payment.id for payment in self.payments)
+        self.assertEqual(ids(date='2021-02-01/2021-02-28'), [late, feb])
+        self.assertEqual(ids(tenant=self.first.id), [late, jan])
+        self.assertEqual(ids(keyword='feb'), [late, feb])
+        self.assertEqual(ids(keyword='feb', tenant=self.other.id, date='2021-01-01/2021-12-31'), [feb])
+
+    def test_malformed_filters(self):
+        for params in ({'date': '2021-01-01'}, {'date': 'x/y'}, {'tenant': 'x'}):
+            for fmt in ('csv', 'ndjson'):
+                response = self.client.get('/payments/export', {'format': fmt, **params})
+                self.assertEqual(response.status_code, 400, params)
+
+    def test_tenants(self):
+        response, body = self.export('/tenants/export')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tenants.csv"')
+        self.assertEqual(body.splitlines(), [
+            'id,full_name,phone_number,email',
+            f'{self.first.id},Tenant 0,555,',
+            f'{self.other.id},Tenant 1,555,',
+        ])
+
+        _, body = self.export('/tenants/export', format='ndjson', search='Tenant 1')
+        self.assertEqual([json.loads(line) for line in body.splitlines()], [
+            {'id': self.other.id, 'full_name': 'Tenant 1', 'phone_number': '555', 'email': None}])
+
+    def test_properties(self):
+        properties = list(Property.objects.filter(landlord=self.landlord).order_by('id'))
+        response, body = self.export('/properties/export')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(body.splitlines(), ['id,street,city,state,postal_code'] + [
+            f'{rental.id},{rental.street},Nashville,TN,37201' for rental in properties])
+
+        _, body = self.export('/properties/export', format='ndjson', search='1 Main')
+        self.assertEqual([json.loads(line)['street'] for line in body.splitlines()], ['1 Main St'])
+
+
+class BulkEditTests(CrossCheckTestCase):
+    """Bulk PATCH and DELETE apply valid items and report the others"""
+
+    def setUp(self):
+        super().setUp()
+        self.first = date.today().replace(day=1)
+        self.tenant, self.rental = self.create_leased_tenants(2)
+        self.other_tenant = Tenant.objects.get(full_name='Tenant 0')
+        self.lease = TenantPropertyRel.objects.get(tenant=self.tenant, rent=1000)
+        cash = PaymentType.objects.create(label='Cash')
+        self.payments = [
+            Payment.objects.create(
+                date=self.first, amount=amount, ref_num='', tenant=self.tenant,
+                payment_type=cash, landlord=self.landlord)
+            for amount in (400, 600)
+        ]
+        stranger = Landlord.objects.create(user=User.objects.create_user(username='other@test.com'))
+        self.foreign = Payment.objects.create(
+            date=self.first, amount=1, ref_num='', payment_type=cash, landlord=stranger,
+            tenant=Tenant.objects.create(full_name='Other', landlord=stranger))
+
+    def received(self):
+        return LedgerEntry.objects.get(lease=self.lease, month=self.first).received
+
+    def test_patch_payments(self):
+        self.assertEqual(self.received(), 1000)
+        response = self.client.patch('/payments/bulk', [
+            {"id": self.payments[0].id, "amount": "$450"},
+            {"id": self.payments[1].id, "tenant": self.other_tenant.id, "ref_num": "moved"},
+            {"id": self.foreign.id, "amount": 5},
+            {"id": self.payments[0].id, "amount": 1},
+            {"id": "x"},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(
+            [error['reason'] for error in response.data['errors']],
+            [f'Not found: {self.foreign.id}', f'Duplicate id: {self.payments[0].id}', 'Invalid id: x'])
+
+        self.payments[1].refresh_from_db()
+        self.assertEqual(self.payments[1].tenant, self.other_tenant)
+        self.assertEqual(self.payments[1].ref_num, 'moved')
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.amount, 1)
+        # Both the old and the new tenant's ledger caught up
+        self.assertEqual(self.received(), 450)
+        self.assertEqual(LedgerEntry.objects.get(
+            tenant=self.other_tenant, month=self.first).received, 600)
+
+    def test_delete_payments(self):
+        ids = [payment.id for payment in self.payments] + [self.foreign.id]
+        response = self.client.delete('/payments/bulk', {"ids": ids}, format='json')
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(response.data['error_count'], 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(self.received(), 0)
+
+    def test_leases(self):
+        response = self.client.patch('/properties/leases/bulk', [
+            {"id": self.lease.id, "rent": 1100},
+            {"id": self.lease.id + 1, "lease_start": "2100-01-01"},
+        ], format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['errors'][0]['reason'], 'lease_start is after lease_end')
+        self.assertEqual(LedgerEntry.objects.get(lease=self.lease, month=self.first).expected, 1100)
+
+        response = self.client.delete('/properties/leases/bulk', [self.lease.id], format='json')
+        self.assertEqual(response.data['deleted'], 1)
+        self.assertFalse(TenantPropertyRel.objects.filter(pk=self.lease.id).exists())
+        self.assertFalse(LedgerEntry.objects.filter(lease_id=self.lease.id).exists())
+
+    def test_not_a_list(self):
+        response = self.client.patch('/payments/bulk', {"id": 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SoftDeleteTests(CrossCheckTestCase):
+    """Deletes flag the row, the purge removes everything pointing to it"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, self.rental = self.create_leased_tenants(2)
+        self.payment = Payment.objects.create(
+            date=date.today(), amount=1000, ref_num='', tenant=self.tenant,
+            payment_type=PaymentType.objects.create(label='Cash'), landlord=self.landlord)
+
+    def test_tenant(self):
+        # Constant however many payments and leases the tenant has,
+        # two of them write the sync tombstones
+        with self.assertNumQueries(8):
+            response = self.client.delete(f'/tenants/{self.tenant.id}')
+        self.assertEqual(response.status_code, 204)
+
+        tenants = self.client.get('/tenants').data
+        self.assertEqual([tenant['full_name'] for tenant in tenants], ['Tenant 0'])
+        self.assertEqual(self.client.get('/payments').data, [])
+        self.assertFalse(TenantPropertyRel.objects.filter(tenant_id=self.tenant.id).exists())
+        self.assertEqual(Payment._base_manager.count(), 1)
+
+        counts = purge()
+        self.assertEqual((counts[Tenant], counts[Payment], counts[TenantPropertyRel]), (1, 1, 2))
+        self.assertFalse(LedgerEntry._base_manager.filter(tenant_id=self.tenant.id).exists())
+        self.assertEqual(Tenant._base_manager.count(), 1)
+
+    def test_property(self):
+        self.client.delete(f'/properties/{self.rental.id}')
+        self.assertEqual(len(self.client.get('/properties').data), 1)
+        self.assertFalse(self.client.get(f'/tenants/{self.tenant.id}').data['rented_property'])
+        # The payment has no property, it stays with its tenant
+        self.assertEqual(len(self.client.get('/payments').data), 1)
+
+        purge(batch_size=1)
+        self.assertEqual(TenantPropertyRel._base_manager.filter(tenant=self.tenant).count(), 0)
+        self.assertTrue(Payment.objects.filter(pk=self.payment.id).exists())
+
+
+
+@override_settings(SYNC=dict(settings.SYNC, OVERLAP_SECONDS=0))
+class SyncTests(CrossCheckTestCase):
+    """GET /sync sends what changed since the cursor, deletes included"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, self.rental = self.create_leased_tenants(2)
+        self.cash = PaymentType.objects.create(label='Cash')
+        self.payments = [Payment.objects.create(
+            date=date(2021, 1, day), amount=1000, ref_num='', tenant=self.tenant,
+            payment_type=self.cash, landlord=self.landlord) for day in (1, 2)]
+
+    def sync(self, cursor=None):
+        response = self.client.get('/sync', {'since': cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_changes_since_cursor(self):
+        first = self.sync()
+        self.assertEqual((len(first['tenants']), len(first['leases']), len(first['payments'])), (2, 4, 2))
+
+        # Nothing changed
+        second = self.sync(first['cursor'])
+        self.assertEqual(second['payments'], [])
+        self.assertGreaterEqual(int(second['cursor']), int(first['cursor']))
+
+        self.client.patch('/payments/bulk', [{"id": self.payments[0].id, "amount": 5}], format='json')
+        self.client.delete(f'/payments/{self.payments[1].id}')
+        third = self.sync(second['cursor'])
+        self.assertEqual([(row['id'], row['amount']) for row in third['payments']],
+                         [(self.payments[0].id, 5)])
+        self.assertEqual(third['deleted']['payments'], [self.payments[1].id])
+        self.assertEqual(third['tenants'], [])
+
+    def test_soft_deleted_tenant_takes_its_rows(self):
+        cursor = self.sync()['cursor']
+        self.client.delete(f'/tenants/{self.tenant.id}')
+        deleted = self.sync(cursor)['deleted']
+        self.assertEqual(deleted['tenants'], [self.tenant.id])
+        self.assertEqual(deleted['payments'], [self.payments[0].id, self.payments[1].id])
+        self.assertEqual(len(deleted['leases']), 2)
+
+    def test_bad_cursors(self):
+        for cursor in ('abc', '1.5', '-1', '9' * 30, '9' * 5000):
+            self.assertEqual(self.client.get('/sync', {'since': cursor}).status_code, 400, cursor[:40])
+        # Older than the tombstones kept
+        self.assertEqual(self.client.get('/sync', {'since': '1'}).status_code, 410)
+
+class EventTests(SimpleTestCase):
+    """Every stream has a bounded queue, a slow one overflows"""
+
+    def tearDown(self):
+        events.hub.clear()
+
+    @override_settings(EVENTS=dict(settings.EVENTS, QUEUE_SIZE=3))
+    def test_overflow(self):
+        async def scenario():
+            subscription = events.hub.subscribe(1)
+            for i in range(5):
+                events.hub.deliver(1, {"ids": [i]})
+            # Delivered to another landlord's streams only
+            events.hub.deliver(2, {"ids": [9]})
+            await asyncio.sleep(0)
+            received = [await subscription.next()]
+            events.hub.deliver(1, {"ids": [5]})
+            await asyncio.sleep(0)
+            received.append(await subscription.next())
+            events.hub.unsubscribe(subscription)
+            return received
+
+        self.assertEqual(async_to_sync(scenario)(), [events.OVERFLOW, {"ids": [5]}])
+        self.assertFalse(events.hub.listening())
+
+
+class EventStreamTests(APITransactionTestCase):
+    """GET /events streams the landlord's committed writes"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='landlord@test.com', password='pw')
+        self.token = Token.objects.create(user=user)
+        self.landlord = Landlord.objects.create(user=user)
+        self.tenant = Tenant.objects.create(full_name='Tenant', phone_number='555', landlord=self.landlord)
+        self.cash = PaymentType.objects.create(label='Cash')
+        self.application = EventStreamRouter(None)
+
+    def tearDown(self):
+        events.hub.clear()
+
+    def stream(self, headers, write=None):
+        """Messages sent by the stream until `write` is received"""
+        async def scenario():
+            sent = []
+            received = asyncio.Queue()
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/events',
+                     'headers': headers, 'query_string': b''}
+            task = asyncio.ensure_future(self.application(scope, received.get, send))
+            if write is not None:
+                while not events.hub.listening(self.landlord.id):
+                    await asyncio.sleep(0.01)
+                await sync_to_async(write)()
+                while not any(message.get('body', b'').startswith(b'data:') for message in sent):
+                    await asyncio.sleep(0.01)
+            await received.put({'type': 'http.disconnect'})
+            await task
+            return sent
+
+        return async_to_sync(scenario)()
+
+    def test_stream(self):
+        def write():
+            return Payment.objects.create(date=date(2021, 1, 1), amount=1000, ref_num='',
+                                          tenant=self.tenant, payment_type=self.cash,
+                                          landlord=self.landlord)
+
+        sent = self.stream([(b'authorization', f'Token {self.token.key}'.encode())], write)
+        self.assertEqual(sent[0]['status'], 200)
+        payment = Payment.objects.get()
+        self.assertEqual(sent[-1]['body'],
+                         b'data: {"resource":"payments","action":"saved","ids":[%d]}\n\n' % payment.id)
+        self.assertFalse(events.hub.listening())
+
+    def test_credentials(self):
+        self.assertEqual(self.stream([])[0]['status'], 401)
+        self.assertEqual(self.stream([(b'authorization', b'Token wrong')])[0]['status'], 401)
+
+    @override_settings(EVENTS=dict(settings.EVENTS, HEARTBEAT_SECONDS=0.02, REAUTH_SECONDS=0.3))
+    def test_revoked_credentials_end_the_stream(self):
+        checks = []
+        authenticate = streams.authenticate
+
+        async def counted(header):
+            checks.append(header)
+            return await authenticate(header)
+
+        async def scenario():
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': b'',
+                     'headers': [(b'authorization', f'Token {self.token.key}'.encode())]}
+            task = asyncio.ensure_future(self.application(scope, asyncio.Queue().get, send))
+            while not events.hub.listening(self.landlord.id):
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.4)
+            self.assertFalse(task.done())
+            await sync_to_async(self.token.delete)()
+            revoked = asyncio.get_running_loop().time()
+            # Ends within REAUTH_SECONDS, without the client disconnecting
+            await asyncio.wait_for(task, 5)
+            return sent, asyncio.get_running_loop().time() - revoked
+
+        with mock.patch.object(streams, 'authenticate', counted):
+            sent, elapsed = async_to_sync(scenario)()
+        self.assertLess(elapsed, 0.3 + 0.2)
+        pings = [message.get('body') for message in sent].count(b': ping\n\n')
+        # Pings keep their pace, the credentials are checked far less often
+        self.assertGreater(pings, 10)
+        self.assertLessEqual(len(checks), 4)
+        self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b': credentials revoked\n\n'})
+        self.assertFalse(events.hub.listening())
+
+
+class TypeaheadTests(APITransactionTestCase):
+    """GET /typeahead answers from an index kept up to date by writes"""
+
+    def setUp(self):
+        indexes.clear()
+        user = User.objects.create_user(username='landlord@test.com', password='pw')
+        self.landlord = Landlord.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        self.tenant = Tenant.objects.create(
+            full_name='John Smith', phone_number='(615) 555-0101', email='jsmith@example.com',
+            landlord=self.landlord)
+        self.rental = Property.objects.create(
+            street='12 Smithson Ave', city='Nashville', state='TN', postal_code='37201',
+            landlord=self.landlord)
+        other = Landlord.objects.create(user=User.objects.create_user(username='other@test.com'))
+        Tenant.objects.create(full_name='Jane Smith', landlord=other)
+
+    def tearDown(self):
+        indexes.clear()
+
+    def lookup(self, query, **params):
+        response = self.client.get('/typeahead', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [tuple(row) for row in response.json()]
+
+    def test_user_without_landlord(self):
+        user = User.objects.create_user(username='staff@test.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        self.assertEqual(self.lookup('smith'), [])
+
+    def test_matches(self):
+        tenant = ('tenant', self.tenant.id, 'John Smith')
+        rental = ('property', self.rental.id, '12 Smithson Ave, Nashville, TN 37201')
+        self.assertEqual(self.lookup('smi'), [tenant, rental])
+        self.assertEqual(self.lookup('John  SM'), [tenant])
+        self.assertEqual(self.lookup('615-555'), [tenant])
+        self.assertEqual(self.lookup('jsmith@'), [tenant])
+        self.assertEqual(self.lookup('nashville tn'), [rental])
+        self.assertEqual(self.lookup('smi', limit=1), [tenant])
+        self.assertEqual(self.lookup('zzz'), [])
+        self.assertEqual(self.client.get('/typeahead', {'q': 's', 'limit': 'x'}).status_code, 400)
+
+        # Built once, then answered from memory
+        with self.assertNumQueries(0):
+            self.lookup('smi')
+
+    def test_writes_update_the_index(self):
+        self.lookup('smi')
+        self.tenant.full_name = 'John Smythe'
+        self.tenant.save()
+        added = Tenant.objects.create(full_name='Ann Smith', landlord=self.landlord)
+        self.client.delete(f'/properties/{self.rental.id}')
+
+        # Updated in place, not rebuilt
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup('smi'), [('tenant', added.id, 'Ann Smith')])
+            self.assertEqual(self.lookup('smy'), [('tenant', self.tenant.id, 'John Smythe')])
+
+    @override_settings(TYPEAHEAD=dict(settings.TYPEAHEAD, MAX_KEYS=5))
+    def test_least_recently_used_index_is_evicted(self):
+        self.lookup('smi')
+        indexes.get(0)
+        self.assertFalse(indexes.loaded(self.landlord.id))
+        self.assertTrue(indexes.loaded(0))
+
+
+class JobTests(CrossCheckTestCase):
+    """Jobs are queued by the API, claimed once and polled at /jobs/{id}"""
+
+    def setUp(self):
+        super().setUp()
+        self.tenant, _ = self.create_leased_tenants(1)
+        self.cash = PaymentType.objects.create(label='Cash')
+
+    def run_jobs(self):
+        for pk in jobs.claim('test', 10):
+            jobs.execute(pk)
+
+    def test_async_import(self):
+        response = self.client.post(
+            '/payments/bulk',
+            f'date,amount,ref_num,tenant,type\n2021-01-05,$1000,a,{self.tenant.id},{self.cash.id}\n',
+            content_type='text/csv', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], response.data['url'])
+        self.assertEqual(Payment.objects.count(), 0)
+
+        self.assertEqual(self.client.get(response['Location'])['Retry-After'], '1')
+        self.run_jobs()
+        # Claimed once only
+        self.assertEqual(jobs.claim('test', 10), [])
+
+        job = self.client.get(response['Location']).data
+        self.assertEqual((job['status'], job['progress'], job['attempts']), ('succeeded', 1, 1))
+        self.assertEqual(job['result']['created'], 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        Job.objects.get().input.delete()
+
+    def test_export_output(self):
+        response = self.client.post(
+            '/jobs', {"kind": "export", "payload": {"resource": "tenants"}}, format='json')
+        self.run_jobs()
+        job = self.client.get(response['Location']).data
+        self.assertEqual(job['result'], {'rows': 1})
+
+        download = self.client.get(job['output'])
+        self.assertEqual(b''.join(download.streaming_content).decode().splitlines()[1],
+                         f'{self.tenant.id},Tenant 0,555,')
+        download.close()
+        Job.objects.get().output.delete()
+
+    def test_statements(self):
+        year = date.today().year
+        for day in (1, 2):
+            Payment.objects.create(
+                date=date(year, 1, day), amount=500, ref_num=f'r{day}', tenant=self.tenant,
+                payment_type=self.cash, landlord=self.landlord)
+        # No lease or payment that year, no statement
+        Tenant.objects.create(full_name='Gone', landlord=self.landlord)
+
+        response = self.client.post(
+            '/jobs', {"kind": "statements", "payload": {"year": year}}, format='json')
+        self.run_jobs()
+        job = self.client.get(response['Location']).data
+        self.assertEqual(job['result'], {'statements': 1})
+
+        download = self.client.get(job['output'])
+        with zipfile.ZipFile(io.BytesIO(b''.join(download.streaming_content))) as archive:
+            name = f'{self.tenant.id}-tenant-0'
+            self.assertEqual(
+                sorted(archive.namelist()), [f'csv/{name}.csv', f'html/{name}.html', 'summary.csv'])
+            self.assertEqual(archive.read(f'csv/{name}.csv').decode().splitlines()[1:],
+                             [f'{year}-01-01,500,r1,Cash,', f'{year}-01-02,500,r2,Cash,'])
+            self.assertIn('Received: 1000', archive.read(f'html/{name}.html').decode())
+        download.close()
+        Job.objects.get().output.delete()
+
+    def test_statements_skip_payments_of_foreign_tenants(self):
+        year = date.today().year
+        stranger = Landlord.objects.create(user=User.objects.create_user(username='other@test.com'))
+        foreign = Tenant.objects.create(full_name='Foreign', landlord=stranger)
+        later = Tenant.objects.create(full_name='Later', landlord=self.landlord)
+        # The API accepts any tenant id on a payment
+        for tenant in (self.tenant, foreign, later):
+            Payment.objects.create(
+                date=date(year, 3, 1), amount=100, ref_num='', tenant=tenant,
+                payment_type=self.cash, landlord=self.landlord)
+
+        found = {statement['name']: len(statement['payments'])
+                 for statement in statements.collect(self.landlord, year)}
+        self.assertEqual(found, {'Tenant 0': 1, 'Later': 1})
+
+    def test_retries_with_backoff(self):
+        def broken(job):
+            raise RuntimeError('database went away')
+
+        jobs.handlers['broken'] = broken
+        self.addCleanup(jobs.handlers.pop, 'broken')
+        job = jobs.enqueue('broken', max_attempts=2)
+
+        with self.assertLogs('crosscheckapi.jobs', 'ERROR'):
+            self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertEqual(job.error, 'RuntimeError: database went away')
+        # Not due before the backoff
+        self.assertEqual(jobs.claim('test', 10), [])
+
+        Job.objects.update(run_at=job.created_at)
+        with self.assertLogs('crosscheckapi.jobs', 'ERROR'):
+            self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_unknown_kind(self):
+        response = self.client.post('/jobs', {"kind": "purge_deleted"}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rebuild_ledger_scope(self):
+        stranger = Landlord.objects.create(user=User.objects.create_user(username='other@test.com'))
+        self.create_leased_tenants(1)
+        with mock.patch('crosscheckapi.tasks.ledger.rebuild', return_value=0) as rebuild:
+            response = self.client.post('/jobs', {"kind": "rebuild_ledger"}, format='json')
+            self.assertEqual(response.status_code, 202)
+            self.run_jobs()
+            leases = rebuild.call_args[0][0]
+            self.assertEqual(set(leases), set(TenantPropertyRel.objects.filter(
+                rented_property__landlord=self.landlord)))
+
+            # Clients can not ask for every landlord's ledger
+            response = self.client.post(
+                '/jobs', {"kind": "rebuild_ledger", "payload": {"all": True}}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=stranger.user).key}')
+            stranger.delete()
+            response = self.client.post('/jobs', {"kind": "rebuild_ledger"}, format='json')
+            self.assertEqual(response.status_code, 403)
+
+            # Without a landlord only the server's explicit request rebuilds everything
+            unscoped = jobs.enqueue('rebuild_ledger')
+            self.run_jobs()
+            unscoped.refresh_from_db()
+            self.assertEqual((unscoped.status, unscoped.attempts), (Job.FAILED, 1))
+
+            call_command('rebuild_ledger', '--background', stdout=io.StringIO())
+            self.run_jobs()
+            self.assertEqual(rebuild.call_count, 2)
+            self.assertEqual(rebuild.call_args[0][0].count(), TenantPropertyRel.objects.count())
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """Safe requests read from a healthy replica unless they wrote.
+    No database: test transactions would pin every read to the primary
+    """
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        routing.health.checks['replica'] = (time.monotonic(), True, 0)
+
+    def tearDown(self):
+        routing.health.clear()
+
+    def route(self, method, write=False, **headers):
+        """The alias a read goes to after `method` (and maybe a write),
+        and the response
+        """
+        request = RequestFactory().generic(method, '/payments', HTTP_AUTHORIZATION='Token abc', **headers)
+        seen = []
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Payment)
+            seen.append(self.router.db_for_read(Payment))
+            return HttpResponse()
+
+        with self.settings(DATABASE_ROUTING=dict(settings.DATABASE_ROUTING, REPLICAS=['replica'])):
+            response = ReplicaMiddleware(view)(request)
+        return seen[0], response
+
+    def test_reads_and_writes(self):
+        # Outside a request everything uses the primary
+        self.assertEqual(self.router.db_for_read(Payment), 'default')
+
+        alias, response = self.route('GET')
+        self.assertEqual(alias, 'replica')
+        self.assertNotIn(routing.STICKY_COOKIE, response.cookies)
+
+        alias, response = self.route('GET', write=True)
+        self.assertEqual(alias, 'default')
+        until = response[routing.STICKY_HEADER]
+        self.assertEqual(response.cookies[routing.STICKY_COOKIE].value, until)
+
+        # The client wrote, it reads from the primary for STICKY_SECONDS
+        # on any worker, with the cookie or the header
+        self.assertEqual(self.route('GET', HTTP_COOKIE=f'{routing.STICKY_COOKIE}={until}')[0], 'default')
+        self.assertEqual(self.route('GET', HTTP_X_PRIMARY_UNTIL=until)[0], 'default')
+        # Once the window ended, or with a deadline it was never given
+        self.assertEqual(self.route('GET', HTTP_X_PRIMARY_UNTIL=str(time.time() - 1))[0], 'replica')
+        self.assertEqual(self.route('GET', HTTP_X_PRIMARY_UNTIL=str(time.time() + 3600))[0], 'replica')
+        self.assertEqual(self.route('GET', HTTP_X_PRIMARY_UNTIL='soon')[0], 'replica')
+
+        alias, response = self.route('POST')
+        self.assertEqual(alias, 'default')
+        self.assertIn(routing.STICKY_HEADER, response)
+
+    def test_unhealthy_replica(self):
+        routing.health.checks['replica'] = (time.monotonic(), False, 30)
+        self.assertEqual(self.route('GET')[0], 'default')
+
+    def test_health_checks_run_in_the_background(self):
+        release = threading.Event()
+        calls = []
+
+        def check(alias):
+            calls.append(alias)
+            release.wait(5)
+            routing.health.checks[alias] = (time.monotonic(), False, None)
+
+        # The last check went stale, requests keep routing on it
+        routing.health.checks['replica'] = (time.monotonic() - 3600, True, 0)
+        with mock.patch.object(routing.health, 'check', check), mock.patch.object(routing, 'connections'):
+            self.assertTrue(routing.health.healthy('replica'))
+            self.assertTrue(routing.health.healthy('replica'))
+            release.set()
+            for _ in range(100):
+                if not routing.health.running:
+                    break
+                time.sleep(0.01)
+            self.assertFalse(routing.health.healthy('replica'))
+        # One probe however many requests came in meanwhile
+        self.assertEqual(calls, ['replica'])
+
+        # Never checked: skipped until the first check finished
+        routing.health.clear()
+        with mock.patch.object(routing.health, 'refresh'):
+            self.assertFalse(routing.health.healthy('replica'))
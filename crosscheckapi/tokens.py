@@ -0,0 +1,155 @@
+"""Short-lived HMAC signed access tokens and refresh tokens
+
+Opt-in with SIGNED_TOKENS['ENABLED']. An access token carries the user
+and landlord ids and its expiry, so checking it is an HMAC and a set
+lookup with no query at all:
+
+    a.<user id>.<landlord id>.<issued at>.<expires at>.<jti>.<signature>
+
+Refresh tokens start with `r` and last longer. POST /token/refresh
+trades one for a new pair, checking the user is still active, and
+POST /token/revoke revokes a token before it expires.
+
+Revocations are rows of RevokedToken, kept in memory by `denylist`:
+loaded with the first token checked by the process and then topped up
+with the rows added since, at most every DENYLIST_SECONDS. A token
+revoked by another process is accepted for at most that long.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from django.conf import settings
+from django.utils import timezone
+from crosscheckapi.models import RevokedToken
+
+ACCESS = 'a'
+REFRESH = 'r'
+
+Claims = namedtuple('Claims', 'kind user_id landlord_id issued_at expires_at jti')
+
+
+class InvalidToken(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def signing_key(secret):
+    """Derived once per secret, like django.utils.crypto.salted_hmac"""
+    return hashlib.sha256(b'crosscheckapi.tokens' + secret.encode()).digest()
+
+
+def sign(body):
+    digest = hmac.new(signing_key(settings.SECRET_KEY), body.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def encode(kind, user_id, landlord_id, lifetime):
+    now = int(time.time())
+    body = (f'{kind}.{user_id}.{landlord_id or ""}.{now}.{now + lifetime}.'
+            f'{secrets.token_urlsafe(12)}')
+    return f'{body}.{sign(body)}'
+
+
+def decode(token, kind=ACCESS):
+    """The claims of a valid, unexpired, unrevoked token of `kind`"""
+    body, _, signature = token.rpartition('.')
+    fields = body.split('.')
+    try:
+        if not hmac.compare_digest(sign(body), signature) or len(fields) != 6 or fields[0] != kind:
+            raise ValueError
+        claims = Claims(fields[0], int(fields[1]), int(fields[2]) if fields[2] else None,
+                        int(fields[3]), int(fields[4]), fields[5])
+    except (TypeError, ValueError):
+        # compare_digest raises TypeError on non-ASCII signatures
+        raise InvalidToken('Invalid token.')
+    if claims.expires_at <= time.time():
+        raise InvalidToken('Token expired.')
+    if denylist.revoked(claims):
+        raise InvalidToken('Token revoked.')
+    return claims
+
+
+def issue(user_id, landlord_id):
+    """A fresh access and refresh token, as sent to the client"""
+    options = settings.SIGNED_TOKENS
+    return {
+        "access": encode(ACCESS, user_id, landlord_id, options['ACCESS_SECONDS']),
+        "refresh": encode(REFRESH, user_id, landlord_id, options['REFRESH_SECONDS']),
+        "token_type": "Bearer",
+        "expires_in": options['ACCESS_SECONDS'],
+    }
+
+
+def as_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, dt_timezone.utc)
+
+
+class Denylist:
+    """jti -> expiry and user id -> revoked at, as timestamps"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.tokens = {}
+            self.users = {}
+            self.last_id = 0
+            self.loaded_at = None
+
+    def load(self):
+        """Add the rows revoked since the last load and forget the expired ones"""
+        now = time.time()
+        rows = (RevokedToken.objects.filter(pk__gt=self.last_id, expires_at__gt=as_datetime(now))
+                .order_by('id').values_list('id', 'jti', 'user_id', 'revoked_at', 'expires_at'))
+        with self.lock:
+            for pk, jti, user_id, revoked_at, expires_at in rows:
+                self.add(jti, user_id, revoked_at.timestamp(), expires_at.timestamp())
+                self.last_id = max(self.last_id, pk)
+            self.tokens = {jti: expires for jti, expires in self.tokens.items() if expires > now}
+            self.users = {user_id: entry for user_id, entry in self.users.items() if entry[1] > now}
+            self.loaded_at = time.monotonic()
+
+    def add(self, jti, user_id, revoked_at, expires_at):
+        if jti:
+            self.tokens[jti] = expires_at
+        else:
+            previous = self.users.get(user_id, (0, 0))
+            self.users[user_id] = (max(previous[0], revoked_at), max(previous[1], expires_at))
+
+    def revoked(self, claims):
+        if (self.loaded_at is None
+                or time.monotonic() - self.loaded_at >= settings.SIGNED_TOKENS['DENYLIST_SECONDS']):
+            self.load()
+        if claims.jti in self.tokens:
+            return True
+        user = self.users.get(claims.user_id)
+        # A token issued in the second of the revocation is revoked too
+        return user is not None and claims.issued_at <= user[0]
+
+    def revoke(self, claims):
+        """Reject one token until it expires"""
+        self.store(claims.jti, claims.user_id, as_datetime(claims.expires_at))
+
+    def revoke_user(self, user_id):
+        """Reject every token of the user issued so far"""
+        options = settings.SIGNED_TOKENS
+        lifetime = max(options['ACCESS_SECONDS'], options['REFRESH_SECONDS'])
+        self.store('', user_id, timezone.now() + timedelta(seconds=lifetime))
+
+    def store(self, jti, user_id, expires_at):
+        row = RevokedToken.objects.create(jti=jti, user_id=user_id, expires_at=expires_at)
+        # Rows nobody needs any more go with the writes, which are rare
+        RevokedToken.objects.filter(expires_at__lte=row.revoked_at).delete()
+        with self.lock:
+            self.add(jti, user_id, row.revoked_at.timestamp(), expires_at.timestamp())
+
+
+denylist = Denylist()
@@ -0,0 +1,231 @@
+"""In-memory prefix index behind GET /typeahead
+
+Every landlord gets a sorted list of keys over tenant names, phone
+numbers and emails and property addresses. A name or address has one
+key per word, starting there and running to the end of the text, so
+`smi` and `john sm` both find "John Smith". Phone numbers
+are keyed by their digits. A lookup is a bisect to the first key
+starting with the query and a scan until `limit` distinct rows matched.
+
+The index of a landlord is built on their first lookup. Writes in this
+process update it once their transaction commits, writes of other
+processes show up when it expires after TYPEAHEAD['TTL'] seconds.
+Indexes are evicted least recently used first once they hold more than
+TYPEAHEAD['MAX_KEYS'] keys together.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from crosscheckapi.models import Property, Tenant
+
+WORD = re.compile(r'[\w@.+-]+')
+PHONE = re.compile(r'[\d\s().+-]+')
+
+# type -> (model, columns read)
+SOURCES = {
+    'tenant': (Tenant, ('id', 'full_name', 'phone_number', 'email')),
+    'property': (Property, ('id', 'street', 'city', 'state', 'postal_code')),
+}
+TYPES = {model: name for name, (model, _) in SOURCES.items()}
+
+
+def normalize(text):
+    """Lower case words, without the punctuation between them"""
+    return ' '.join(WORD.findall(text.lower()))
+
+
+def suffixes(text):
+    """The normalized text from the start of each word on"""
+    text = normalize(text)
+    found = [text] if text else []
+    space = text.find(' ')
+    while space != -1:
+        found.append(text[space + 1:])
+        space = text.find(' ', space + 1)
+    return found
+
+
+def entry(kind, row):
+    """(label, keys) of one `values_list` row of SOURCES[kind]"""
+    if kind == 'tenant':
+        _, full_name, phone_number, email = row
+        label = full_name
+        keys = suffixes(full_name)
+        digits = re.sub(r'\D', '', phone_number or '')
+        if digits:
+            keys.append(digits)
+        if email:
+            keys.append(email.lower())
+    else:
+        _, street, city, state, postal_code = row
+        label = f'{street}, {city}, {state} {postal_code}'
+        keys = suffixes(label)
+    return label, set(keys)
+
+
+def terms(query):
+    """Keys to look up for what the user typed"""
+    found = [normalize(query)]
+    if PHONE.fullmatch(query):
+        digits = re.sub(r'\D', '', query)
+        if digits and digits != found[0]:
+            found.append(digits)
+    return [term for term in found if term]
+
+
+class LandlordIndex:
+    """Sorted keys, the (type, id) each belongs to at the same position,
+    and the label and keys of each row
+    """
+
+    def __init__(self, rows):
+        self.rows = {}
+        keys = []
+        refs = []
+        for kind, pk, label, row_keys in rows:
+            self.rows[kind, pk] = (label, row_keys)
+            keys.extend(row_keys)
+            refs.extend([(kind, pk)] * len(row_keys))
+        # Sorting positions by plain strings beats sorting tuples
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.refs = [refs[i] for i in order]
+        self.built = time.monotonic()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def put(self, kind, pk, label, keys):
+        self.remove(kind, pk)
+        self.rows[kind, pk] = (label, keys)
+        for key in keys:
+            i = bisect_right(self.keys, key)
+            self.keys.insert(i, key)
+            self.refs.insert(i, (kind, pk))
+
+    def remove(self, kind, pk):
+        _, keys = self.rows.pop((kind, pk), (None, ()))
+        for key in keys:
+            i = bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                if self.refs[i] == (kind, pk):
+                    del self.keys[i]
+                    del self.refs[i]
+                    break
+                i += 1
+
+    def lookup(self, query, limit):
+        """Up to `limit` (type, id, label) ordered by the key they matched"""
+        found = {}
+        for term in terms(query):
+            i = bisect_left(self.keys, term)
+            while i < len(self.keys) and len(found) < limit:
+                key = self.keys[i]
+                if not key.startswith(term):
+                    break
+                found.setdefault(self.refs[i], key)
+                i += 1
+        ordered = sorted(found.items(), key=lambda item: item[1])
+        return [(kind, pk, self.rows[kind, pk][0]) for (kind, pk), _ in ordered]
+
+
+def load(landlord_id):
+    """Build the index of a landlord, one query per type"""
+    rows = []
+    for kind, (model, columns) in SOURCES.items():
+        for row in model.objects.filter(landlord_id=landlord_id).values_list(*columns):
+            rows.append((kind, row[0], *entry(kind, row)))
+    return LandlordIndex(rows)
+
+
+class Indexes:
+    """landlord id -> LandlordIndex, least recently used first"""
+
+    def __init__(self):
+        self.indexes = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, landlord_id):
+        with self.lock:
+            index = self.indexes.get(landlord_id)
+            if index is not None:
+                if index.built + settings.TYPEAHEAD['TTL'] > time.monotonic():
+                    self.indexes.move_to_end(landlord_id)
+                    return index
+                self.drop(landlord_id)
+
+        index = load(landlord_id)
+        with self.lock:
+            self.drop(landlord_id)
+            self.indexes[landlord_id] = index
+            self.size += len(index)
+            # Never evicts the index just built, however big
+            while self.size > settings.TYPEAHEAD['MAX_KEYS'] and len(self.indexes) > 1:
+                self.drop(next(iter(self.indexes)))
+        return index
+
+    def drop(self, landlord_id):
+        """Call with the lock held"""
+        index = self.indexes.pop(landlord_id, None)
+        if index is not None:
+            self.size -= len(index)
+
+    def loaded(self, landlord_id):
+        return landlord_id in self.indexes
+
+    def lookup(self, landlord_id, query, limit):
+        index = self.get(landlord_id)
+        with self.lock:
+            return index.lookup(query, limit)
+
+    def update(self, landlord_id, kind, rows):
+        """Put `values_list` rows of SOURCES[kind] into a loaded index"""
+        with self.lock:
+            index = self.indexes.get(landlord_id)
+            if index is None:
+                return
+            self.size -= len(index)
+            for row in rows:
+                index.put(kind, row[0], *entry(kind, row))
+            self.size += len(index)
+
+    def remove(self, landlord_id, kind, ids):
+        with self.lock:
+            index = self.indexes.get(landlord_id)
+            if index is None:
+                return
+            self.size -= len(index)
+            for pk in ids:
+                index.remove(kind, pk)
+            self.size += len(index)
+
+    def clear(self):
+        with self.lock:
+            self.indexes.clear()
+            self.size = 0
+
+
+indexes = Indexes()
+
+
+def saved(model, landlord_id, rows):
+    """Put `values_list` rows of `model` (see SOURCES) into the index of
+    the landlord once the transaction commits
+    """
+    if landlord_id is None or not indexes.loaded(landlord_id):
+        return
+    rows = list(rows)
+    transaction.on_commit(lambda: indexes.update(landlord_id, TYPES[model], rows))
+
+
+def deleted(model, landlord_id, ids):
+    """Drop rows of `model` once the transaction commits"""
+    if landlord_id is None or not indexes.loaded(landlord_id):
+        return
+    ids = list(ids)
+    transaction.on_commit(lambda: indexes.remove(landlord_id, TYPES[model], ids))
@@ -0,0 +1,146 @@
+"""Per-landlord resource versions for conditional GET (ETag / 304)
+
+Every write to a model bumps the version of its resource. List views
+wrapped with `versioned` read the versions they depend on with one
+query on a tiny table, answer `If-None-Match` with a 304 when nothing
+changed and otherwise serve the rendered body from a process cache
+keyed by those versions.
+"""
+import secrets
+from datetime import date
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from crosscheckapi.authentication import TTLCache
+from crosscheckapi.models import (
+    Payment, PaymentType, Property, ResourceVersion, Tenant, TenantPropertyRel
+)
+
+RESOURCES = {
+    Tenant: 'tenants',
+    Property: 'properties',
+    TenantPropertyRel: 'leases',
+    Payment: 'payments',
+    PaymentType: 'paymenttypes',
+}
+
+# Shared by every landlord, stored with landlord_id 0
+GLOBAL_RESOURCES = {'paymenttypes'}
+
+bodies = TTLCache(settings.RESPONSE_CACHE['MAX_SIZE'], settings.RESPONSE_CACHE['TTL'])
+
+
+def scope(resource, landlord_id):
+    return 0 if resource in GLOBAL_RESOURCES else landlord_id
+
+
+def start_version():
+    """Counters start at a random value so a recreated database (or a
+    rolled back test) never repeats a version still held in a cache
+    """
+    return secrets.randbits(40)
+
+
+def bump(resource, landlord_id):
+    """Mark every cached representation of `resource` as stale"""
+    landlord_id = scope(resource, landlord_id)
+    versions = ResourceVersion.objects.filter(resource=resource, landlord_id=landlord_id)
+    if versions.update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ResourceVersion.objects.create(
+                resource=resource, landlord_id=landlord_id, version=start_version())
+    except IntegrityError:
+        # Created by a concurrent request in the meantime
+        versions.update(version=F('version') + 1)
+
+
+def landlord_of(instance):
+    """Landlord id of any versioned model instance"""
+    if isinstance(instance, TenantPropertyRel):
+        return Tenant.objects.filter(pk=instance.tenant_id).values_list(
+            'landlord_id', flat=True).first()
+    return getattr(instance, 'landlord_id', 0)
+
+
+def bump_instance(instance):
+    landlord_id = landlord_of(instance)
+    if landlord_id is not None:
+        bump(RESOURCES[type(instance)], landlord_id)
+
+
+def current(resources, landlord_id):
+    """resource -> version, creating the counters seen for the first time"""
+    condition = Q()
+    for resource in resources:
+        condition |= Q(resource=resource, landlord_id=scope(resource, landlord_id))
+    versions = dict(ResourceVersion.objects.filter(condition).values_list('resource', 'version'))
+
+    for resource in resources:
+        if resource not in versions:
+            try:
+                with transaction.atomic():
+                    versions[resource] = ResourceVersion.objects.create(
+                        resource=resource, landlord_id=scope(resource, landlord_id),
+                        version=start_version()).version
+            except IntegrityError:
+                versions[resource] = ResourceVersion.objects.get(
+                    resource=resource, landlord_id=scope(resource, landlord_id)).version
+    return versions
+
+
+def matches(request, etag):
+    """True when `etag` is one of the tags in If-None-Match"""
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def versioned(*resources):
+    """Conditional GET for a ViewSet action depending on `resources`.
+
+    The ETag covers the landlord, the negotiated format and API version,
+    today's date (lease `active` flags change at midnight) and the
+    version of each resource. Rendered 200 bodies are kept in `bodies`
+    keyed by the ETag and the full path, so query parameters get their
+    own entry.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(self, request, *args, **kwargs):
+            landlord_id = request.landlord.id if request.landlord else 0
+            versions = current(resources, landlord_id)
+            etag = '"{}"'.format('.'.join(
+                [str(landlord_id), request.accepted_renderer.format, str(request.version),
+                 str(date.today().toordinal())] +
+                [str(versions[resource]) for resource in resources]))
+
+            headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+            if matches(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            key = (view.__qualname__, etag, request.get_full_path())
+            cached = bodies.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = view(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                # Render now so the bytes can be reused. dispatch()
+                # finalizes the response again, which is a no-op
+                response = self.finalize_response(request, response, *args, **kwargs)
+                response.render()
+                bodies.set(key, (response.content, response['Content-Type']))
+
+            for header, value in headers.items():
+                response[header] = value
+            return response
+        return wrapper
+    return decorator
@@ -1,6 +1,13 @@
 from .auth import register_user
 from .auth import login_user
+from .auth import refresh_token
+from .auth import revoke_token
 from .tenant import Tenants
 from .payment import Payments
 from .property import Properties
-from .paymenttype import PaymentTypes
\ No newline at end of file
+from .paymenttype import PaymentTypes
+from .ledger import Ledger
+from .job import Jobs
+from .sync import Sync
+from .typeahead import Typeahead
+from .metrics import metrics
\ No newline at end of file
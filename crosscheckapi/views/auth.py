@@ -1,10 +1,12 @@
 import json
+from django.conf import settings
 from django.http import HttpResponse
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from rest_framework import status
 from django.views.decorators.csrf import csrf_exempt
+from crosscheckapi import tokens
 from crosscheckapi.models import Landlord
 
 @csrf_exempt
@@ -25,6 +27,13 @@ def login_user(request):
         password = req_body['password']
         authenticated_user = authenticate(username=username, password=password)
 
+        # With signed tokens only the landlord id is needed, not the stored token
+        if authenticated_user is not None and settings.SIGNED_TOKENS['ENABLED']:
+            landlord_id = Landlord.objects.filter(
+                user=authenticated_user).values_list('id', flat=True).first()
+            data = json.dumps({"valid": True, **tokens.issue(authenticated_user.id, landlord_id)})
+            return HttpResponse(data, content_type='application/json')
+
         # If authentication was successful, respond with their token
         if authenticated_user is not None:
             token = Token.objects.get(user=authenticated_user)
@@ -66,7 +75,63 @@ def register_user(request):
     # Use the REST Framework's token generator on the new user account
     token = Token.objects.create(user=new_user)
 
+    if settings.SIGNED_TOKENS['ENABLED']:
+        data = json.dumps(tokens.issue(new_user.id, landlord.id))
+        return HttpResponse(data, content_type='application/json', status=status.HTTP_201_CREATED)
+
     # Return the token to the client
     data = json.dumps({"token": token.key})
     return HttpResponse(data, content_type='application/json', status=status.HTTP_201_CREATED)
 
+def token_error(reason):
+    data = json.dumps({"reason": reason})
+    return HttpResponse(data, content_type='application/json', status=status.HTTP_401_UNAUTHORIZED)
+
+@csrf_exempt
+def refresh_token(request):
+    '''Trades a signed refresh token for a new access and refresh token.
+    The old refresh token is revoked
+
+    Method arguments:
+        request -- The full HTTP request object
+    '''
+
+    if request.method != 'POST' or not settings.SIGNED_TOKENS['ENABLED']:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+    req_body = json.loads(request.body.decode())
+    try:
+        claims = tokens.decode(str(req_body.get('refresh', '')), tokens.REFRESH)
+    except tokens.InvalidToken as ex:
+        return token_error(str(ex))
+
+    # Unlike access tokens, a refresh checks the user is still there and active
+    user = User.objects.filter(pk=claims.user_id, is_active=True).values_list(
+        'id', 'landlord__id').first()
+    if user is None:
+        return token_error('User inactive or deleted.')
+
+    tokens.denylist.revoke(claims)
+    data = json.dumps(tokens.issue(*user))
+    return HttpResponse(data, content_type='application/json')
+
+@csrf_exempt
+def revoke_token(request):
+    '''Revokes a signed access or refresh token before it expires
+
+    Method arguments:
+        request -- The full HTTP request object
+    '''
+
+    if request.method != 'POST' or not settings.SIGNED_TOKENS['ENABLED']:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+    req_body = json.loads(request.body.decode())
+    token = str(req_body.get('token', ''))
+    try:
+        claims = tokens.decode(token, token[:1])
+    except tokens.InvalidToken as ex:
+        return token_error(str(ex))
+
+    tokens.denylist.revoke(claims)
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,107 @@
+"""View module for handling requests about background jobs"""
+from django.conf import settings
+from django.http import FileResponse
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.viewsets import ViewSet
+from rest_framework.response import Response
+from rest_framework import serializers
+from crosscheckapi.jobs import enqueue
+from crosscheckapi.models import Job
+from crosscheckapi.tasks import CLIENT_KINDS
+
+
+class Jobs(ViewSet):
+    """Cross Check background jobs"""
+
+    def create(self, request):
+        """Handle POST requests queueing a job,
+        e.g. {"kind": "export", "payload": {"resource": "payments"}}
+        Returns:
+            Response -- JSON serialized job with 202 status code
+        """
+        kind = request.data.get("kind")
+        if kind not in CLIENT_KINDS:
+            return Response({"reason": f"kind must be one of {', '.join(sorted(CLIENT_KINDS))}"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Jobs of clients only ever see their own landlord's rows
+        if request.landlord is None:
+            return Response({"reason": "Only landlords can queue jobs"},
+                status=status.HTTP_403_FORBIDDEN)
+        payload = request.data.get("payload")
+        if isinstance(payload, dict) and 'all' in payload:
+            return Response({"reason": "all is reserved for jobs queued by the server"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        job = enqueue(kind, payload, landlord=request.landlord)
+        return accepted(job, request)
+
+    def retrieve(self, request, pk=None):
+        """Handle GET requests polling a single job
+        Returns:
+            Response -- JSON serialized job, with Retry-After until it finishes
+        """
+        try:
+            job = Job.objects.get(pk=pk, landlord=request.landlord)
+        except Job.DoesNotExist as ex:
+            return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
+
+        response = Response(JobSerializer(job, context={'request': request}).data)
+        if job.status in (Job.QUEUED, Job.RUNNING):
+            response['Retry-After'] = str(settings.JOBS['POLL_SECONDS'])
+        return response
+
+    def list(self, request):
+        """Handle GET requests to jobs resource, most recent first
+        Returns:
+            Response -- JSON serialized list of the landlord's last 50 jobs
+        """
+        jobs = Job.objects.filter(landlord=request.landlord).order_by('-created_at', '-id')
+
+        chosen_status = request.query_params.get('status', None)
+        if chosen_status is not None:
+            jobs = jobs.filter(status=chosen_status)
+
+        serializer = JobSerializer(jobs[:50], many=True, context={'request': request})
+        return Response(serializer.data)
+
+    @action(methods=['get'], detail=True)
+    def output(self, request, pk=None):
+        """Handle GET requests downloading the file a job produced
+        Returns:
+            FileResponse -- The file, streamed from disk
+        """
+        job = Job.objects.filter(pk=pk, landlord=request.landlord, status=Job.SUCCEEDED).first()
+        if job is None or not job.output:
+            return Response({'message': 'No output'}, status=status.HTTP_404_NOT_FOUND)
+
+        filename = job.output.name.rsplit('/', 1)[-1]
+        return FileResponse(job.output.open('rb'), as_attachment=True, filename=filename)
+
+
+def accepted(job, request):
+    """202 response pointing the client to the job to poll"""
+    data = JobSerializer(job, context={'request': request}).data
+    return Response(data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': data['url']})
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """JSON serializer for jobs"""
+    url = serializers.SerializerMethodField()
+    output = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ('id', 'url', 'kind', 'status', 'progress', 'attempts', 'max_attempts',
+                    'result', 'error', 'output', 'created_at', 'started_at', 'finished_at')
+
+    def get_url(self, job):
+        return self.context['request'].build_absolute_uri(reverse('job-detail', args=[job.id]))
+
+    def get_output(self, job):
+        if job.status != Job.SUCCEEDED or not job.output:
+            return None
+        return self.context['request'].build_absolute_uri(reverse('job-output', args=[job.id]))
@@ -0,0 +1,60 @@
+"""View module for handling requests about the rent ledger"""
+from datetime import date
+from rest_framework import status
+from rest_framework.viewsets import ViewSet
+from rest_framework.response import Response
+from rest_framework import serializers
+from crosscheckapi.models import LedgerEntry
+from crosscheckapi.versions import versioned
+
+
+def parse_month(value):
+    """Months are sent as `YYYY-MM`"""
+    year, month = value.split('-')[:2]
+    return date(int(year), int(month), 1)
+
+
+class Ledger(ViewSet):
+    """Cross Check rent ledger"""
+
+    @versioned('payments', 'leases', 'tenants', 'properties')
+    def list(self, request):
+        """Handle GET requests to the ledger resource.
+        Accepts `property`, `tenant`, `start` and `end` (YYYY-MM)
+        Returns:
+            Response -- JSON serialized list of ledger entries
+        """
+        landlord = request.landlord
+        entries = LedgerEntry.objects.filter(landlord=landlord)
+
+        try:
+            start = request.query_params.get('start', None)
+            if start is not None:
+                entries = entries.filter(month__gte=parse_month(start))
+
+            end = request.query_params.get('end', None)
+            if end is not None:
+                entries = entries.filter(month__lte=parse_month(end))
+
+            chosen_property = request.query_params.get('property', None)
+            if chosen_property is not None:
+                entries = entries.filter(rented_property_id=int(chosen_property))
+
+            chosen_tenant = request.query_params.get('tenant', None)
+            if chosen_tenant is not None:
+                entries = entries.filter(tenant_id=int(chosen_tenant))
+        except ValueError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = LedgerEntrySerializer(
+            entries.order_by('month', 'lease_id'), many=True, context={'request': request})
+
+        return Response(serializer.data)
+
+
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    """JSON serializer for ledger entries"""
+    class Meta:
+        model = LedgerEntry
+        fields = ('id', 'lease', 'tenant', 'rented_property', 'month',
+                    'expected', 'received', 'balance', 'payment_count')
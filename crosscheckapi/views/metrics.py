@@ -0,0 +1,16 @@
+"""View module exposing request metrics to Prometheus"""
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from crosscheckapi.metrics import registry
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """Handle GET requests for the metrics of this process.
+    Only staff users can read them
+    Returns:
+        HttpResponse -- Prometheus text exposition format
+    """
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,15 +1,30 @@
 """View module for handling requests about payments"""
+import shutil
+import tempfile
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files import File
 from django.core.exceptions import ValidationError
 from django.http import HttpResponseServerError
-from rest_framework import status
+from rest_framework import exceptions, status
 from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from datetime import datetime
-import operator
-from crosscheckapi.models import Tenant, Landlord, Payment, PaymentType, TenantPropertyRel
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from crosscheckapi.models import Tenant, Payment, PaymentType, TenantPropertyRel
+from crosscheckapi.bulk import body_ids, delete_payments, edit_payments
+from crosscheckapi.jobs import enqueue
+from crosscheckapi.importer import RowError, import_payments, parse_amount, parse_date, read_rows
+from crosscheckapi.matching import match_statement, read_statement
+from crosscheckapi.pagination import keyset_page
+from crosscheckapi.search import search_q
+from crosscheckapi.export import PAYMENT_COLUMNS, stream_export
+from crosscheckapi.renderers import CSVRenderer, NDJSONRenderer
+from crosscheckapi.versions import versioned
+from crosscheckapi.views.job import accepted
 
 class Payments(ViewSet):
     """ Cross Check payments """
@@ -20,31 +35,18 @@ class Payments(ViewSet):
             Response -- JSON serialized payment instance
         """
         # landlord = authenticated user
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
         tenant_id = int(request.data["full_name"])
         tenant = Tenant.objects.get(pk=tenant_id )
         payment = Payment()
 
-        # Splitting the datetime string on the T to save the date
-        date_string_list = request.data["date"].split('T')
-        date = date_string_list[0]
-        payment.date = date
-
-        # This field is looking for an integer.
-        # If the user includes a $, the string will
-        # split, be converted to an integer and saved
+        # Splitting the datetime string on the T to save the date.
+        # The amount field is looking for an integer, a $ is stripped
         try:
-            payment.amount = int(request.data["amount"])
-        except ValueError:
-            try:
-                amount_string_list = request.data["amount"].split('$')
-                float_amount = float(amount_string_list[1])
-                amount = int(float_amount)
-                payment.amount = amount
-            except IndexError:
-                float_amount = float(request.data["amount"])
-                amount = int(float_amount)
-                payment.amount = amount
+            payment.date = parse_date(request.data["date"])
+            payment.amount = parse_amount(request.data["amount"])
+        except RowError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
         
         payment.ref_num = request.data["ref_num"]
         payment.tenant = tenant
@@ -78,56 +80,37 @@ class Payments(ViewSet):
             Response -- JSON serialized payment instance
         """
         try:
-            payment = Payment.objects.get(pk=pk)
+            payment = Payment.objects.values(*PAYMENT_VALUES).get(pk=pk)
 
-            serializer = PaymentSerializer(
-                payment, context={'request': request})
-            return Response(serializer.data)
+            return Response(serialize_payment(payment))
         except Exception as ex:
             return HttpResponseServerError(ex, status=status.HTTP_404_NOT_FOUND)
 
+    @versioned('payments', 'tenants', 'paymenttypes')
     def list(self, request):
         """Handle GET requests to payments resource
         Returns:
             Response -- JSON serialized list of payments
         """
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
         payments = Payment.objects.filter(landlord=landlord)
         
-        # Search keyword query parameter.
-        # Allows the user to search by ref_num or name
-        # using the same search input.
-        keyword = self.request.query_params.get('keyword', None)
-        if keyword is not None:
-            payments = payments.filter(ref_num__icontains=keyword
-                        ) | payments.filter(tenant__full_name__icontains=keyword) 
-
-        # Date range query parameter
-        # Check for the parameter to distinguigh the fetch
-        # Use the values sent in the body for the range
-        date_range = self.request.query_params.get('date', None)
-        if date_range is not None:
-            print(date_range)
-            date_split = date_range.split('/')
-            print(date_split)
-            d1 = date_split[0]
-            d2 = date_split[1]
-            # d1 = request.data["startDate"]
-            # d2 = request.data["endDate"]
-            payments = payments.filter(date__range=(d1,d2))
-
-        # Specific tenant query parameter
-        chosen_tenant = self.request.query_params.get('tenant', None)
-        if chosen_tenant is not None:
-            payments = payments.filter(tenant__id=int(chosen_tenant))
+        payments = filter_payments(request, payments)
 
-        # Sort the payments by date starting with the most recent
-        sorted_payments = sorted(payments, key=operator.attrgetter('date'), reverse=True)
+        # Opt-in cursor mode. `?cursor` (empty for the first page)
+        # returns one page and an opaque cursor for the next one
+        if 'cursor' in self.request.query_params:
+            page, next_cursor = keyset_page(payments.values(*PAYMENT_VALUES), request)
 
-        serializer = PaymentSerializer(
-            sorted_payments, many=True, context={'request': request})
+            return Response({
+                "results": [serialize_payment(row) for row in page],
+                "next": next_cursor
+            })
+
+        # Sort the payments by date starting with the most recent
+        sorted_payments = payments.order_by('-date', '-id').values(*PAYMENT_VALUES)
 
-        return Response(serializer.data)
+        return Response([serialize_payment(row) for row in sorted_payments])
 
     def update(self, request, pk=None):
         """Handle PUT requests for payments
@@ -135,31 +118,18 @@ class Payments(ViewSet):
             Response -- Empty body with 204 status code
         """
         # landlord = authenticated user
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
         tenant = Tenant.objects.get(pk=request.data["full_name"])
         
         payment = Payment.objects.get(pk=pk)
 
-        # Splitting the datetime string on the T to save the date
-        date_string_list = request.data["date"].split('T')
-        date = date_string_list[0]
-        payment.date = date
-
-        # This field is looking for an integer.
-        # If the user includes a $, the string will
-        # split, be converted to an integer and saved
+        # Splitting the datetime string on the T to save the date.
+        # The amount field is looking for an integer, a $ is stripped
         try:
-            payment.amount = int(request.data["amount"])
-        except ValueError:
-            try:
-                amount_string_list = request.data["amount"].split('$')
-                float_amount = float(amount_string_list[1])
-                amount = int(float_amount)
-                payment.amount = amount
-            except IndexError:
-                float_amount = float(request.data["amount"])
-                amount = int(float_amount)
-                payment.amount = amount
+            payment.date = parse_date(request.data["date"])
+            payment.amount = parse_amount(request.data["amount"])
+        except RowError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
 
         payment.ref_num = request.data["ref_num"]
         payment.tenant = tenant
@@ -197,10 +167,247 @@ class Payments(ViewSet):
         except Exception as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(methods=['post', 'patch', 'delete'], detail=False)
+    def bulk(self, request):
+        """Handle POST requests importing many payments at once.
+        The body is CSV (text/csv) or one JSON object per line
+        (application/x-ndjson) with the same fields as create.
+
+        With `Prefer: respond-async` the body is imported by a
+        background job instead, answered with 202 and the job to poll.
+
+        PATCH takes a list of changes, each an id and the fields of
+        update to change. DELETE takes {"ids": [...]} or a list of ids
+        Returns:
+            Response -- Number of created, updated or deleted payments
+            and per-row errors
+        """
+        landlord = request.landlord
+
+        if request.method in ('PATCH', 'DELETE'):
+            try:
+                if request.method == 'PATCH':
+                    report = edit_payments(request.data, landlord)
+                else:
+                    report = delete_payments(body_ids(request.data), landlord)
+            except ValueError as ex:
+                return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(report)
+
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in ('text/csv', 'application/x-ndjson'):
+            return Response(
+                {"reason": "Send text/csv or application/x-ndjson"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        try:
+            batch_size = int(request.query_params.get('batch_size', settings.PAYMENT_IMPORT_BATCH_SIZE))
+        except ValueError:
+            batch_size = 0
+        if batch_size < 1:
+            return Response({"reason": "batch_size must be a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        if 'respond-async' in request.META.get('HTTP_PREFER', ''):
+            # Spool the body to disk for the worker, without holding it in memory
+            with tempfile.TemporaryFile() as body:
+                if request.stream is not None:
+                    shutil.copyfileobj(request.stream, body, 64 * 1024)
+                body.seek(0)
+                job = enqueue(
+                    'import_payments', {'content_type': content_type, 'batch_size': batch_size},
+                    landlord=landlord, input=File(body, name='payments.' + content_type.split('/')[-1].replace('x-', '')))
+            return accepted(job, request)
+
+        report = import_payments(
+            read_rows(request.stream, content_type), landlord, batch_size)
+
+        return Response(report, status=status.HTTP_201_CREATED)
+
+    @action(methods=['post'], detail=False)
+    def match(self, request):
+        """Handle POST requests proposing tenants and leases for every
+        deposit of a bank statement. The body is CSV (text/csv) or OFX
+        (application/x-ofx). Accepts `limit` candidates per line and a
+        `window` of days around the due date
+        Returns:
+            Response -- Scored candidates per statement line
+        """
+        landlord = request.landlord
+
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in STATEMENT_TYPES:
+            return Response(
+                {"reason": "Send text/csv or application/x-ofx"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        try:
+            limit = int(request.query_params.get('limit', 3))
+            window = max(1, int(request.query_params.get('window', 10)))
+        except ValueError:
+            return Response({"reason": "limit and window must be integers"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        text = request.body.decode('utf-8-sig', errors='replace')
+        try:
+            lines, errors = read_statement(text, content_type)
+        except RowError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "matches": match_statement(lines, landlord, limit, window),
+            "errors": errors,
+        })
+
+    @action(methods=['get'], detail=False, renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Handle GET requests streaming every matching payment
+        as `?format=csv` (default) or `?format=ndjson`
+        Returns:
+            StreamingHttpResponse -- One row per payment, most recent first
+        """
+        landlord = request.landlord
+        payments = filter_payments(request, Payment.objects.filter(landlord=landlord))
+
+        return stream_export(
+            payments.order_by('-date', '-id'), PAYMENT_COLUMNS,
+            request.accepted_renderer.format, 'payments')
+
+    @action(methods=['get'], detail=False)
+    @versioned('payments', 'tenants', 'paymenttypes')
+    def summary(self, request):
+        """Handle GET requests for payment totals grouped by
+        `?group=month,property,tenant,type` (any combination, none for
+        one grand total). Accepts the same keyword, date and tenant
+        filters as the list
+        Returns:
+            Response -- One array per column, one entry per group
+        """
+        landlord = request.landlord
+        payments = filter_payments(request, Payment.objects.filter(landlord=landlord))
+
+        groups = []
+        for name in request.query_params.get('group', '').split(','):
+            name = name.strip()
+            if not name or name in groups:
+                continue
+            if name not in SUMMARY_GROUPS:
+                return Response(
+                    {"reason": f"Unknown group {name}, use {', '.join(SUMMARY_GROUPS)}"},
+                    status=status.HTTP_400_BAD_REQUEST)
+            groups.append(name)
+        fields = [SUMMARY_GROUPS[name] for name in groups]
+
+        # One GROUP BY query, answered from the payment_summary index.
+        # COUNT(*) rather than COUNT(id) keeps the id column out of it
+        if 'month' in groups:
+            payments = payments.annotate(month=TruncMonth('date'))
+        if fields:
+            rows = (payments.values(*fields)
+                    .annotate(total=Sum('amount'), count=Count('*'))
+                    .order_by(*fields)
+                    .values_list(*fields, 'total', 'count'))
+        else:
+            totals = payments.aggregate(total=Sum('amount'), count=Count('*'))
+            rows = [(totals['total'] or 0, totals['count'])]
+
+        columns = groups + ['total', 'count']
+        data = {column: [] for column in columns}
+        for row in rows:
+            for column, value in zip(columns, row):
+                data[column].append(value)
+        if 'month' in data:
+            data['month'] = [month.isoformat()[:7] for month in data['month']]
+
+        return Response({"columns": columns, **data})
+
     # @action(methods=['post'], detail=True)
     # def daterange(self, request):
     #     """
 
+
+def filter_payments(request, payments):
+    """Apply the keyword, date and tenant query parameters
+    shared by the payment list, summary and export. Raises
+    ValidationError (400) for malformed dates and tenants
+    """
+    # Search keyword query parameter.
+    # Allows the user to search by ref_num or name
+    # using the same search input.
+    keyword = request.query_params.get('keyword', None)
+    if keyword is not None:
+        payments = payments.filter(
+            search_q(Payment, keyword) |
+            search_q(Tenant, keyword, fields=('full_name',), prefix='tenant__')
+        )
+
+    # Date range query parameter, `start/end`
+    date_range = request.query_params.get('date', None)
+    if date_range is not None:
+        try:
+            d1, d2 = (parse_date(day) for day in date_range.split('/'))
+        except (RowError, ValueError):
+            raise exceptions.ValidationError({'date': 'Must be YYYY-MM-DD/YYYY-MM-DD'})
+        payments = payments.filter(date__range=(d1, d2))
+
+    # Specific tenant query parameter
+    chosen_tenant = request.query_params.get('tenant', None)
+    if chosen_tenant is not None:
+        try:
+            chosen_tenant = int(chosen_tenant)
+        except ValueError:
+            raise exceptions.ValidationError({'tenant': 'Must be an integer'})
+        payments = payments.filter(tenant__id=chosen_tenant)
+
+    return payments
+
+
+# Statement formats accepted by Payments.match
+STATEMENT_TYPES = ('text/csv', 'application/x-ofx', 'application/ofx')
+
+
+# Dimensions accepted by Payments.summary and the column each groups on
+SUMMARY_GROUPS = {
+    'month': 'month',
+    'property': 'rented_property_id',
+    'tenant': 'tenant_id',
+    'type': 'payment_type_id',
+}
+
+
+# Columns read by the list and retrieve views. Everything comes
+# back in one joined query instead of per-row lazy fetches
+PAYMENT_VALUES = (
+    'id', 'date', 'amount', 'ref_num',
+    'tenant_id', 'tenant__phone_number', 'tenant__email',
+    'tenant__landlord_id', 'tenant__full_name',
+    'payment_type_id', 'payment_type__label',
+)
+
+
+def serialize_payment(row):
+    """Build the same JSON shape as PaymentSerializer from a
+    `values(*PAYMENT_VALUES)` row, without the serializer machinery
+    """
+    return {
+        "id": row['id'],
+        "date": row['date'].isoformat(),
+        "amount": row['amount'],
+        "ref_num": row['ref_num'],
+        "tenant": {
+            "id": row['tenant_id'],
+            "phone_number": row['tenant__phone_number'],
+            "email": row['tenant__email'],
+            "landlord": row['tenant__landlord_id'],
+            "full_name": row['tenant__full_name'],
+        },
+        "payment_type": {
+            "id": row['payment_type_id'],
+            "label": row['payment_type__label'],
+        },
+    }
+
+
 class TenantSerializer(serializers.ModelSerializer):
     """JSON serializer for tenants"""
     
@@ -5,11 +5,13 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import serializers
 from crosscheckapi.models import PaymentType
+from crosscheckapi.versions import versioned
 import json
 
 class PaymentTypes(ViewSet):
     """ Cross Check PaymentTypes """
 
+    @versioned('paymenttypes')
     def list(self, request):
         """Handle GET requests to payment_type resource
         Returns:
@@ -23,9 +25,11 @@ class PaymentTypes(ViewSet):
         for pt in payment_types:
             pt_obj[pt.id] = pt.label
 
-        pt_obj_string = json.dumps(pt_obj, separators=None)
+        # API version 1 clients expect the object as a JSON string
+        if request.version == '1':
+            return Response(json.dumps(pt_obj, separators=None))
 
-        return Response(pt_obj_string)
+        return Response(pt_obj)
 
 class PaymentTypeSerializer(serializers.ModelSerializer):
     """JSON serializer for payment_types"""
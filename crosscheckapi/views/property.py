@@ -9,7 +9,14 @@ from rest_framework.response import Response
 from rest_framework import serializers
 from datetime import date
 from datetime import datetime
-from crosscheckapi.models import Property, Tenant, Landlord, Payment, PaymentType, TenantPropertyRel
+from crosscheckapi.models import Property, Tenant, Payment, PaymentType, TenantPropertyRel
+from crosscheckapi.search import search
+from crosscheckapi.export import PROPERTY_COLUMNS, stream_export
+from crosscheckapi.renderers import CSVRenderer, NDJSONRenderer
+from crosscheckapi.versions import versioned
+from crosscheckapi.occupancy import portfolio, property_timeline
+from crosscheckapi.bulk import body_ids, delete_leases, edit_leases
+from crosscheckapi.purge import soft_delete
 
 
 class Properties(ViewSet):
@@ -21,7 +28,7 @@ class Properties(ViewSet):
             Response -- JSON serialized property instance
         """
         # landlord = authenticated user
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
 
         rental = Property()
         rental.street = request.data["street"]
@@ -45,43 +52,34 @@ class Properties(ViewSet):
         try:
             rental = Property.objects.get(pk=pk)
 
-            # Find the associated leases and attach them to the custom property `lease`
-            try:
-                leases = TenantPropertyRel.objects.filter(rented_property=pk)
+            # Find the associated leases and attach them as `lease`.
+            # The `active` flag is computed by the database from the lease date range
+            leases = TenantPropertyRel.objects.filter(
+                rented_property=pk
+            ).with_active().order_by('id').values(*LEASE_VALUES)
 
-                # Set the custom property `active` based on the lease date range
-                current_day = date.today()
-                for lease in leases:
-                    if current_day >= lease.lease_start and current_day <= lease.lease_end:
-                        lease.active = True
-                    else: 
-                        lease.active = False
-                rental.lease = leases
-
-            except TenantPropertyRel.DoesNotExist:
-                rental.lease = None
-
-            serializer = LeasedPropertySerializer(
+            serializer = PropertySerializer(
                 rental, context={'request': request})
-            return Response(serializer.data)
+            data = serializer.data
+            data['lease'] = [serialize_lease(row) for row in leases]
+
+            return Response(data)
         except Exception as ex:
             return HttpResponseServerError(ex, status=status.HTTP_404_NOT_FOUND)
 
+    @versioned('properties')
     def list(self, request):
         """Handle GET requests to property resource
         Returns:
             Response -- JSON serialized list of properties
         """
-        landlord = Landlord.objects.get(user=request.auth.user)
-        current_users_properties = Property.objects.filter(landlord=landlord)
+        landlord = request.landlord
+        current_users_properties = Property.objects.filter(landlord=landlord).order_by('id')
 
         search_term = self.request.query_params.get('search', None)
         if search_term is not None:
-            current_users_properties = current_users_properties.filter(street__icontains=search_term
-            ) | current_users_properties.filter(city__icontains=search_term
-            ) | current_users_properties.filter(state__icontains=search_term
-            ) | current_users_properties.filter(postal_code__icontains=search_term
-            )
+            # Matches street, city, state or postal_code through the search index
+            current_users_properties = search(current_users_properties, search_term)
 
         serializer = PropertySerializer(
             current_users_properties, many=True, context={'request': request})
@@ -94,7 +92,7 @@ class Properties(ViewSet):
             Response -- Empty body with 204 status code
         """
         # landlord = authenticated user
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
 
         rental = Property.objects.get(pk=pk)
         rental.street = request.data["street"]
@@ -114,7 +112,9 @@ class Properties(ViewSet):
         """
         try:
             rental = Property.objects.get(pk=pk)
-            rental.delete()
+            # Only flags the property. manage.py purge_deleted removes it
+            # with its leases and payments later
+            soft_delete(rental, request.landlord)
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -150,21 +150,153 @@ class Properties(ViewSet):
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=['patch', 'delete'], detail=False, url_path='leases/bulk')
+    def leases_bulk(self, request):
+        """Handle PATCH and DELETE requests for many leases at once.
+        PATCH takes a list of changes, each an id and any of lease_start,
+        lease_end, rent and tenant. DELETE takes {"ids": [...]} or a list of ids
+        Returns:
+            Response -- Number of updated or deleted leases and per-item errors
+        """
+        landlord = request.landlord
+        try:
+            if request.method == 'PATCH':
+                report = edit_leases(request.data, landlord)
+            else:
+                report = delete_leases(body_ids(request.data), landlord)
+        except ValueError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+    @action(methods=['get'], detail=False)
+    @versioned('properties', 'leases')
+    def occupancy(self, request):
+        """Handle GET requests for the occupancy of every property between
+        `start` and `end` (defaults to the current year) and the leases
+        active on `date` (defaults to today), all YYYY-MM-DD
+        Returns:
+            Response -- Occupied and vacant days, gaps and overlaps per property
+        """
+        landlord = request.landlord
+        try:
+            start, end = parse_range(request)
+            day = date.fromisoformat(request.query_params.get('date', date.today().isoformat()))
+        except ValueError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        properties = portfolio(landlord, start, end, day)
+        for row in properties:
+            row['gaps'] = serialize_spans(row['gaps'])
+
+        return Response({
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "date": day.isoformat(),
+            "occupied": sum(1 for row in properties if row['active_leases']),
+            "vacant": sum(1 for row in properties if not row['active_leases']),
+            "properties": properties,
+        })
+
+    @action(methods=['get'], detail=True)
+    @versioned('properties', 'leases')
+    def timeline(self, request, pk=None):
+        """Handle GET requests for the leases, vacancy gaps and overlapping
+        leases of one property between `start` and `end`
+        Returns:
+            Response -- Leases sorted by start date with gaps and overlaps
+        """
+        landlord = request.landlord
+        if not Property.objects.filter(pk=pk, landlord=landlord).exists():
+            return Response({'message': 'Property matching query does not exist.'},
+                status=status.HTTP_404_NOT_FOUND)
+        try:
+            start, end = parse_range(request)
+        except ValueError as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        timeline = property_timeline(pk, start, end)
+
+        return Response({
+            "id": int(pk),
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "occupied_days": timeline['occupied_days'],
+            "gaps": serialize_spans(timeline['gaps']),
+            "overlaps": timeline['overlaps'],
+            "leases": [{
+                "id": lease['id'],
+                "tenant": lease['tenant_id'],
+                "lease_start": lease['lease_start'].isoformat(),
+                "lease_end": lease['lease_end'].isoformat(),
+                "rent": lease['rent'],
+            } for lease in timeline['leases']],
+        })
+
+    @action(methods=['get'], detail=False, renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Handle GET requests streaming the landlord's properties
+        as `?format=csv` (default) or `?format=ndjson`
+        Returns:
+            StreamingHttpResponse -- One row per property
+        """
+        landlord = request.landlord
+        properties = Property.objects.filter(landlord=landlord)
 
-class LeaseSerializer(serializers.ModelSerializer):
-    """JSON serializer for leases"""
-    class Meta:
-        model = TenantPropertyRel
-        fields = ('id', 'lease_start', 'lease_end', 'rent', 'tenant', 'active')
-        depth = 2
+        search_term = request.query_params.get('search', None)
+        if search_term is not None:
+            properties = search(properties, search_term)
+
+        return stream_export(
+            properties.order_by('id'), PROPERTY_COLUMNS,
+            request.accepted_renderer.format, 'properties')
+
+
+# Columns read for the leases of a single property
+LEASE_VALUES = (
+    'id', 'lease_start', 'lease_end', 'rent', 'active',
+    'tenant_id', 'tenant__phone_number', 'tenant__email',
+    'tenant__full_name', 'tenant__landlord_id', 'tenant__landlord__user_id',
+)
+
+
+def parse_range(request):
+    """`start` and `end` query parameters (YYYY-MM-DD), both included.
+    Default to the current calendar year
+    """
+    today = date.today()
+    start = date.fromisoformat(request.query_params.get('start', f'{today.year}-01-01'))
+    end = date.fromisoformat(request.query_params.get('end', f'{today.year}-12-31'))
+    if end < start:
+        raise ValueError('end is before start')
+    return start, end
+
+
+def serialize_spans(spans):
+    return [[first.isoformat(), last.isoformat()] for first, last in spans]
+
+
+def serialize_lease(row):
+    """JSON for one lease of a property, with the tenant and landlord
+    nested as before, from a `values(*LEASE_VALUES)` row
+    """
+    return {
+        "id": row['id'],
+        "lease_start": row['lease_start'].isoformat(),
+        "lease_end": row['lease_end'].isoformat(),
+        "rent": row['rent'],
+        "tenant": {
+            "id": row['tenant_id'],
+            "phone_number": row['tenant__phone_number'],
+            "email": row['tenant__email'],
+            "full_name": row['tenant__full_name'],
+            "landlord": {
+                "id": row['tenant__landlord_id'],
+                "user": row['tenant__landlord__user_id'],
+            },
+        },
+        "active": row['active'],
+    }
 
-class LeasedPropertySerializer(serializers.ModelSerializer):
-    """JSON serializer for individual properties with the associated leases"""
-    lease = LeaseSerializer(many=True)
-    class Meta:
-        model = Property
-        fields = ('id', 'street', 'city', 
-        'state', 'postal_code', 'landlord', 'lease')
 
 class PropertySerializer(serializers.ModelSerializer):
     """JSON serializer for properties"""
@@ -0,0 +1,28 @@
+"""View module for incremental sync of the landlord's data"""
+from rest_framework import status
+from rest_framework.viewsets import ViewSet
+from rest_framework.response import Response
+from crosscheckapi.sync import CursorExpired, changes
+
+
+class Sync(ViewSet):
+    """Cross Check change feed"""
+
+    def list(self, request):
+        """Handle GET requests to the sync resource.
+        With `since`, the cursor of the previous sync, only the
+        tenants, properties, leases and payments changed since then and
+        the ids deleted since then. Without it every row. Rows are flat,
+        foreign keys are ids
+        Returns:
+            Response -- JSON object with the next cursor, the rows per
+            resource and the deleted ids per resource
+        """
+        try:
+            data = changes(request.landlord, request.query_params.get('since', None))
+        except ValueError:
+            return Response({"reason": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        except CursorExpired as ex:
+            return Response({"reason": str(ex)}, status=status.HTTP_410_GONE)
+
+        return Response(data)
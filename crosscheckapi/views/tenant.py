@@ -1,5 +1,4 @@
 """View module for handling requests about tenants"""
-from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.http import HttpResponseServerError
 from rest_framework import status
@@ -7,10 +6,63 @@ from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
-from crosscheckapi.models import Tenant, Landlord, TenantPropertyRel
+from collections import defaultdict
+from crosscheckapi.models import Tenant, TenantPropertyRel
+from crosscheckapi.search import search
+from crosscheckapi.export import TENANT_COLUMNS, stream_export
+from crosscheckapi.renderers import CSVRenderer, NDJSONRenderer
+from crosscheckapi.versions import versioned
+from crosscheckapi.purge import soft_delete
 import json
-from datetime import date
-from datetime import datetime
+
+
+# Columns read by the list and retrieve views
+TENANT_VALUES = ('id', 'phone_number', 'email', 'landlord_id', 'full_name')
+LEASE_VALUES = (
+    'id', 'tenant_id', 'lease_start', 'lease_end', 'rent', 'active',
+    'rented_property_id', 'rented_property__street', 'rented_property__city',
+    'rented_property__state', 'rented_property__postal_code',
+    'rented_property__landlord_id',
+)
+
+
+def serialize_tenants(tenants):
+    """Build the TenantSerializer JSON shape for every tenant in `tenants`
+    with two queries: one for the tenants and one for all of their
+    leases, properties and `active` flags
+    """
+    leases = defaultdict(list)
+    lease_rows = TenantPropertyRel.objects.filter(
+        tenant_id__in=tenants.values('id')
+    ).with_active().order_by('id').values(*LEASE_VALUES)
+
+    for row in lease_rows:
+        leases[row['tenant_id']].append({
+            "id": row['id'],
+            "lease_start": row['lease_start'].isoformat(),
+            "lease_end": row['lease_end'].isoformat(),
+            "rent": row['rent'],
+            "rented_property": {
+                "id": row['rented_property_id'],
+                "street": row['rented_property__street'],
+                "city": row['rented_property__city'],
+                "state": row['rented_property__state'],
+                "postal_code": row['rented_property__postal_code'],
+                "landlord": row['rented_property__landlord_id'],
+            },
+            "active": row['active'],
+        })
+
+    # If the tenant does not have a lease, null will be
+    # returned rather than an empty array
+    return [{
+        "id": row['id'],
+        "phone_number": row['phone_number'],
+        "email": row['email'],
+        "landlord": row['landlord_id'],
+        "full_name": row['full_name'],
+        "rented_property": leases.get(row['id']) or None,
+    } for row in tenants.values(*TENANT_VALUES)]
 
 class Tenants(ViewSet):
     """Cross Check tenants"""
@@ -20,7 +72,7 @@ class Tenants(ViewSet):
         Returns:
             Response -- JSON serialized tenant instance
         """
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
 
         tenant = Tenant()
         tenant.phone_number = request.data["phone_number"]
@@ -43,29 +95,11 @@ class Tenants(ViewSet):
         """
 
         try: 
-            tenant = Tenant.objects.get(pk=pk)
+            tenants = serialize_tenants(Tenant.objects.filter(pk=pk))
+            if not tenants:
+                raise Tenant.DoesNotExist('Tenant matching query does not exist.')
 
-            try:
-                rented_property = TenantPropertyRel.objects.filter(tenant=pk)
-                tenant.rented_property = rented_property
-            except TenantPropertyRel.DoesNotExist:
-                tenant.rented_property = None
-
-            # Check if the lease is active and add a custom property
-            current_day = date.today()
-            for rp in tenant.rented_property:
-                if current_day > rp.lease_start and current_day < rp.lease_end:
-                    rp.active = True
-                else: 
-                    rp.active = False         
-
-            # If the tenant does not have a lease, null will be
-            # returned rather than an empty array
-            if not tenant.rented_property:
-                    tenant.rented_property = None   
-
-            serializer = TenantSerializer(tenant, context={'request': request})
-            return Response(serializer.data)
+            return Response(tenants[0])
         except Exception as ex:
             return HttpResponseServerError(ex, status=status.HTTP_404_NOT_FOUND)
 
@@ -74,7 +108,7 @@ class Tenants(ViewSet):
         Returns:
             Response -- Empty body with 204 status code
         """
-        landlord = Landlord.objects.get(user=request.auth.user)
+        landlord = request.landlord
 
         tenant = Tenant.objects.get(pk=pk)
         tenant.phone_number = request.data["phone_number"]
@@ -92,7 +126,9 @@ class Tenants(ViewSet):
         """
         try:
             tenant = Tenant.objects.get(pk=pk)
-            tenant.delete()
+            # Only flags the tenant. manage.py purge_deleted removes it
+            # with its leases and payments later
+            soft_delete(tenant, request.landlord)
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -102,13 +138,14 @@ class Tenants(ViewSet):
         except Exception as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @versioned('tenants', 'leases', 'properties')
     def list(self, request):
         """Handle GET requests to tenants resource
         Returns:
             Response -- JSON serialized list of tenants
         """
-        landlord = Landlord.objects.get(user=request.auth.user)
-        current_users_tenants = Tenant.objects.filter(landlord=landlord)
+        landlord = request.landlord
+        current_users_tenants = Tenant.objects.filter(landlord=landlord).order_by('id')
 
         # The table on the front end requires an object where the
         # id's are keys and names are values
@@ -117,46 +154,40 @@ class Tenants(ViewSet):
             tenant_obj = {}
             for tenant in current_users_tenants:
                 tenant_obj[tenant.id] = tenant.full_name
-            
-            to_string = json.dumps(tenant_obj, separators=None)
 
-            return Response(to_string)
+            # API version 1 clients expect the object as a JSON string
+            if request.version == '1':
+                return Response(json.dumps(tenant_obj, separators=None))
+
+            return Response(tenant_obj)
 
         search_term = self.request.query_params.get('search', None)
         if search_term is not None:
-            current_users_tenants = current_users_tenants.filter(phone_number__icontains=search_term
-                ) | current_users_tenants.filter(email__icontains=search_term
-                ) | current_users_tenants.filter(full_name__icontains=search_term
-                ) 
+            # Matches phone_number, email or full_name through the search index
+            current_users_tenants = search(current_users_tenants, search_term)
+
+        # Connect rented properties to tenants through the relationship table.
+        # Leases, their properties and the `active` flag come back in
+        # one query no matter how many tenants there are
+        return Response(serialize_tenants(current_users_tenants))
+
+    @action(methods=['get'], detail=False, renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export(self, request):
+        """Handle GET requests streaming the landlord's tenants
+        as `?format=csv` (default) or `?format=ndjson`
+        Returns:
+            StreamingHttpResponse -- One row per tenant
+        """
+        landlord = request.landlord
+        tenants = Tenant.objects.filter(landlord=landlord)
 
-        # Connect rented properties to tenants through the relationship table
-        try:
-            for tenant in current_users_tenants:
-                lease = TenantPropertyRel.objects.filter(tenant=tenant)
-                tenant.rented_property = lease
-
-                # Check if the lease is active and add a custom property
-                current_day = date.today()
-                for rp in tenant.rented_property:
-                    if current_day > rp.lease_start and current_day < rp.lease_end:
-                        rp.active = True
-                    else: 
-                        rp.active = False
-
-        except TenantPropertyRel.DoesNotExist:
-            current_users_tenants.rented_property = None
-
-        # If the tenant does not have a lease, null will be 
-        # returned rather than an empty array
-        for tenant in current_users_tenants:
-            if not tenant.rented_property:
-                    tenant.rented_property = None
-        
-        serializer = TenantSerializer(
-            current_users_tenants, many=True, context={'request': request}
-        )
-        return Response(serializer.data)
+        search_term = request.query_params.get('search', None)
+        if search_term is not None:
+            tenants = search(tenants, search_term)
 
+        return stream_export(
+            tenants.order_by('id'), TENANT_COLUMNS,
+            request.accepted_renderer.format, 'tenants')
 
 
 class LeaseSerializer(serializers.ModelSerializer):
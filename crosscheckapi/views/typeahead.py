@@ -0,0 +1,32 @@
+"""View module for the search boxes' typeahead suggestions"""
+from django.conf import settings
+from rest_framework import status
+from rest_framework.viewsets import ViewSet
+from rest_framework.response import Response
+from crosscheckapi.typeahead import indexes
+
+
+class Typeahead(ViewSet):
+    """Cross Check typeahead"""
+
+    def list(self, request):
+        """Handle GET requests to the typeahead resource.
+        `q` is matched against the start of every word of tenant names
+        and property addresses, tenant emails and phone numbers.
+        `limit` caps the suggestions, TYPEAHEAD['LIMIT'] by default
+        Returns:
+            Response -- JSON list of [type, id, label], type being
+            "tenant" or "property"
+        """
+        options = settings.TYPEAHEAD
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(int(request.query_params.get('limit', options['LIMIT'])), options['MAX_LIMIT'])
+        except ValueError:
+            return Response({"reason": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Users without a landlord have nothing to look up
+        if request.landlord is None or not query.strip() or limit < 1:
+            return Response([])
+
+        return Response(indexes.lookup(request.landlord.id, query, limit))